@@ -0,0 +1,187 @@
+"""Speed limits for sending, so a transfer does not crowd out the rest of the network.
+
+Every transfer has a Throttle with its own limit, and all of them share
+the process-wide limit from the "speed_limit_mbps" setting, or from the
+"speed_limit_profiles" entry for the time of day:
+
+    "speed_limit_profiles": [{"from": "09:00", "to": "18:00", "mbps": 20}]
+
+Limits are in megabits per second, 0 meaning none. Changing the settings
+takes effect within SETTINGS_CHECK_INTERVAL, in running transfers too,
+whether written by this process (Preferences) or another (cli.py limit).
+With no limit in force, sending costs one clock read per chunk.
+"""
+import asyncio
+import datetime
+import os
+import threading
+import time
+from constant import config_file, get_config, logger, reload_config, subscribe_config
+
+# A bucket holds this many seconds' worth of its rate, so bursts stay short
+BURST_SECONDS = 0.05
+# Sends are cut into pieces no smaller than this while a limit is in force
+MIN_QUANTUM = 16 * 1024
+SETTINGS_CHECK_INTERVAL = 1.0
+
+
+def mbps_to_rate(mbps):
+    """Bytes per second for a limit in megabits per second; 0 for no limit."""
+    return max(0.0, float(mbps or 0)) * 1000 * 1000 / 8
+
+
+class TokenBucket:
+    """Bytes per second, taken by reservation: a sender asks for the delay before sending n bytes.
+
+    Safe to share between threads and event loops. A rate of 0 lets
+    everything through at once.
+    """
+
+    def __init__(self, rate=0.0):
+        self.lock = threading.Lock()
+        self.rate = 0.0
+        self.burst = 0.0
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            self.burst = max(rate * BURST_SECONDS, MIN_QUANTUM)
+            # A new limit applies from now on, not to what was sent before it
+            self.tokens = min(max(self.tokens, 0.0), self.burst)
+
+    def reserve(self, n):
+        """Seconds to wait before `n` more bytes may go out."""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+
+def _minutes(clock):
+    hours, minutes = clock.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def scheduled_limit(config, now=None):
+    """The limit in Mbit/s that `config` sets for the local time `now`."""
+    now = now or datetime.datetime.now()
+    minute = now.hour * 60 + now.minute
+    for profile in config.get("speed_limit_profiles") or []:
+        try:
+            start, end = _minutes(profile["from"]), _minutes(profile["to"])
+            mbps = profile["mbps"]
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Ignoring malformed speed limit profile %r", profile)
+            continue
+        # A profile may run past midnight, e.g. from 22:00 to 06:00
+        if start <= minute < end or (end <= start and (minute >= start or minute < end)):
+            return mbps
+    return config.get("speed_limit_mbps", 0)
+
+
+class _GlobalLimit:
+    """The process-wide bucket, kept in line with the settings and the clock."""
+
+    def __init__(self):
+        self.bucket = TokenBucket()
+        self.lock = threading.Lock()
+        self.next_check = 0.0
+        self.config_mtime = None
+        self.subscribed = False
+
+    def check(self, now):
+        with self.lock:
+            if now < self.next_check:
+                return
+            self.next_check = now + SETTINGS_CHECK_INTERVAL
+            if not self.subscribed:
+                subscribe_config(self.on_config_changed)
+                self.subscribed = True
+            try:
+                mtime = os.stat(config_file).st_mtime
+            except (OSError, TypeError):
+                mtime = None
+        if self.config_mtime is not None and mtime != self.config_mtime:
+            # Written by another process; our copy of the settings is stale
+            reload_config()
+        self.config_mtime = mtime
+        self.apply(get_config())
+
+    def on_config_changed(self, config, changed):
+        if changed & {"speed_limit_mbps", "speed_limit_profiles"}:
+            self.apply(config)
+
+    def apply(self, config):
+        rate = mbps_to_rate(scheduled_limit(config))
+        if rate != self.bucket.rate:
+            logger.info("Speed limit now %s", f"{rate * 8 / 1e6:g} Mbit/s" if rate else "off")
+            self.bucket.set_rate(rate)
+
+
+_global_limit = _GlobalLimit()
+
+
+class Throttle:
+    """Paces one transfer by its own limit and the process-wide one.
+
+    Senders check limited() per chunk and only then call wait() or
+    sendall(); the limit may be changed with set_limit() at any time.
+    """
+
+    def __init__(self, mbps=0):
+        self.bucket = TokenBucket(mbps_to_rate(mbps))
+
+    def set_limit(self, mbps):
+        self.bucket.set_rate(mbps_to_rate(mbps))
+
+    def limited(self):
+        _global_limit.check(time.monotonic())
+        return bool(self.bucket.rate or _global_limit.bucket.rate)
+
+    def chunk_size(self, size):
+        """`size` cut down to the pieces a limited sender should send at a time."""
+        rates = [rate for rate in (self.bucket.rate, _global_limit.bucket.rate) if rate]
+        return min(size, max(MIN_QUANTUM, int(min(rates, default=size) * BURST_SECONDS)))
+
+    def delay(self, n):
+        return max(self.bucket.reserve(n), _global_limit.bucket.reserve(n))
+
+    async def wait(self, n):
+        delay = self.delay(n)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def wait_blocking(self, n):
+        delay = self.delay(n)
+        if delay:
+            time.sleep(delay)
+
+    async def sendall(self, sock, data):
+        """loop.sock_sendall() at the pace of the limits."""
+        loop = asyncio.get_running_loop()
+        view = memoryview(data)
+        while view:
+            piece = view[:self.chunk_size(len(view))]
+            await self.wait(len(piece))
+            await loop.sock_sendall(sock, piece)
+            view = view[len(piece):]
+
+    def sendall_blocking(self, sock, data):
+        view = memoryview(data)
+        while view:
+            piece = view[:self.chunk_size(len(view))]
+            self.wait_blocking(len(piece))
+            sock.sendall(piece)
+            view = view[len(piece):]
@@ -0,0 +1,884 @@
+"""Throughput benchmarks for the DataDash transfer paths.
+
+Runs entirely over localhost and needs no GUI, e.g.
+
+    python benchmark.py sendfile --size 1024
+    python benchmark.py encryption --files 1000
+    python benchmark.py smallfiles --files 5000 --size 16
+    python benchmark.py discovery --senders 500
+    python benchmark.py receivers --senders 8 --size 16
+    python benchmark.py startup --budget 150
+    python benchmark.py integrity --size 512 --manifest 100000
+    python benchmark.py readahead --latency 2 --disk 200
+    python benchmark.py writebehind --disk 400
+    python benchmark.py compression --link 20
+    python benchmark.py pacing --limits 40 80 400
+    python benchmark.py priority --link 200 --size 256
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import transfer_io
+import crypt_handler
+
+
+def _drain(server, done):
+    conn, _ = server.accept()
+    buffer = bytearray(4 * 1024 * 1024)
+    with conn:
+        while conn.recv_into(buffer):
+            pass
+    done.set()
+
+
+def _make_file(directory, size_mb):
+    path = os.path.join(directory, 'payload.bin')
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return path
+
+
+def _legacy_send(sock, file_path):
+    # The loop FileSender.send_file used before transfer_io existed
+    file_size = os.path.getsize(file_path)
+    sent_size = 0
+    with open(file_path, 'rb') as f:
+        while sent_size < file_size:
+            data = f.read(4096)
+            sock.sendall(data)
+            sent_size += len(data)
+
+
+def _run_case(name, send, file_path):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    done = threading.Event()
+    threading.Thread(target=_drain, args=(server, done), daemon=True).start()
+
+    sock = socket.create_connection(server.getsockname())
+    size = os.path.getsize(file_path)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    send(sock, file_path)
+    cpu = time.process_time() - cpu_start
+    sock.close()
+    done.wait()
+    wall = time.perf_counter() - wall_start
+    server.close()
+
+    gigabytes = size / (1024 ** 3)
+    print(f"{name:<12} {size / wall / (1024 ** 2):>10.1f} MB/s {cpu / gigabytes:>10.3f} CPU s/GB")
+
+
+def _async_send(use_sendfile):
+    # send_file_data_async as the senders call it, with or without zero-copy
+    def send(sock, file_path):
+        has_sendfile = transfer_io.HAS_SENDFILE
+        transfer_io.HAS_SENDFILE = use_sendfile
+        sock.setblocking(False)
+        try:
+            asyncio.run(transfer_io.send_file_data_async(sock, file_path))
+        finally:
+            transfer_io.HAS_SENDFILE = has_sendfile
+    return send
+
+
+def bench_sendfile(args):
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = _make_file(directory, args.size)
+        print(f"Sending {args.size} MiB over localhost (CPU of the whole process, receiver included)")
+        _run_case('legacy-4k', _legacy_send, file_path)
+        _run_case('buffered', _async_send(False), file_path)
+        if transfer_io.HAS_SENDFILE:
+            _run_case('sendfile', _async_send(True), file_path)
+        else:
+            print("sendfile     not available on this platform")
+
+
+def _encrypt_all(files, session_for_file):
+    sealed = []
+    for data in files:
+        session = session_for_file()
+        sealed.append(b''.join(crypt_handler.encrypt_stream(io.BytesIO(data), session, len(data))))
+    return sealed
+
+
+def _decrypt_all(sealed, password):
+    keys = {}
+    for blob in sealed:
+        crypt_handler.decrypt_stream(io.BytesIO(blob), io.BytesIO(), password, len(blob), keys)
+
+
+def _timed(name, func, count, total_bytes):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {count / elapsed:>10.1f} files/s {total_bytes / elapsed / (1024 ** 2):>8.2f} MB/s")
+    return result
+
+
+def bench_encryption(args):
+    password = 'benchmark-password'
+    files = [os.urandom(args.size * 1024) for _ in range(args.files)]
+    total = args.files * args.size * 1024
+    print(f"{args.files} files of {args.size} KiB, encryption on")
+
+    # Before sessions every file ran its own PBKDF2 derivation on both ends
+    _timed('encrypt, key per file', lambda: _encrypt_all(
+        files, lambda: crypt_handler.EncryptionSession(password)), args.files, total)
+
+    session = crypt_handler.EncryptionSession(password)
+    sealed = _timed('encrypt, session key', lambda: _encrypt_all(files, lambda: session), args.files, total)
+
+    _timed('decrypt, session key', lambda: _decrypt_all(sealed, password), args.files, total)
+
+
+def _run_receiver(destination, settings=None):
+    import constant
+    import transfer_core
+
+    constant.logger.setLevel('INFO')
+    config = dict(constant.get_config(), save_to_directory=destination, **(settings or {}))
+    transfer_core.get_config = lambda: config
+    asyncio.run(transfer_core.Receiver('127.0.0.1').run())
+
+
+def _send_folder(folder, receiver_data, **settings):
+    # Real transfer_core Sender and Receiver over localhost, each in its own
+    # process so they do not share a GIL
+    import multiprocessing
+    import constant
+    import transfer_core
+
+    # Per-file debug logging to the console would otherwise dominate the timing
+    constant.logger.setLevel('INFO')
+    with tempfile.TemporaryDirectory() as destination:
+        config = dict(constant.get_config(), save_to_directory=destination, encryption=False, **settings)
+        transfer_core.get_config = lambda: config
+        receiver = multiprocessing.Process(target=_run_receiver, args=(destination, settings))
+        receiver.start()
+        time.sleep(0.5)
+        start = time.perf_counter()
+        asyncio.run(transfer_core.Sender('127.0.0.1', [folder], receiver_data=receiver_data).run())
+        receiver.join()
+        return time.perf_counter() - start
+
+
+def bench_smallfiles(args):
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, 'tree')
+        for i in range(args.files):
+            sub = os.path.join(folder, f'dir{i // 100}')
+            os.makedirs(sub, exist_ok=True)
+            with open(os.path.join(sub, f'file{i}.txt'), 'wb') as f:
+                f.write(os.urandom(args.size * 1024))
+        print(f"{args.files} files of {args.size} KiB in {args.files // 100 + 1} folders")
+        for name, receiver_data in (('legacy', {'device_type': 'python'}),
+                                    ('packed', {'device_type': 'python', 'protocols': [1]})):
+            elapsed = _send_folder(folder, receiver_data)
+            print(f"{name:<12} {args.files / elapsed:>10.1f} files/s {elapsed:>8.2f} s")
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _legacy_responder(port, reply_port, stopped):
+    # The loop ReceiveApp.listenForBroadcast ran before BroadcastResponder
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('', port))
+        s.settimeout(0.5)
+        while not stopped.is_set():
+            try:
+                message, address = s.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if message.decode() == 'DISCOVER':
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as response_socket:
+                    response_socket.sendto(b'RECEIVER:bench', (address[0], reply_port))
+            time.sleep(1)
+
+
+def _simulate_senders(count, port, reply_port, window, repeat=1):
+    """Every sender scans from its own 127.x address; returns reply latencies and the reply count."""
+    senders = []
+    with selectors.DefaultSelector() as selector:
+        for i in range(count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind((f'127.0.{1 + i // 250}.{1 + i % 250}', reply_port))
+            s.setblocking(False)
+            selector.register(s, selectors.EVENT_READ, i)
+            senders.append(s)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for s in senders:
+                s.sendto(b'DISCOVER', ('127.0.0.1', port))
+        latencies = {}
+        replies = 0
+        deadline = start + window
+        while time.perf_counter() < deadline:
+            for key, _ in selector.select(deadline - time.perf_counter()):
+                while True:
+                    try:
+                        key.fileobj.recvfrom(1024)
+                    except BlockingIOError:
+                        break
+                    replies += 1
+                    latencies.setdefault(key.data, time.perf_counter() - start)
+        for s in senders:
+            s.close()
+    return sorted(latencies.values()), replies
+
+
+def _report(name, count, latencies, replies):
+    answered = len(latencies)
+    p50 = latencies[answered // 2] * 1000 if latencies else float('nan')
+    p99 = latencies[min(answered - 1, answered * 99 // 100)] * 1000 if latencies else float('nan')
+    print(f"{name:<24} {answered:>5}/{count} answered {replies:>6} replies "
+          f"p50 {p50:>8.2f} ms p99 {p99:>8.2f} ms")
+    return answered, replies, p99
+
+
+def bench_discovery(args):
+    import discovery
+
+    print(f"{args.senders} simulated senders on localhost, {args.window:.0f} s scan window")
+    port, reply_port = _free_udp_port(), _free_udp_port()
+    stopped = threading.Event()
+    legacy = threading.Thread(target=_legacy_responder, args=(port, reply_port, stopped), daemon=True)
+    legacy.start()
+    time.sleep(0.2)
+    _report('sleep(1) loop', args.senders, *_simulate_senders(args.senders, port, reply_port, args.window))
+    stopped.set()
+    legacy.join()
+
+    port = _free_udp_port()
+    responder = discovery.BroadcastResponder('bench', port=port, reply_port=reply_port)
+    thread = threading.Thread(target=responder.run, daemon=True)
+    thread.start()
+    time.sleep(0.2)
+    answered, replies, p99 = _report('BroadcastResponder', args.senders,
+                                     *_simulate_senders(args.senders, port, reply_port, args.window))
+    failures = []
+    if answered < args.senders:
+        failures.append(f"{args.senders - answered} senders got no reply")
+    if p99 > args.budget:
+        failures.append(f"p99 reply latency {p99:.1f} ms, over the {args.budget:g} ms budget")
+    # Every sender repeats DISCOVER 10 times at once: the rate limit keeps it to one reply each
+    time.sleep(discovery.RESPONDER_MIN_INTERVAL)
+    _, replies, _ = _report('  10x burst per sender', args.senders,
+                            *_simulate_senders(args.senders, port, reply_port, args.window, repeat=10))
+    if replies > args.senders:
+        failures.append(f"{replies} replies to a burst from {args.senders} senders")
+    responder.pause()
+    _, replies, _ = _report('  paused', args.senders, *_simulate_senders(args.senders, port, reply_port, 0.5))
+    if replies:
+        failures.append(f"{replies} replies while paused")
+    responder.stop()
+    thread.join()
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+
+
+def _receive_many(destination, tokens, ready):
+    import constant
+    import receiver_server
+    import transfer_core
+
+    constant.logger.setLevel('WARNING')
+    config = dict(constant.get_config(), save_to_directory=destination)
+    transfer_core.get_config = lambda: config
+    server = receiver_server.ReceiverServer(max_senders=len(tokens)).start()
+    # Every sender is served by a task on this one event loop
+    receivers = [transfer_core.Receiver('127.0.0.1', listener=server.register('127.0.0.1', token))
+                 for token in tokens]
+
+    async def receive_all():
+        ready.set()
+        await asyncio.gather(*(receiver.run() for receiver in receivers))
+
+    asyncio.run(receive_all())
+    server.stop()
+
+
+def _send_as(token, path):
+    import constant
+    import discovery
+    import session
+    import transfer_core
+
+    constant.logger.setLevel('WARNING')
+    config = dict(constant.get_config(), encryption=False, parallel_streams=4)
+    transfer_core.get_config = lambda: config
+    session._sessions['127.0.0.1'] = session.DataSession('127.0.0.1', token)
+    receiver_data = dict(discovery.device_data(), streams=config['parallel_streams'])
+    asyncio.run(transfer_core.Sender('127.0.0.1', [path], receiver_data=receiver_data).run())
+
+
+def _serve_senders(files, concurrent):
+    # One receiver process serving every sender, each sender its own process
+    # as on separate machines; all of them send a file named payload.bin
+    import multiprocessing
+    import session
+
+    with tempfile.TemporaryDirectory() as destination:
+        tokens = [session.make_session_token() for _ in files]
+        ready = multiprocessing.Event()
+        receiver = multiprocessing.Process(target=_receive_many, args=(destination, tokens, ready))
+        receiver.start()
+        ready.wait()
+        senders = [multiprocessing.Process(target=_send_as, args=(token, path)) for token, path in zip(tokens, files)]
+        start = time.perf_counter()
+        for sender in senders:
+            sender.start()
+            if not concurrent:
+                sender.join()
+        for sender in senders:
+            sender.join()
+        receiver.join()
+        elapsed = time.perf_counter() - start
+        received = {_digest(os.path.join(destination, name)) for name in os.listdir(destination)}
+        return elapsed, received
+
+
+def _digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def bench_receivers(args):
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for i in range(args.senders):
+            os.makedirs(os.path.join(directory, str(i)))
+            files.append(_make_file(os.path.join(directory, str(i)), args.size))
+        expected = {_digest(path) for path in files}
+        total = args.senders * args.size
+        print(f"{args.senders} senders, {args.size} MiB each, all named payload.bin")
+        failures = []
+        for name, concurrent in (('one after another', False), ('concurrent', True)):
+            elapsed, received = _serve_senders(files, concurrent)
+            status = 'all intact' if received == expected else f'{len(received & expected)} intact'
+            print(f"{name:<20} {total / elapsed:>10.1f} MiB/s {elapsed:>8.2f} s  {status}")
+            if received != expected:
+                failures.append(f"{name}: {len(expected - received)} of {args.senders} files missing or damaged")
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+
+
+def bench_integrity(args):
+    from integrity import INTEGRITY_ALGORITHM, Manifest, hash_file
+
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, 'tree')
+        os.makedirs(os.path.join(folder, 'small'))
+        _make_file(folder, args.size)
+        for i in range(args.files):
+            with open(os.path.join(folder, 'small', f'file{i}.txt'), 'wb') as f:
+                f.write(os.urandom(16 * 1024))
+        total = args.size + args.files * 16 / 1024
+        start = time.perf_counter()
+        hash_file(os.path.join(folder, 'payload.bin'))
+        print(f"hash_file alone {args.size / (time.perf_counter() - start):>10.1f} MiB/s")
+        print(f"{args.size} MiB file and {args.files} files of 16 KiB")
+        for name, receiver_data in (('unverified', {'device_type': 'python', 'protocols': [1]}),
+                                    ('verified', {'device_type': 'python', 'protocols': [1],
+                                                  'integrity': INTEGRITY_ALGORITHM})):
+            elapsed = _send_folder(folder, receiver_data)
+            print(f"{name:<12} {total / elapsed:>10.1f} MiB/s {elapsed:>8.2f} s")
+
+    manifest = Manifest()
+    for i in range(args.manifest):
+        manifest.add(f'dir{i // 1000}/sub{i // 100 % 10}/file{i}.txt', hashlib.blake2b(str(i).encode(),
+                                                                                    digest_size=16).digest())
+    start = time.perf_counter()
+    nodes = manifest.nodes()
+    built = time.perf_counter() - start
+    theirs = dict(nodes, **{'dir7/sub3': '0' * 32, 'dir7': '0' * 32, '': '0' * 32})
+    start = time.perf_counter()
+    differing = Manifest.differing(nodes, theirs)
+    compared = time.perf_counter() - start
+    print(f"manifest of {args.manifest} files: {len(nodes)} nodes built in {built * 1000:.1f} ms, "
+          f"one changed file narrowed to {len(differing)} directories in {compared * 1000:.1f} ms")
+
+
+class _SlowFile:
+    """A file on an emulated network share: reads and writes take as long as at `rate` bytes/s."""
+
+    def __init__(self, f, rate):
+        self.f = f
+        self.rate = rate
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        time.sleep(len(data) / self.rate)
+        return data
+
+    def readinto(self, buffer):
+        n = self.f.readinto(buffer)
+        time.sleep(n / self.rate)
+        return n
+
+    def write(self, data):
+        n = self.f.write(data)
+        time.sleep(n / self.rate)
+        return n
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.f.close()
+
+
+def bench_readahead(args):
+    import transfer_core
+
+    def slow_open(path, mode='r', *open_args, **open_kwargs):
+        f = open(path, mode, *open_args, **open_kwargs)
+        if mode == 'rb':
+            time.sleep(args.latency / 1000)
+            return _SlowFile(f, args.disk * 1024 * 1024)
+        return f
+
+    # The sender reads through transfer_io; sendfile would bypass the emulated share
+    transfer_io.open = slow_open
+    transfer_io.HAS_SENDFILE = transfer_core.HAS_SENDFILE = False
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, 'tree')
+        os.makedirs(os.path.join(folder, 'small'))
+        for i in range(args.large):
+            os.makedirs(os.path.join(folder, f'large{i}'))
+            _make_file(os.path.join(folder, f'large{i}'), args.size)
+        for i in range(args.files):
+            with open(os.path.join(folder, 'small', f'file{i}.txt'), 'wb') as f:
+                f.write(os.urandom(16 * 1024))
+        total = args.large * args.size + args.files * 16 / 1024
+        print(f"{args.large} files of {args.size} MiB and {args.files} of 16 KiB on a share with "
+              f"{args.latency} ms per open and {args.disk} MiB/s")
+        receiver_data = {'device_type': 'python', 'protocols': [1]}
+        for name, read_ahead_mb in (('serial', 0), ('read-ahead', args.buffer)):
+            elapsed = _send_folder(folder, receiver_data, read_ahead_mb=read_ahead_mb, parallel_streams=1)
+            print(f"{name:<12} {total / elapsed:>10.1f} MiB/s {elapsed:>8.2f} s")
+
+
+def bench_writebehind(args):
+    import transfer_core
+
+    def slow_open(path, mode='r', *open_args, **open_kwargs):
+        f = open(path, mode, *open_args, **open_kwargs)
+        return _SlowFile(f, args.disk * 1024 * 1024) if mode in ('wb', 'r+b') else f
+
+    # The receiver writes through transfer_core; pwrite() would bypass the emulated drive
+    transfer_core.open = slow_open
+    transfer_io.HAS_PWRITE = False
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, 'tree')
+        for i in range(args.files):
+            os.makedirs(os.path.join(folder, f'large{i}'))
+            _make_file(os.path.join(folder, f'large{i}'), args.size)
+        total = args.files * args.size
+        print(f"{args.files} files of {args.size} MiB to a drive writing {args.disk} MiB/s")
+        receiver_data = {'device_type': 'python', 'protocols': [1]}
+        for name, write_behind_mb in (('direct', 0), ('write-behind', args.buffer)):
+            elapsed = _send_folder(folder, receiver_data, write_behind_mb=write_behind_mb, parallel_streams=1)
+            print(f"{name:<14} {total / elapsed:>10.1f} MiB/s {elapsed:>8.2f} s")
+
+
+def _throttle_link(rate):
+    # Every sock_sendall() of the process takes as long as on a link of `rate` bytes/s
+    from asyncio import selector_events
+    original = selector_events.BaseSelectorEventLoop.sock_sendall
+    free_at = [0.0]
+
+    async def sock_sendall(self, sock, data):
+        await original(self, sock, data)
+        now = time.perf_counter()
+        free_at[0] = max(free_at[0], now) + len(data) / rate
+        await asyncio.sleep(free_at[0] - now)
+
+    selector_events.BaseSelectorEventLoop.sock_sendall = sock_sendall
+
+
+def _write_log(path, size_mb):
+    # Log lines with varying fields: shrinks like a real log rather than like a repeated block
+    with open(path, 'w') as f:
+        written = line = 0
+        while written < size_mb * 1024 * 1024:
+            text = (f"2026-10-18 12:{line // 60 % 60:02d}:{line % 60:02d} INFO worker-{line % 17} "
+                    f"request={hashlib.md5(str(line).encode()).hexdigest()[:12]} status={200 + line % 7 * 50} "
+                    f"took={line * 7919 % 1000} ms path=/api/v1/items/{line % 997}\n")
+            f.write(text)
+            written += len(text)
+            line += 1
+
+
+def bench_compression(args):
+    import transfer_core
+
+    # The emulated link only paces sock_sendall(); sendfile would go around it
+    transfer_io.HAS_SENDFILE = transfer_core.HAS_SENDFILE = False
+    _throttle_link(args.link * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, 'tree')
+        os.makedirs(os.path.join(folder, 'logs'))
+        os.makedirs(os.path.join(folder, 'media'))
+        for i in range(args.files):
+            _write_log(os.path.join(folder, 'logs', f'server{i}.log'), args.size)
+        with open(os.path.join(folder, 'media', 'video.mp4'), 'wb') as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        with open(os.path.join(folder, 'media', 'unnamed.bin'), 'wb') as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        total = (args.files + 2) * args.size
+        print(f"{args.files} logs and 2 random files of {args.size} MiB over a {args.link} MiB/s link")
+        receiver_data = {'device_type': 'python', 'protocols': [1], 'compression': ['zlib']}
+        for name, compression in (('raw', False), ('compressed', True)):
+            elapsed = _send_folder(folder, receiver_data, compression=compression, parallel_streams=1)
+            print(f"{name:<12} {total / elapsed:>10.1f} MiB/s effective {elapsed:>8.2f} s")
+
+
+def _paced_receiver(server, arrivals):
+    # (seconds since the first byte, bytes so far) after every recv
+    conn, _ = server.accept()
+    buffer = bytearray(1024 * 1024)
+    received = 0
+    start = None
+    with conn:
+        while n := conn.recv_into(buffer):
+            now = time.perf_counter()
+            start = start or now
+            received += n
+            arrivals.append((now - start, received))
+
+
+def _paced_send(file_path, throttles, change=None):
+    """Send `file_path` once per throttle, all at the same time; the arrivals seen by each receiver.
+
+    `change` is (seconds, callable) to run that long after the start.
+    """
+    async def run():
+        loop = asyncio.get_running_loop()
+        if change:
+            loop.call_later(*change)
+        sends = []
+        for throttle, server in zip(throttles, servers):
+            sock = socket.create_connection(server.getsockname())
+            sock.setblocking(False)
+            sends.append((sock, transfer_io.send_file_data_async(sock, file_path, throttle=throttle)))
+        await asyncio.gather(*(send for _, send in sends))
+        for sock, _ in sends:
+            sock.close()
+
+    servers, receivers, arrivals = [], [], []
+    for _ in throttles:
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        servers.append(server)
+        arrivals.append([])
+        receivers.append(threading.Thread(target=_paced_receiver, args=(server, arrivals[-1]), daemon=True))
+        receivers[-1].start()
+    asyncio.run(run())
+    for receiver, server in zip(receivers, servers):
+        receiver.join()
+        server.close()
+    return arrivals
+
+
+def _rate_between(arrivals, start, end):
+    """Mbit/s a receiver saw from `start` to `end` seconds after its first byte.
+
+    The slope of bytes received over time, fitted by least squares, so a
+    send split over several recv calls at either end does not skew it.
+    """
+    inside = [(at, total) for at, total in arrivals if start <= at <= end]
+    mean_at = sum(at for at, _ in inside) / len(inside)
+    mean_total = sum(total for _, total in inside) / len(inside)
+    covariance = sum((at - mean_at) * (total - mean_total) for at, total in inside)
+    variance = sum((at - mean_at) ** 2 for at, _ in inside)
+    return covariance / max(variance, 1e-12) * 8 / 1e6
+
+
+def _pacing_row(name, wanted, measured):
+    print(f"{name:<28} {wanted:>8.1f} {measured:>10.1f} {(measured - wanted) / wanted * 100:>+8.2f}%")
+
+
+def bench_pacing(args):
+    import bandwidth
+
+    # The global limit comes from these settings instead of the config file
+    settings = {'speed_limit_mbps': 0}
+    bandwidth.get_config = lambda: settings
+    bandwidth.reload_config = lambda: None
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = _make_file(directory, args.size)
+        size = os.path.getsize(file_path)
+        print(f"{args.size} MiB sent over localhost; rates in Mbit/s as the receiver saw them, "
+              f"skipping the first {args.settle:g} s")
+        print(f"{'case':<28} {'limit':>8} {'achieved':>10} {'error':>9}")
+        for limit in args.limits:
+            # Long enough to measure, short enough not to wait on slow limits
+            count = min(size, int(limit * 1e6 / 8 * args.seconds))
+            arrivals, = _paced_send(_prefix(file_path, count), [bandwidth.Throttle(limit)])
+            _pacing_row("transfer limit", limit, _rate_between(arrivals, args.settle, arrivals[-1][0]))
+
+        low, high = args.limits[0], args.limits[1] if len(args.limits) > 1 else args.limits[0] * 2
+        throttle = bandwidth.Throttle(low)
+        half = args.seconds / 2
+        count = int((low + high) / 2 * 1e6 / 8 * args.seconds)
+        arrivals, = _paced_send(_prefix(file_path, min(size, count)), [throttle],
+                                change=(half, lambda: throttle.set_limit(high)))
+        _pacing_row("live change, before", low, _rate_between(arrivals, args.settle, half - 0.1))
+        _pacing_row("live change, after", high, _rate_between(arrivals, half + args.settle, arrivals[-1][0]))
+
+        settings['speed_limit_mbps'] = low
+        bandwidth._global_limit.next_check = 0.0
+        count = int(low / 2 * 1e6 / 8 * args.seconds)
+        both = _paced_send(_prefix(file_path, min(size, count)), [bandwidth.Throttle(), bandwidth.Throttle()])
+        end = min(arrivals[-1][0] for arrivals in both)
+        shared = sum(_rate_between(arrivals, args.settle, end) for arrivals in both)
+        _pacing_row("global limit, 2 transfers", low, shared)
+        settings['speed_limit_mbps'] = 0
+        bandwidth._global_limit.next_check = 0.0
+
+        print(f"no limit, {args.size} MiB, best of 3:")
+        for name, throttle in (('without throttle', None), ('throttle, no limit', bandwidth.Throttle())):
+            elapsed = []
+            for _ in range(3):
+                start = time.perf_counter()
+                _paced_send(file_path, [throttle])
+                elapsed.append(time.perf_counter() - start)
+            print(f"  {name:<26} {size * 8 / 1e6 / min(elapsed):>10.1f} Mbit/s")
+
+
+def _send_urgent(files, urgent, delay, interactive, link):
+    """Seconds from marking `urgent` as such until it was sent, and for the whole batch."""
+    import multiprocessing
+    import scheduling
+    import transfer_core
+
+    timings = {}
+
+    class Queue(scheduling.SendQueue):
+        def done(self, entry):
+            super().done(entry)
+            if entry.name == os.path.basename(urgent):
+                timings['urgent'] = time.perf_counter() - timings['marked']
+
+    async def mark(sender):
+        await asyncio.sleep(delay)
+        timings['marked'] = time.perf_counter()
+        sender.prioritize(os.path.basename(urgent), scheduling.URGENT)
+
+    async def run():
+        sender = transfer_core.Sender('127.0.0.1', files + [urgent], receiver_data=receiver_data,
+                                      speed_limit=link, queue=Queue(interactive=interactive))
+        marking = asyncio.ensure_future(mark(sender))
+        await sender.run()
+        await marking
+
+    receiver_data = {'device_type': 'python', 'protocols': [1]}
+    with tempfile.TemporaryDirectory() as destination:
+        receiver = multiprocessing.Process(target=_run_receiver, args=(destination, {'write_behind_mb': 16}))
+        receiver.start()
+        time.sleep(0.5)
+        start = time.perf_counter()
+        asyncio.run(run())
+        receiver.join()
+        return timings['urgent'], time.perf_counter() - start
+
+
+def bench_priority(args):
+    import constant
+    import transfer_core
+
+    constant.logger.setLevel('INFO')
+    config = dict(constant.get_config(), encryption=False, compression=False, parallel_streams=1)
+    transfer_core.get_config = lambda: config
+    with tempfile.TemporaryDirectory() as directory:
+        large = _make_file(directory, args.size)
+        urgent = os.path.join(directory, 'urgent.pdf')
+        with open(urgent, 'wb') as f:
+            f.write(os.urandom(args.urgent * 1024))
+        print(f"{args.size} MiB file, then a {args.urgent} KiB one marked urgent {args.delay:g} s in, "
+              f"over a {args.link:g} Mbit/s link")
+        for name, interactive in (('after the file', False), ('preempting', True)):
+            waited, total = _send_urgent([large], urgent, args.delay, interactive, args.link)
+            print(f"{name:<16} urgent file sent {waited:>7.2f} s after marking, batch {total:>7.2f} s")
+
+
+def _prefix(file_path, count):
+    """A file holding the first `count` bytes of `file_path`."""
+    path = f"{file_path}.{count}"
+    if not os.path.exists(path):
+        with open(file_path, 'rb') as source, open(path, 'wb') as f:
+            f.write(source.read(count))
+    return path
+
+
+# Only loaded once the window that needs them opens; importing main must not pull them in
+STARTUP_DEFERRED = ('requests', 'cryptography', 'netifaces', 'crypt_handler', 'preferences',
+                    'broadcast', 'file_receiver', 'file_sender', 'file_sender_java', 'file_sender_swift')
+# Builds the main window and paints it once, printing the seconds taken
+_FIRST_PAINT = """
+import time
+start = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+app = QApplication([])
+import main
+window = main.MainApp()
+window.show()
+app.processEvents()
+print(time.perf_counter() - start)
+"""
+
+
+def _python(*args):
+    environment = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'),
+                       DATADASH_CONSOLE_LOG='WARNING')
+    return subprocess.run([sys.executable, *args], cwd=os.path.dirname(os.path.abspath(__file__)),
+                          env=environment, capture_output=True, text=True, check=True)
+
+
+def _import_times():
+    """{module: cumulative microseconds} for main and everything it imports, from -X importtime."""
+    times = {}
+    for line in _python('-X', 'importtime', '-c', 'import main').stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative)
+        # A module is listed after everything it imported; a top level one ends a tree
+        if not name.startswith('  '):
+            if name.strip() == 'main':
+                return times
+            times = {}
+    raise RuntimeError("import main did not show up in -X importtime output")
+
+
+def bench_startup(args):
+    # Best of several runs, so the page cache and a busy machine skew less
+    runs = [_import_times() for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times['main'])
+    import_ms = best['main'] / 1000
+    paint_ms = min(float(_python('-c', _FIRST_PAINT).stdout) for _ in range(args.runs)) * 1000
+    print(f"import main       {import_ms:>8.1f} ms  (budget {args.budget:g} ms)")
+    print(f"first paint       {paint_ms:>8.1f} ms  (QApplication, import, MainApp, one event pass)")
+    print("slowest imports:")
+    for name, cumulative in sorted(best.items(), key=lambda item: -item[1])[1:args.top + 1]:
+        print(f"  {name:<30} {cumulative / 1000:>8.1f} ms")
+
+    eager = sorted(name for name in best if name.split('.')[0] in STARTUP_DEFERRED)
+    failures = []
+    if eager:
+        failures.append(f"imported at startup: {', '.join(eager)}")
+    if import_ms > args.budget:
+        failures.append(f"import main took {import_ms:.1f} ms, over the {args.budget:g} ms budget")
+    if failures:
+        sys.exit('FAIL: ' + '; '.join(failures))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sendfile_parser = subparsers.add_parser('sendfile', help='zero-copy vs buffered vs legacy send loop')
+    sendfile_parser.add_argument('--size', type=int, default=512, help='payload size in MiB')
+    sendfile_parser.set_defaults(func=bench_sendfile)
+
+    encryption_parser = subparsers.add_parser('encryption', help='many small encrypted files')
+    encryption_parser.add_argument('--files', type=int, default=200, help='number of files')
+    encryption_parser.add_argument('--size', type=int, default=16, help='file size in KiB')
+    encryption_parser.set_defaults(func=bench_encryption)
+
+    smallfiles_parser = subparsers.add_parser('smallfiles', help='folder of many small files, legacy vs packed')
+    smallfiles_parser.add_argument('--files', type=int, default=5000, help='number of files')
+    smallfiles_parser.add_argument('--size', type=int, default=16, help='file size in KiB')
+    smallfiles_parser.set_defaults(func=bench_smallfiles)
+
+    discovery_parser = subparsers.add_parser('discovery', help='DISCOVER replies to many simultaneous senders')
+    discovery_parser.add_argument('--senders', type=int, default=500, help='number of simulated senders')
+    discovery_parser.add_argument('--window', type=float, default=2.0, help='scan window in seconds')
+    discovery_parser.add_argument('--budget', type=float, default=100.0, help='allowed p99 reply latency in ms')
+    discovery_parser.set_defaults(func=bench_discovery)
+
+    receivers_parser = subparsers.add_parser('receivers', help='one receiver serving many senders at once')
+    receivers_parser.add_argument('--senders', type=int, default=8, help='number of sender processes')
+    receivers_parser.add_argument('--size', type=int, default=16, help='file size per sender in MiB')
+    receivers_parser.set_defaults(func=bench_receivers)
+
+    startup_parser = subparsers.add_parser('startup', help='import time of main.py, fails over budget')
+    startup_parser.add_argument('--budget', type=float, default=150.0, help='allowed ms for import main')
+    startup_parser.add_argument('--runs', type=int, default=5, help='runs to take the best of')
+    startup_parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    startup_parser.set_defaults(func=bench_startup)
+
+    integrity_parser = subparsers.add_parser('integrity', help='transfer with and without digests, manifest size')
+    integrity_parser.add_argument('--size', type=int, default=512, help='large file size in MiB')
+    integrity_parser.add_argument('--files', type=int, default=1000, help='number of 16 KiB files')
+    integrity_parser.add_argument('--manifest', type=int, default=100000, help='files in the manifest test')
+    integrity_parser.set_defaults(func=bench_integrity)
+
+    readahead_parser = subparsers.add_parser('readahead', help='sending from a slow share, with and without read-ahead')
+    readahead_parser.add_argument('--latency', type=float, default=2.0, help='emulated ms per open')
+    readahead_parser.add_argument('--disk', type=float, default=200.0, help='emulated read rate in MiB/s')
+    readahead_parser.add_argument('--large', type=int, default=2, help='number of large files')
+    readahead_parser.add_argument('--size', type=int, default=128, help='large file size in MiB')
+    readahead_parser.add_argument('--files', type=int, default=1000, help='number of 16 KiB files')
+    readahead_parser.add_argument('--buffer', type=int, default=16, help='read-ahead memory in MiB')
+    readahead_parser.set_defaults(func=bench_readahead)
+
+    writebehind_parser = subparsers.add_parser('writebehind', help='receiving to a slow drive, with and without write-behind')
+    writebehind_parser.add_argument('--disk', type=float, default=400.0, help='emulated write rate in MiB/s')
+    writebehind_parser.add_argument('--files', type=int, default=2, help='number of files')
+    writebehind_parser.add_argument('--size', type=int, default=128, help='file size in MiB')
+    writebehind_parser.add_argument('--buffer', type=int, default=16, help='write-behind memory in MiB')
+    writebehind_parser.set_defaults(func=bench_writebehind)
+
+    compression_parser = subparsers.add_parser('compression', help='text and media over a throttled link, raw vs compressed')
+    compression_parser.add_argument('--link', type=float, default=20.0, help='emulated link speed in MiB/s')
+    compression_parser.add_argument('--files', type=int, default=4, help='number of log files')
+    compression_parser.add_argument('--size', type=int, default=16, help='file size in MiB')
+    compression_parser.set_defaults(func=bench_compression)
+
+    pacing_parser = subparsers.add_parser('pacing', help='sending under speed limits, achieved rate vs limit')
+    pacing_parser.add_argument('--limits', type=float, nargs='+', default=[40.0, 80.0, 400.0],
+                               help='limits to test in Mbit/s; the first two are used for the live change')
+    pacing_parser.add_argument('--seconds', type=float, default=4.0, help='length of each limited transfer')
+    pacing_parser.add_argument('--settle', type=float, default=0.5, help='seconds left out at the start')
+    pacing_parser.add_argument('--size', type=int, default=256, help='file size in MiB')
+    pacing_parser.set_defaults(func=bench_pacing)
+
+    priority_parser = subparsers.add_parser('priority', help='an urgent file behind a large one, with and without preemption')
+    priority_parser.add_argument('--link', type=float, default=200.0, help='speed limit in Mbit/s')
+    priority_parser.add_argument('--size', type=int, default=256, help='large file size in MiB')
+    priority_parser.add_argument('--urgent', type=int, default=512, help='urgent file size in KiB')
+    priority_parser.add_argument('--delay', type=float, default=1.0, help='seconds before the file is marked urgent')
+    priority_parser.set_defaults(func=bench_priority)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,5 @@
 import sys
-import json
-import platform
 import socket
-import struct
 import math
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
@@ -10,11 +7,10 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import QThread, pyqtSignal, Qt, QPointF, QTimer, QSize
 from PyQt6.QtGui import QScreen, QColor, QLinearGradient, QPainter, QPen, QFont, QIcon, QKeySequence,QKeyEvent
-from constant import BROADCAST_PORT, LISTEN_PORT, logger, get_config, RECEIVER_JSON
-from file_sender import SendApp
-from file_sender_java import SendAppJava
-from file_sender_swift import SendAppSwift
-import netifaces
+from constant import logger, get_config
+from discovery import DiscoveryService
+from transfer_core import pair, submit
+
 
 class CircularDeviceButton(QWidget):
     def __init__(self, device_name, device_ip, parent=None):
@@ -79,6 +75,7 @@ class CircularDeviceButton(QWidget):
 
 class BroadcastWorker(QThread):
     device_detected = pyqtSignal(dict)
+    device_lost = pyqtSignal(dict)
     device_connected = pyqtSignal(str, str, dict)
     device_connected_java = pyqtSignal(str, str, dict)
     device_connected_swift = pyqtSignal(str, str, dict)
@@ -88,106 +85,28 @@ class BroadcastWorker(QThread):
         self.socket = None
         self.client_socket = None
         self.receiver_data = None
+        self.discovery = None
 
     def run(self):
-        # Start discovering receivers directly
-        self.discover_receivers()
-
-    def get_broadcast(self):
+        # Keeps announcing and tracking receivers until stop() is called
+        self.discovery = DiscoveryService(on_added=self.device_detected.emit, on_removed=self.device_lost.emit,
+                                          multicast=get_config().get('multicast_discovery', True))
+        self.discovery.run()
+
+    def refresh(self):
+        if self.discovery and self.isRunning():
+            self.discovery.refresh()
+        else:
+            self.start()
+
+    def connect_to_device(self, device_ip, device_name, device_info=None):
         try:
-            # Get all network interfaces
-            for interface in netifaces.interfaces():
-                # Skip loopback interface
-                if interface.startswith('lo'):
-                    continue
-                    
-                addrs = netifaces.ifaddresses(interface)
-                
-                # Check for IPv4 addresses
-                if netifaces.AF_INET in addrs:
-                    for addr in addrs[netifaces.AF_INET]:
-                        ip = addr['addr']
-                        # Skip loopback addresses
-                        if not ip.startswith('127.'):
-                            logger.info("Local IP determined: %s", ip)
-                            # Split IP and create broadcast
-                            ip_parts = ip.split('.')
-                            ip_parts[-1] = '255'
-                            broadcast_address = '.'.join(ip_parts)
-                            logger.info("Broadcast address determined: %s", broadcast_address)
-                            return broadcast_address
-
-            logger.error("No valid network interface found")
-            return "Unable to get IP"
-                            
-        except Exception as e:
-            logger.error("Error obtaining local IP: %s", e)
-            return "Unable to get IP"
-
-    def discover_receivers(self):
-        broadcast_address = self.get_broadcast()
-        if broadcast_address == "Unable to get IP":
-            return
-            
-        # Create new UDP socket
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # Bind to LISTEN_PORT to receive responses
-            s.bind(('', LISTEN_PORT))
-            logger.info("Sending discover packet to %s:%d", broadcast_address, BROADCAST_PORT)
-            
-            # Send discovery packet
-            s.sendto(b'DISCOVER', (broadcast_address, BROADCAST_PORT))
-            
-            # Listen for responses with timeout
-            s.settimeout(2)
-            try:
-                while True:
-                    message, address = s.recvfrom(1024)
-                    message = message.decode()
-                    logger.info("Received response from %s: %s", address[0], message)
-                    
-                    if message.startswith('RECEIVER:'):
-                        device_name = message.split(':')[1]
-                        device_info = {'ip': address[0], 'name': device_name}
-                        logger.info("Found device: %s", device_info)
-                        self.device_detected.emit(device_info)
-                        
-            except socket.timeout:
-                logger.info("Discovery timeout reached")
-            except Exception as e:
-                logger.error("Error during discovery: %s", str(e))
-
-    def connect_to_device(self, device_ip, device_name):
-        try:
-            if self.client_socket:
-                self.client_socket.shutdown(socket.SHUT_RDWR)  # Properly shutdown before closing
-                self.client_socket.close()
-            
-            # Create a new socket for connection
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.client_socket.connect((device_ip, RECEIVER_JSON))
-
-            device_data = {
-                'device_type': 'python',
-                'os': platform.system()
-            }
-            device_data_json = json.dumps(device_data)
-            self.client_socket.send(struct.pack('<Q', len(device_data_json)))
-            self.client_socket.send(device_data_json.encode())
+            self.receiver_data = submit(pair(device_ip, device_info)).result()
             #com.an.Datadash
 
-            receiver_json_size = struct.unpack('<Q', self.client_socket.recv(8))[0]
-            receiver_json = self.client_socket.recv(receiver_json_size).decode()
-            self.receiver_data = json.loads(receiver_json)
-
             device_type = self.receiver_data.get('device_type', 'unknown')
             if device_type == 'python':
                 self.device_connected.emit(device_ip, device_name, self.receiver_data)
-                self.client_socket.close()
             elif device_type == 'java':
                 self.device_connected_java.emit(device_ip, device_name, self.receiver_data)
             elif device_type == 'swift':
@@ -197,9 +116,6 @@ class BroadcastWorker(QThread):
 
         except Exception as e:
             QMessageBox.critical(None, "Connection Error", f"Failed to connect: {str(e)}")
-        finally:
-            if self.client_socket:
-                self.client_socket.close()  # Ensure the socket is always closed
 
     def closeEvent(self, event):
         # Ensure socket is forcefully closed
@@ -212,8 +128,13 @@ class BroadcastWorker(QThread):
                 logger.error(f"Error closing socket: {str(e)}")
         event.accept()  # Accept the window close event
 
+    def stop_discovery(self):
+        if self.discovery:
+            self.discovery.stop()
+
     def stop(self):
         # Method to manually stop the socket
+        self.stop_discovery()
         if self.client_socket:
             try:
                 self.client_socket.shutdown(socket.SHUT_RDWR)
@@ -236,6 +157,7 @@ class Broadcast(QWidget):
         self.devices = []
         self.broadcast_worker = BroadcastWorker()
         self.broadcast_worker.device_detected.connect(self.add_device)
+        self.broadcast_worker.device_lost.connect(self.remove_device)
         self.broadcast_worker.device_connected.connect(self.show_send_app)
         self.broadcast_worker.device_connected_java.connect(self.show_send_app_java)
         self.broadcast_worker.device_connected_swift.connect(self.show_send_app_swift)
@@ -342,16 +264,18 @@ class Broadcast(QWidget):
         self.update()
 
     def discover_devices(self):
-        self.devices.clear()
-        for child in self.device_area.children():
-            if isinstance(child, CircularDeviceButton):
-                child.deleteLater()
-        self.broadcast_worker.start()
+        # Discovery runs continuously; Refresh only re-announces right away
+        self.broadcast_worker.refresh()
 
     def add_device(self, device_info):
+        self.devices = [device for device in self.devices if device['ip'] != device_info['ip']]
         self.devices.append(device_info)
         self.update_devices()
 
+    def remove_device(self, device_info):
+        self.devices = [device for device in self.devices if device['ip'] != device_info['ip']]
+        self.update_devices()
+
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
@@ -446,10 +370,12 @@ class Broadcast(QWidget):
         confirm_dialog.exec()
 
         if confirm_dialog.clickedButton() == yes_button:
-            self.broadcast_worker.connect_to_device(device['ip'], device['name'])
+            self.broadcast_worker.connect_to_device(device['ip'], device['name'], device)
 
     def show_send_app(self, device_ip, device_name, receiver_data):
         self.hide()
+        self.broadcast_worker.stop_discovery()
+        from file_sender import SendApp
         self.send_app = SendApp(device_ip, device_name, receiver_data)
         self.send_app.show()
 
@@ -506,6 +432,8 @@ class Broadcast(QWidget):
                 msg_box.exec() 
         
         self.hide()
+        self.broadcast_worker.stop_discovery()
+        from file_sender_java import SendAppJava
         self.send_app_java = SendAppJava(device_ip, device_name, receiver_data)
         self.send_app_java.show()
         #com.an.Datadash
@@ -563,6 +491,8 @@ class Broadcast(QWidget):
                 msg_box.exec() 
         
         self.hide()
+        self.broadcast_worker.stop_discovery()
+        from file_sender_swift import SendAppSwift
         self.send_app_swift = SendAppSwift(device_ip, device_name, receiver_data)
         self.send_app_swift.show()
         #com.an.Datadash
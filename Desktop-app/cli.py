@@ -0,0 +1,399 @@
+"""Headless DataDash: send, receive and discover from the command line, without Qt.
+
+    python cli.py discover --timeout 3
+    python cli.py send 192.168.1.20 build/ artifacts.tar.gz
+    python cli.py send lab-07 nightly.zip --json
+    python cli.py send lab-07 project/ --sync
+    python cli.py send lab-07 videos/ --no-compress
+    python cli.py send lab-07 backups/ --limit 50
+    python cli.py send lab-07 shoot/ --order smallest --urgent 'contract*.pdf'
+    python cli.py limit 20 --profile 09:00-18:00=10
+    python cli.py receive --dest /srv/incoming
+    python cli.py receive --daemon --dest /srv/incoming --json
+
+`receive` exits after the first sender is done; with --daemon it keeps
+serving senders, several at once, until SIGINT or SIGTERM. With --json
+every event is one JSON object per line on stdout; otherwise a short
+human readable line is printed at most once a second. Logging goes to
+stderr at WARNING and above (DEBUG with --verbose) and to the log file.
+`limit` changes the speed limit of every sender on this machine,
+including transfers already running; without arguments it shows it.
+The password for encrypted transfers may be given in DATADASH_PASSWORD
+instead of on the command line.
+
+Exit codes: 0 success, 1 transfer failed, 2 bad usage,
+3 receiver not found or unreachable, 130 interrupted.
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from transfer_core import TransferEvents
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_UNREACHABLE = 3
+EXIT_INTERRUPTED = 130
+
+# Human readable progress is printed at most this often; --json gets every snapshot
+HUMAN_PROGRESS_INTERVAL = 1.0
+
+
+class Reporter(TransferEvents):
+    """Prints transfer events.
+
+    Everything runs on the event loop's thread except discovery callbacks,
+    so output is serialized with a lock shared by all reporters.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, json_output, peer=None, password=None):
+        self.json_output = json_output
+        self.peer = peer
+        self.password = password
+        self.batches = 0
+        self.failed = False
+        self.last_progress = float('-inf')
+        self.last_done = None
+        self.decrypting = []
+
+    def emit(self, event, **fields):
+        if self.peer:
+            fields = dict(peer=self.peer, **fields)
+        with self.lock:
+            if self.json_output:
+                print(json.dumps(dict(event=event, time=round(time.time(), 3), **fields)), flush=True)
+            else:
+                print(self.describe(event, fields), flush=True)
+
+    def describe(self, event, fields):
+        from progress import format_eta, format_rate
+        prefix = f"[{self.peer}] " if self.peer else ''
+        if event == 'progress':
+            return (f"{prefix}{fields['percent']:3d}%  {fields['files_done']}/{fields['total_files']} files  "
+                    f"{format_rate(fields['rate'])}  {format_eta(fields['eta'])} left  {fields['file_name']}")
+        if event == 'found':
+            return f"{fields['ip']:<15}  {fields['name']}  {fields.get('device_type', '')}".rstrip()
+        if event == 'error':
+            return f"{prefix}error: {fields['message']}"
+        details = '  '.join(f"{key}={value}" for key, value in fields.items() if key != 'peer')
+        return f"{prefix}{event}  {details}".rstrip()
+
+    def on_started(self):
+        self.emit('started')
+
+    def on_progress(self, snapshot):
+        now = time.monotonic()
+        if not self.json_output:
+            finished = snapshot['bytes_done'] >= snapshot['total_bytes']
+            if snapshot['bytes_done'] == self.last_done or (
+                    not finished and now - self.last_progress < HUMAN_PROGRESS_INTERVAL):
+                return
+        self.last_progress = now
+        self.last_done = snapshot['bytes_done']
+        self.emit('progress', **snapshot)
+
+    def on_finished(self, encrypted_files):
+        self.batches += 1
+        self.emit('finished', encrypted_files=encrypted_files)
+        if encrypted_files and self.password:
+            loop = asyncio.get_running_loop()
+            self.decrypting.append(loop.run_in_executor(None, self.decrypt, encrypted_files))
+
+    def on_error(self, title, message, details=''):
+        self.failed = True
+        self.emit('error', message=message, details=details)
+
+    def decrypt(self, encrypted_files):
+        from crypt_handler import decrypt_file
+        # Files of one transfer share a session key, derived once for all of them
+        keys = {}
+        for path in encrypted_files:
+            try:
+                decrypt_file(path, self.password, keys)
+            except Exception as e:
+                self.on_error("Decryption Error", f"Cannot decrypt {path}: {e}")
+                continue
+            os.remove(path)
+            self.emit('decrypted', file=path)
+
+    async def wait_decrypted(self):
+        if self.decrypting:
+            await asyncio.gather(*self.decrypting)
+
+
+def discover(timeout, reporter=None, name=None):
+    """Peers answering within `timeout` seconds; with `name`, stop at the first one of that name."""
+    from constant import get_config
+    from discovery import DiscoveryService
+    found = threading.Event()
+    peers = {}
+
+    def on_added(peer):
+        new = peer['ip'] not in peers
+        peers[peer['ip']] = peer
+        if reporter and new:
+            reporter.emit('found', **peer)
+        if name and peer['name'] == name:
+            found.set()
+
+    service = DiscoveryService(on_added=on_added, multicast=get_config().get("multicast_discovery", True))
+    thread = threading.Thread(target=service.run, daemon=True)
+    thread.start()
+    found.wait(timeout)
+    service.stop()
+    thread.join()
+    return list(peers.values())
+
+
+def run_discover(args):
+    reporter = Reporter(args.json)
+    peers = discover(args.timeout, reporter)
+    return EXIT_OK if peers else EXIT_UNREACHABLE
+
+
+def resolve_receiver(target, timeout, reporter):
+    """(ip, announcement) of `target`, an IP address or a device name looked up by discovery."""
+    try:
+        ipaddress.ip_address(target)
+        return target, None
+    except ValueError:
+        pass
+    for peer in discover(timeout, name=target):
+        if peer['name'] == target:
+            return peer['ip'], peer
+    reporter.emit('error', message=f"No receiver named {target} answered within {timeout:g} s")
+    return None, None
+
+
+async def send(args, reporter):
+    from constant import get_config
+    from scheduling import SendQueue
+    from session import close_session
+    from transfer_core import Sender, pair
+    ip_address, announcement = await asyncio.to_thread(resolve_receiver, args.receiver, args.timeout, reporter)
+    if ip_address is None:
+        return EXIT_UNREACHABLE
+    reporter.peer = ip_address
+    try:
+        receiver_data = await pair(ip_address, announcement)
+    except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        reporter.emit('error', message=f"Handshake with {ip_address} failed: {e or type(e).__name__}")
+        return EXIT_UNREACHABLE
+    if receiver_data.get('device_type') != 'python':
+        reporter.emit('error', message=f"{ip_address} is a {receiver_data.get('device_type')} device; "
+                                       "only desktop receivers are supported")
+        close_session(ip_address)
+        return EXIT_UNREACHABLE
+    # Nobody can reorder files once a command line transfer started, so large files need not be interruptible
+    queue = SendQueue(args.order or get_config().get("send_order", "listed"), urgent=args.urgent or (),
+                      interactive=False)
+    sender = Sender(ip_address, args.paths, password=args.password, receiver_data=receiver_data,
+                    events=reporter, encryption=bool(args.password), sync=args.sync or None,
+                    compress=False if args.no_compress else None, speed_limit=args.limit, queue=queue)
+    try:
+        sent = await sender.run()
+    finally:
+        close_session(ip_address)
+    if not sent:
+        if not reporter.failed:
+            reporter.emit('error', message=f"Transfer to {ip_address} failed")
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+async def receive(args, reporter):
+    from constant import get_config
+    from discovery import BroadcastResponder, device_data
+    from receiver_server import ReceiverServer
+    from transfer_core import HandshakeServer, Receiver
+
+    receivers = set()
+    results = []
+    first_done = asyncio.Event()
+
+    async def serve_sender(device_info, listener):
+        sender = Reporter(args.json, peer=listener.peer_ip, password=args.password)
+        sender.emit('connected', device_type=device_info['device_type'], os=device_info.get('os', 'unknown'))
+        try:
+            await Receiver(listener.peer_ip, listener=listener, events=sender,
+                           save_to_directory=args.dest).run()
+            await sender.wait_decrypted()
+        finally:
+            results.append(sender.batches > 0 and not sender.failed)
+            sender.emit('disconnected', batches=sender.batches)
+            first_done.set()
+
+    def on_paired(device_info, listener):
+        task = asyncio.ensure_future(serve_sender(device_info, listener))
+        receivers.add(task)
+        task.add_done_callback(receivers.discard)
+
+    config = get_config()
+    name = args.name or config["device_name"]
+    announcement = device_data if config.get("multicast_discovery", True) else None
+    responder = BroadcastResponder(name, announcement=announcement)
+    data_server = ReceiverServer().start()
+    handshakes = HandshakeServer(data_server, on_paired)
+    threading.Thread(target=responder.run, daemon=True).start()
+    server = asyncio.ensure_future(handshakes.serve())
+    reporter.emit('listening', name=name, dest=args.dest or config["save_to_directory"])
+    try:
+        if args.daemon:
+            await server
+            return EXIT_OK
+        waiting = asyncio.ensure_future(first_done.wait())
+        done, _ = await asyncio.wait({server, waiting}, timeout=args.timeout or None,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if server in done:
+            server.result()
+        if not done:
+            reporter.emit('error', message=f"No sender connected within {args.timeout:g} s")
+            return EXIT_UNREACHABLE
+        # Let anyone else who connected meanwhile finish too
+        if receivers:
+            await asyncio.wait(set(receivers))
+        return EXIT_OK if all(results) else EXIT_FAILED
+    except OSError as e:
+        reporter.emit('error', message=f"Cannot accept senders: {e}")
+        return EXIT_FAILED
+    finally:
+        for task in [server, *receivers]:
+            task.cancel()
+        await asyncio.gather(server, *receivers, return_exceptions=True)
+        responder.stop()
+        data_server.stop()
+
+
+def speed_profile(text):
+    """argparse type for --profile: "HH:MM-HH:MM=MBPS"."""
+    try:
+        hours, mbps = text.split('=')
+        start, end = hours.split('-')
+        for clock in (start, end):
+            hour, minute = clock.split(':')
+            if not (0 <= int(hour) < 24 and 0 <= int(minute) < 60):
+                raise ValueError(clock)
+        return {'from': start, 'to': end, 'mbps': float(mbps)}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected HH:MM-HH:MM=MBPS, got {text!r}")
+
+
+def run_limit(args):
+    from bandwidth import scheduled_limit
+    from constant import get_config, write_config
+    reporter = Reporter(args.json)
+    config = get_config()
+    changed = {}
+    if args.mbps is not None:
+        changed['speed_limit_mbps'] = args.mbps
+    if args.profile is not None or args.no_profiles:
+        changed['speed_limit_profiles'] = args.profile or []
+    if changed:
+        config.update(changed)
+        write_config(config)
+    reporter.emit('limit', mbps=config.get('speed_limit_mbps', 0), profiles=config.get('speed_limit_profiles', []),
+                  now=scheduled_limit(config))
+    return EXIT_OK
+
+
+async def run_until_signal(command, args, reporter):
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    if sys.platform != 'win32':
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, task.cancel)
+    try:
+        return await command(args, reporter)
+    except asyncio.CancelledError:
+        reporter.emit('stopped')
+        return EXIT_OK if getattr(args, 'daemon', False) else EXIT_INTERRUPTED
+
+
+def run_transfer(command):
+    def run(args):
+        reporter = Reporter(args.json)
+        try:
+            return asyncio.run(run_until_signal(command, args, reporter))
+        except KeyboardInterrupt:
+            return EXIT_INTERRUPTED
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='datadash', description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=__doc__.split('\n', 2)[2])
+    parser.add_argument('--json', action='store_true', help='one JSON object per event on stdout')
+    parser.add_argument('--verbose', action='store_true', help='log everything to stderr')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    discover_parser = subparsers.add_parser('discover', help='list receivers on the local network')
+    discover_parser.add_argument('--timeout', type=float, default=3.0, help='seconds to listen for replies')
+    discover_parser.set_defaults(func=run_discover)
+
+    send_parser = subparsers.add_parser('send', help='send files and folders to a receiver')
+    send_parser.add_argument('receiver', help='IP address or device name of the receiver')
+    send_parser.add_argument('paths', nargs='+', help='files or folders to send')
+    send_parser.add_argument('--password', default=os.environ.get('DATADASH_PASSWORD'),
+                             help='encrypt with this password')
+    send_parser.add_argument('--timeout', type=float, default=5.0,
+                             help='seconds to look for a receiver given by name')
+    send_parser.add_argument('--sync', action='store_true',
+                             help="update the receiver's copy of a folder, sending only what changed")
+    send_parser.add_argument('--no-compress', action='store_true',
+                             help='send every file as it is, even when compression is enabled')
+    send_parser.add_argument('--limit', type=float, metavar='MBPS',
+                             help='send no faster than this many megabits per second')
+    send_parser.add_argument('--order', choices=['listed', 'smallest'],
+                             help='send files as listed or smallest first (default: the send_order setting)')
+    send_parser.add_argument('--urgent', action='append', metavar='PATTERN',
+                             help='send files whose name matches this pattern before all others; repeatable')
+    send_parser.set_defaults(func=run_transfer(send))
+
+    receive_parser = subparsers.add_parser('receive', help='receive files from senders')
+    receive_parser.add_argument('--dest', help='save here instead of the configured directory')
+    receive_parser.add_argument('--name', help='device name to announce instead of the configured one')
+    receive_parser.add_argument('--password', default=os.environ.get('DATADASH_PASSWORD'),
+                                help='decrypt encrypted files with this password')
+    receive_parser.add_argument('--daemon', action='store_true', help='keep serving senders until stopped')
+    receive_parser.add_argument('--timeout', type=float, default=0,
+                                help='give up if no sender connects within this many seconds')
+    receive_parser.set_defaults(func=run_transfer(receive))
+
+    limit_parser = subparsers.add_parser('limit', help='show or set the speed limit for sending')
+    limit_parser.add_argument('mbps', type=float, nargs='?', help='megabits per second, 0 for no limit')
+    limit_parser.add_argument('--profile', type=speed_profile, action='append', metavar='HH:MM-HH:MM=MBPS',
+                              help='a different limit between these times; repeat for several, '
+                                   'replacing the ones set before')
+    limit_parser.add_argument('--no-profiles', action='store_true', help='remove the time of day limits')
+    limit_parser.set_defaults(func=run_limit)
+
+    # Global options are accepted after the command too
+    for subparser in (discover_parser, send_parser, receive_parser, limit_parser):
+        subparser.add_argument('--json', action='store_true', default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+        subparser.add_argument('--verbose', action='store_true', default=argparse.SUPPRESS, help=argparse.SUPPRESS)
+
+    args = parser.parse_args(argv)
+    if args.command == 'send':
+        missing = [path for path in args.paths if not os.path.exists(path)]
+        if missing:
+            parser.error(f"no such file or folder: {', '.join(missing)}")
+    if args.command == 'receive' and args.dest:
+        args.dest = os.path.abspath(args.dest)
+        os.makedirs(args.dest, exist_ok=True)
+    # Read by constant.py when it sets up logging, so before anything imports it
+    if args.verbose:
+        os.environ['DATADASH_CONSOLE_LOG'] = 'DEBUG'
+    else:
+        os.environ.setdefault('DATADASH_CONSOLE_LOG', 'WARNING')
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
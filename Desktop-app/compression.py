@@ -0,0 +1,202 @@
+"""Per-file compression on the wire, adapting to the data and the link.
+
+A compressed body is a series of blocks, each a header of method, stored
+length and raw length followed by the stored bytes. Before a file is
+sent, a sample of its first bytes is compressed; a file that barely
+shrinks is sent as it is, with sendfile. Otherwise the level follows,
+block by block, whichever side is slower: while the socket keeps the compressor waiting the level goes up,
+and when the compressor keeps the socket waiting it goes down, as far as
+sending raw. A step that does not raise the throughput is taken back.
+
+zlib is always available; zstd is used when the zstandard package is
+installed on both sides.
+"""
+import asyncio
+import os
+import struct
+import time
+import zlib
+from framing import ProtocolError
+from transfer_io import recv_exact_async
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Advertised as "compression" in the RECEIVER_JSON handshake, preferred first
+COMPRESSION_CODECS = ['zstd', 'zlib'] if zstandard else ['zlib']
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+SAMPLE_SIZE = 128 * 1024
+# Blocks larger than this are refused rather than allocated
+MAX_COMPRESSION_BLOCK_SIZE = 16 * 1024 * 1024
+# A sample that keeps more than this share of its size is not worth compressing
+WORTHWHILE_RATIO = 0.9
+# Levels the compressor moves between, fastest first
+LEVELS = {'zlib': (1, 3, 6), 'zstd': (1, 3, 9)}
+RAW_SETTING = -1
+# Blocks measured before each change of level, and windows to wait after a change that did not pay off
+ADAPT_WINDOW = 4
+HOLD_WINDOWS = 8
+# Contents that are already compressed; sampling them would only waste time
+COMPRESSED_EXTENSIONS = {
+    '.7z', '.aac', '.apk', '.avi', '.br', '.bz2', '.docx', '.flac', '.gif', '.gz', '.heic', '.jar', '.jpeg',
+    '.jpg', '.lz4', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.opus', '.png', '.pptx', '.rar', '.tgz',
+    '.webm', '.webp', '.xlsx', '.xz', '.zip', '.zst'
+}
+
+# method, stored length, raw length
+_BLOCK_HEADER = struct.Struct('<BII')
+METHOD_RAW = 0
+_METHODS = {'zlib': 1, 'zstd': 2}
+
+
+def negotiate_compression(peer_data):
+    """The first of our codecs the peer can decompress, or None."""
+    try:
+        theirs = set((peer_data or {}).get('compression', []))
+    except TypeError:
+        return None
+    return next((codec for codec in COMPRESSION_CODECS if codec in theirs), None)
+
+
+def is_compressed_format(file_path):
+    return os.path.splitext(file_path)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+def worth_compressing(file_path, offset=0):
+    """False for known compressed formats and for files whose sample at `offset` barely shrinks."""
+    if is_compressed_format(file_path):
+        return False
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        sample = f.read(SAMPLE_SIZE)
+    return len(zlib.compress(sample, 1)) <= len(sample) * WORTHWHILE_RATIO
+
+
+def _compress(codec, level, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def _decompress(method, data, raw_length):
+    if method == _METHODS['zstd'] and zstandard:
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=raw_length)
+    if method == _METHODS['zlib']:
+        decompressor = zlib.decompressobj()
+        raw = decompressor.decompress(data, raw_length)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ProtocolError("Compressed block is larger than announced")
+        return raw
+    raise ProtocolError(f"Unknown compression method {method}")
+
+
+class BlockCompressor:
+    """Turns `count` bytes of an open file into compressed blocks; `consumed` counts the raw bytes done.
+
+    blocks() is meant for send_chunks_async(), which asks for the next
+    block as soon as the socket took the last one: the time between those
+    requests is what one block costs, whichever side is the slower. Every
+    ADAPT_WINDOW blocks that cost decides the next setting.
+    """
+
+    def __init__(self, codec, block_size=COMPRESSION_BLOCK_SIZE):
+        self.codec = codec
+        self.block_size = block_size
+        self.levels = LEVELS[codec]
+        # Index into levels, RAW_SETTING to send blocks as they are
+        self.setting = 0
+        self.rates = {}
+        self.trial = None
+        self.hold = 0
+        self.consumed = 0
+        self.stored = 0
+
+    def blocks(self, f, offset, count):
+        f.seek(offset)
+        window_start = time.perf_counter()
+        window_raw = window_blocks = 0
+        window_busy = 0.0
+        while self.consumed < count:
+            raw = f.read(min(self.block_size, count - self.consumed))
+            if not raw:
+                raise ConnectionError("File ended before all data was sent.")
+            payload = raw
+            if self.setting != RAW_SETTING:
+                start = time.perf_counter()
+                payload = _compress(self.codec, self.levels[self.setting], raw)
+                window_busy += time.perf_counter() - start
+            if len(payload) < len(raw):
+                header = _BLOCK_HEADER.pack(_METHODS[self.codec], len(payload), len(raw))
+            else:
+                header = _BLOCK_HEADER.pack(METHOD_RAW, len(raw), len(raw))
+                payload = raw
+            self.consumed += len(raw)
+            self.stored += len(header) + len(payload)
+            yield header + payload
+            window_raw += len(raw)
+            window_blocks += 1
+            if window_blocks == ADAPT_WINDOW:
+                elapsed = max(time.perf_counter() - window_start, 1e-9)
+                self.adapt(window_raw / elapsed, window_busy / elapsed)
+                window_start = time.perf_counter()
+                window_raw = window_blocks = 0
+                window_busy = 0.0
+
+    def adapt(self, rate, load):
+        """Move one setting towards whichever side is slower; undo moves that lost throughput."""
+        self.rates[self.setting] = rate
+        if self.trial is not None:
+            if rate < self.rates.get(self.trial, 0):
+                self.setting = self.trial
+                self.hold = HOLD_WINDOWS
+            self.trial = None
+            return
+        if self.hold:
+            self.hold -= 1
+            return
+        if load > 0.8:
+            # The compressor keeps the socket waiting
+            target = self.setting - 1 if self.setting > 0 else RAW_SETTING
+        elif load < 0.5:
+            # The socket keeps the compressor waiting: shrinking more is free
+            target = 0 if self.setting == RAW_SETTING else self.setting + 1
+        else:
+            return
+        if target != self.setting and target < len(self.levels):
+            self.trial = self.setting
+            self.setting = target
+
+
+async def receive_compressed_async(sock, f, size, progress_callback=None, data_callback=None):
+    """Receive the blocks of a compressed body and write the `size` bytes they hold to `f`.
+
+    Blocks are decompressed on a worker thread; `progress_callback` and
+    `data_callback` see the raw data, as with receive_file_data_async().
+    """
+    received = 0
+    try:
+        while received < size:
+            method, stored, raw_length = _BLOCK_HEADER.unpack(await recv_exact_async(sock, _BLOCK_HEADER.size))
+            if (not raw_length or raw_length > min(MAX_COMPRESSION_BLOCK_SIZE, size - received)
+                    or stored > MAX_COMPRESSION_BLOCK_SIZE):
+                raise ProtocolError(f"Compressed block of {raw_length} bytes refused")
+            payload = await recv_exact_async(sock, stored)
+            if method == METHOD_RAW:
+                raw = payload
+            else:
+                raw = await asyncio.to_thread(_decompress, method, payload, raw_length)
+            if len(raw) != raw_length:
+                raise ProtocolError("Compressed block does not match its length")
+            if data_callback:
+                data_callback(raw)
+            f.write(raw)
+            received += raw_length
+            if progress_callback:
+                progress_callback(received)
+    finally:
+        if received < size:
+            f.flush()
+            f.truncate(f.tell())
+    return received
@@ -2,7 +2,8 @@ import json
 import platform
 import os
 import logging
-import socket
+import threading
+import weakref
 
 # Define the config file name and current version
 config_file_name = ".config.json"
@@ -45,7 +46,8 @@ file_handler.setFormatter(formatter)
 
 # Create a StreamHandler for console output
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+# The command line interface keeps stderr quiet unless asked otherwise
+console_handler.setLevel(os.environ.get('DATADASH_CONSOLE_LOG', 'DEBUG').upper())
 console_handler.setFormatter(formatter)
 
 # Add handlers to the logger
@@ -95,20 +97,85 @@ def get_default_path():
     logger.info("Default path determined: %s", file_path)
     return file_path
 
+# Parsed config files, loaded once per process and kept in sync by write_config()
+_config_cache = {}
+_config_lock = threading.RLock()
+_config_subscribers = []
+
+def subscribe_config(callback):
+    """Call `callback(config, changed_keys)` after every write_config() of the app config.
+
+    Callbacks run on the thread that wrote the config. Bound methods are held
+    weakly, so a window that subscribes does not outlive being closed.
+    """
+    if hasattr(callback, '__self__'):
+        ref = weakref.WeakMethod(callback)
+    else:
+        ref = lambda: callback
+    with _config_lock:
+        _config_subscribers.append(ref)
+
+def unsubscribe_config(callback):
+    with _config_lock:
+        _config_subscribers[:] = [ref for ref in _config_subscribers if ref() not in (None, callback)]
+
 def write_config(data, filename=config_file):
-    with open(filename, 'w') as file:
-        json.dump(data, file, indent=4)
+    import tempfile
+    # Write next to the target and rename over it, so readers never see a half-written file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.config-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, filename)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
     logger.info("Configuration written to %s", filename)
+    _replace_cached(filename, data)
 
-def get_config(filename=config_file):
+def reload_config(filename=config_file):
+    """Read the config again after another process (cli.py) wrote it, notifying subscribers of changes."""
     try:
         with open(filename, 'r') as file:
             data = json.load(file)
-        logger.info("Loaded configuration from %s", filename)
-        return data
-    except FileNotFoundError:
-        logger.warning("Configuration file %s not found. Returning empty config.", filename)
-        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Could not reload configuration from %s: %s", filename, e)
+        return
+    _replace_cached(filename, data)
+
+def _replace_cached(filename, data):
+    with _config_lock:
+        previous = _config_cache.get(filename, {})
+        _config_cache[filename] = dict(data)
+        changed = {key for key in set(previous) | set(data) if previous.get(key) != data.get(key)}
+        subscribers = [ref() for ref in _config_subscribers] if filename == config_file else []
+    if not changed:
+        return
+    for callback in subscribers:
+        if callback is None:
+            continue
+        try:
+            callback(dict(data), changed)
+        except Exception as e:
+            logger.error("Config subscriber %r failed: %s", callback, e)
+
+def get_config(filename=config_file):
+    """The parsed config; read from disk only the first time. Returns a copy the caller may modify."""
+    with _config_lock:
+        if filename not in _config_cache:
+            try:
+                with open(filename, 'r') as file:
+                    _config_cache[filename] = json.load(file)
+                logger.info("Loaded configuration from %s", filename)
+            except FileNotFoundError:
+                logger.warning("Configuration file %s not found. Returning empty config.", filename)
+                return {}
+        return dict(_config_cache[filename])
 
 if not os.path.exists(config_file):
     file_path = get_default_path()
@@ -123,7 +190,16 @@ if not os.path.exists(config_file):
         "swift_encryption": False,
         "show_warning": True,
         "check_update": True,
-        "update_channel": "stable"
+        "update_channel": "stable",
+        "parallel_streams": 4,
+        "multicast_discovery": True,
+        "sync_folders": False,
+        "read_ahead_mb": 16,
+        "write_behind_mb": 16,
+        "compression": True,
+        "speed_limit_mbps": 0,
+        "speed_limit_profiles": [],
+        "send_order": "listed"
     }
 
     write_config(default_config, config_file)
@@ -141,6 +217,15 @@ else:
         encryption = config_data.get("encryption", False)
         channel = config_data.get("update_channel", "stable")
         warnings = config_data.get("show_warning", True)
+        parallel_streams = config_data.get("parallel_streams", 4)
+        multicast_discovery = config_data.get("multicast_discovery", True)
+        sync_folders = config_data.get("sync_folders", False)
+        read_ahead_mb = config_data.get("read_ahead_mb", 16)
+        write_behind_mb = config_data.get("write_behind_mb", 16)
+        compression = config_data.get("compression", True)
+        speed_limit_mbps = config_data.get("speed_limit_mbps", 0)
+        speed_limit_profiles = config_data.get("speed_limit_profiles", [])
+        send_order = config_data.get("send_order", "listed")
 
         default_config = {
             "version": current_version,
@@ -152,7 +237,16 @@ else:
             "swift_encryption": False,
             "show_warning": warnings,
             "check_update": True,
-            "update_channel": channel
+            "update_channel": channel,
+            "parallel_streams": parallel_streams,
+            "multicast_discovery": multicast_discovery,
+            "sync_folders": sync_folders,
+            "read_ahead_mb": read_ahead_mb,
+            "write_behind_mb": write_behind_mb,
+            "compression": compression,
+            "speed_limit_mbps": speed_limit_mbps,
+            "speed_limit_profiles": speed_limit_profiles,
+            "send_order": send_order
         }
 
         write_config(default_config, config_file)
@@ -164,6 +258,8 @@ LISTEN_PORT = 49186
 SENDER_DATA = 57000
 RECEIVER_JSON = 54314
 RECEIVER_DATA = 57341  
+# Organization-local group for the optional multicast discovery, next to the broadcast ports
+MULTICAST_GROUP = "239.255.49.185"
 
 logger.info("Broadcast port: %d, Listen port: %d", BROADCAST_PORT, LISTEN_PORT)
 #com.an.Datadash
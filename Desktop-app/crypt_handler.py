@@ -1,16 +1,12 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import padding
 import os
-import base64
-import sys
-from constant import logger
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLineEdit, QDialog, QLabel, QGridLayout, QPushButton, QApplication, QSpacerItem, QSizePolicy, QMessageBox
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QFont, QColor, QScreen
-from PyQt6.QtWidgets import QGraphicsDropShadowEffect
+import struct
 
 def derive_key(key: str, salt: bytes) -> bytes:
     """Derive a key using PBKDF2HMAC."""
@@ -23,45 +19,134 @@ def derive_key(key: str, salt: bytes) -> bytes:
     )
     return kdf.derive(key.encode())
 
-def encrypt_file(filepath: str, key: str):
-    salt = os.urandom(16)
-    derived_key = derive_key(key, salt)
-
-    with open(filepath, 'rb') as f:
-        data = f.read()
-
-    padder = padding.PKCS7(128).padder()
-    padded_data = padder.update(data) + padder.finalize()
-    #com.an.Datadash
-
-    iv = os.urandom(16)
-    cipher = Cipher(algorithms.AES(derived_key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
-
-    with open(filepath + '.crypt', 'wb') as f:
-        f.write(salt + iv + encrypted_data)
-
-    return filepath + '.crypt'
-
-def decrypt_file(filepath: str, key: str):
-    with open(filepath, 'rb') as f:
-        data = f.read()
-
+def derive_key_once(key: str, salt: bytes, keys: dict = None) -> bytes:
+    """derive_key(), reusing the result for (`salt`, `key`) from `keys` when given.
+
+    Files of one transfer share a session salt, so a caller decrypting a
+    batch passes the same dict for all of them and pays for PBKDF2 once.
+    The dict is the caller's, and goes away with it.
+    """
+    if keys is None:
+        return derive_key(key, salt)
+    if (salt, key) not in keys:
+        keys[salt, key] = derive_key(key, salt)
+    return keys[salt, key]
+
+def derive_file_key(master_key: bytes, file_salt: bytes) -> bytes:
+    """Cheap per-file subkey of a session master key (HKDF-SHA256)."""
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=file_salt,
+        info=b'DataDash file key',
+        backend=default_backend()
+    )
+    return hkdf.derive(master_key)
+
+class EncryptionSession:
+    """Master key for one transfer.
+
+    PBKDF2 runs once when the session is created; each file then gets a
+    fresh random salt and its own HKDF subkey, so no two files share a key.
+    """
+
+    def __init__(self, password: str, salt: bytes = None):
+        self.salt = salt or os.urandom(16)
+        self.master_key = derive_key(password, self.salt)
+
+    def file_cipher(self, file_salt: bytes) -> AESGCM:
+        return AESGCM(derive_file_key(self.master_key, file_salt))
+
+# Streaming format: a header followed by independently authenticated AES-GCM
+# chunks, so neither side ever holds more than one chunk in memory.
+#   header: magic | chunk size (<I) | session salt (16) | file salt (16) | nonce prefix (7)
+#   chunk:  ciphertext of up to `chunk size` bytes + 16 byte GCM tag
+# The session salt feeds PBKDF2 (once per transfer), the file salt the
+# per-file HKDF subkey. The nonce of each chunk is prefix | counter (>I) |
+# last-chunk flag, which makes reordering, truncation and chunk splicing
+# fail authentication.
+STREAM_MAGIC = b'DDS1'
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_TAG_SIZE = 16
+_STREAM_HEADER = struct.Struct('<4sI16s16s7s')
+STREAM_HEADER_SIZE = _STREAM_HEADER.size
+
+
+def _chunk_nonce(prefix: bytes, counter: int, final: bool) -> bytes:
+    return prefix + struct.pack('>IB', counter, 1 if final else 0)
+
+
+def encrypted_size(plain_size: int, chunk_size: int = STREAM_CHUNK_SIZE) -> int:
+    """Size on the wire of a `plain_size` byte file in the streaming format."""
+    chunks = max(1, -(-plain_size // chunk_size))
+    return STREAM_HEADER_SIZE + plain_size + chunks * STREAM_TAG_SIZE
+
+
+def encrypt_stream(f, session: EncryptionSession, size: int, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield the header and then each encrypted chunk of `size` bytes read from `f`."""
+    file_salt = os.urandom(16)
+    prefix = os.urandom(7)
+    header = _STREAM_HEADER.pack(STREAM_MAGIC, chunk_size, session.salt, file_salt, prefix)
+    aead = session.file_cipher(file_salt)
+    yield header
+
+    counter = 0
+    remaining = size
+    while True:
+        data = f.read(min(chunk_size, remaining))
+        if len(data) < min(chunk_size, remaining):
+            raise ValueError("File changed size while it was being encrypted.")
+        remaining -= len(data)
+        final = remaining == 0
+        yield aead.encrypt(_chunk_nonce(prefix, counter, final), data, header)
+        if final:
+            break
+        counter += 1
+
+
+def decrypt_stream(src, dst, key: str, size: int, keys: dict = None):
+    """Decrypt `size` bytes of streaming format read from `src` into `dst`, one chunk at a time.
+
+    `keys` is as for derive_key_once().
+    """
+    header = src.read(STREAM_HEADER_SIZE)
+    if len(header) < STREAM_HEADER_SIZE:
+        raise ValueError("Encrypted data is truncated.")
+    magic, chunk_size, session_salt, file_salt, prefix = _STREAM_HEADER.unpack(header)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a DataDash encrypted stream.")
+    aead = AESGCM(derive_file_key(derive_key_once(key, session_salt, keys), file_salt))
+
+    counter = 0
+    remaining = size - STREAM_HEADER_SIZE
+    while True:
+        block = src.read(min(chunk_size + STREAM_TAG_SIZE, remaining))
+        if len(block) < STREAM_TAG_SIZE:
+            raise ValueError("Encrypted data is truncated.")
+        remaining -= len(block)
+        final = remaining == 0
+        dst.write(aead.decrypt(_chunk_nonce(prefix, counter, final), block, header))
+        if final:
+            break
+        counter += 1
+
+
+def _decrypt_legacy(data: bytes, key: str, keys: dict = None) -> bytes:
+    # Whole-file AES-CBC format written by DataDash before the streaming format
     salt = data[:16]
     iv = data[16:32]
     encrypted_data = data[32:]
-    #com.an.Datadash
 
-    derived_key = derive_key(key, salt)
+    derived_key = derive_key_once(key, salt, keys)
 
     cipher = Cipher(algorithms.AES(derived_key), modes.CBC(iv), backend=default_backend())
     decryptor = cipher.decryptor()
     padded_data = decryptor.update(encrypted_data) + decryptor.finalize()
 
     unpadder = padding.PKCS7(128).unpadder()
-    decrypted_data = unpadder.update(padded_data) + unpadder.finalize()
+    return unpadder.update(padded_data) + unpadder.finalize()
 
+def decrypt_file(filepath: str, key: str, keys: dict = None):
     # Get the directory of the encrypted file
     directory = os.path.dirname(filepath)
     # Prepare the file name without the ".crypt" extension
@@ -77,359 +162,20 @@ def decrypt_file(filepath: str, key: str):
 
     # Use the updated file_name to save the decrypted file
     output_file_path = os.path.join(directory, file_name)
-    with open(output_file_path, 'wb') as f:
-        f.write(decrypted_data)
-
-
-class Decryptor(QWidget):
-    def __init__(self, file_list):
-        super().__init__()
-        self.initUI()
-        self.encrypted_files = file_list
-        self.pass_attempts = 3
-        self.setFixedSize(400, 200)
-        self.set_background()
-        self.center_window()
-
-    def initUI(self):
-        self.setWindowTitle('Decryptor')
-        self.setGeometry(100, 100, 400, 200)  # Reduced window size
-        
-        layout = QVBoxLayout()
-        layout.setSpacing(0)  # Reduced spacing between elements
-        layout.setContentsMargins(30, 20, 30, 20)  # Reduced margins
-        
-        self.password_label = QLabel('Decryption Password:', self)
-        self.style_label(self.password_label)
-        layout.addWidget(self.password_label)
-        #com.an.Datadash
-
-         # Add a spacer to remove the gap between the label and the input box
-        spacer = QSpacerItem(0, 0, QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Fixed)
-        layout.addItem(spacer)
-
-        self.password_input = QLineEdit(self)
-        self.password_input.setEchoMode(QLineEdit.EchoMode.Password)
-        self.style_input(self.password_input)
-        layout.addWidget(self.password_input)
-        
-        self.submit_button = QPushButton('Submit', self)
-        self.style_button(self.submit_button)
-        layout.addWidget(self.submit_button, alignment=Qt.AlignmentFlag.AlignCenter)
-        
-        self.submit_button.clicked.connect(self.decrypt_all_files)
-        self.setLayout(layout)
-
-
-    def decrypt_all_files(self, pass_attempts = 3):
-        password = self.password_input.text()
-        if not password:
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("Input Error")
-                msg_box.setText("Please Enter a Password.")
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                # Apply custom style with gradient background
-                msg_box.setStyleSheet("""
-                    QMessageBox {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 1,
-                            stop: 0 #b0b0b0,
-                            stop: 1 #505050
-                        );
-                        color: #FFFFFF;
-                        font-size: 16px;
-                    }
-                    QLabel {
-                    background-color: transparent; /* Make the label background transparent */
-                    }
-                    QPushButton {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(47, 54, 66, 255),
-                            stop: 1 rgba(75, 85, 98, 255)
-                        );
-                        color: white;
-                        border-radius: 10px;
-                        border: 1px solid rgba(0, 0, 0, 0.5);
-                        padding: 4px;
-                        font-size: 16px;
-                    }
-                    QPushButton:hover {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(60, 68, 80, 255),
-                            stop: 1 rgba(90, 100, 118, 255)
-                        );
-                    }
-                    QPushButton:pressed {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(35, 41, 51, 255),
-                            stop: 1 rgba(65, 75, 88, 255)
-                        );
-                    }
-                """)
-                msg_box.exec()
-            
-                return
-
-        failed = False
-
-        for f in self.encrypted_files:
-            logger.debug("Decrypting %s with password %s", f, password)
-            try:
-                decrypt_file(f, password)
-                logger.debug("Decrypted: %s", f)
-            except:
-                if self.pass_attempts > 0:
-                        msg_box = QMessageBox(self)
-                        msg_box.setWindowTitle("Input Error")
-                        msg_box.setText(f"Try again, Remaining attempts: {self.pass_attempts}")
-                        msg_box.setIcon(QMessageBox.Icon.Critical)
-                        msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                        # Apply custom style with gradient background
-                        msg_box.setStyleSheet("""
-                            QMessageBox {
-                                background: qlineargradient(
-                                    x1: 0, y1: 0, x2: 1, y2: 1,
-                                    stop: 0 #b0b0b0,
-                                    stop: 1 #505050
-                                );
-                                color: #FFFFFF;
-                                font-size: 16px;
-                            }
-                            QLabel {
-                            background-color: transparent; /* Make the label background transparent */
-                            }
-                            QPushButton {
-                                background: qlineargradient(
-                                    x1: 0, y1: 0, x2: 1, y2: 0,
-                                    stop: 0 rgba(47, 54, 66, 255),
-                                    stop: 1 rgba(75, 85, 98, 255)
-                                );
-                                color: white;
-                                border-radius: 10px;
-                                border: 1px solid rgba(0, 0, 0, 0.5);
-                                padding: 4px;
-                                font-size: 16px;
-                            }
-                            QPushButton:hover {
-                                background: qlineargradient(
-                                    x1: 0, y1: 0, x2: 1, y2: 0,
-                                    stop: 0 rgba(60, 68, 80, 255),
-                                    stop: 1 rgba(90, 100, 118, 255)
-                                );
-                            }
-                            QPushButton:pressed {
-                                background: qlineargradient(
-                                    x1: 0, y1: 0, x2: 1, y2: 0,
-                                    stop: 0 rgba(35, 41, 51, 255),
-                                    stop: 1 rgba(65, 75, 88, 255)
-                                );
-                            }
-                        """)
-                        msg_box.exec()
-                        self.pass_attempts -= 1
-                        return
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as src:
+        streaming = src.read(len(STREAM_MAGIC)) == STREAM_MAGIC
+        src.seek(0)
+        if not streaming:
+            decrypted_data = _decrypt_legacy(src.read(), key, keys)
+
+        try:
+            with open(output_file_path, 'wb') as dst:
+                if streaming:
+                    decrypt_stream(src, dst, key, size, keys)
                 else:
-                    failed = True
-            os.remove(f)
-
-        if failed:
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("Input Error")
-                msg_box.setText("Too many incorrect attempts, File has been deleted.")
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                # Apply custom style with gradient background
-                msg_box.setStyleSheet("""
-                    QMessageBox {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 1,
-                            stop: 0 #b0b0b0,
-                            stop: 1 #505050
-                        );
-                        color: #FFFFFF;
-                        font-size: 16px;
-                    }
-                    QLabel {
-                    background-color: transparent; /* Make the label background transparent */
-                    }
-                    QPushButton {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(47, 54, 66, 255),
-                            stop: 1 rgba(75, 85, 98, 255)
-                        );
-                        color: white;
-                        border-radius: 10px;
-                        border: 1px solid rgba(0, 0, 0, 0.5);
-                        padding: 4px;
-                        font-size: 16px;
-                    }
-                    QPushButton:hover {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(60, 68, 80, 255),
-                            stop: 1 rgba(90, 100, 118, 255)
-                        );
-                    }
-                    QPushButton:pressed {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(35, 41, 51, 255),
-                            stop: 1 rgba(65, 75, 88, 255)
-                        );
-                    }
-                """)
-                msg_box.exec()
-        else:
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("Success")
-                msg_box.setText("Successfully decrypted files")
-                msg_box.setIcon(QMessageBox.Icon.Information)
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                # Apply custom style with gradient background
-                msg_box.setStyleSheet("""
-                    QMessageBox {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 1,
-                            stop: 0 #b0b0b0,
-                            stop: 1 #505050
-                        );
-                        color: #FFFFFF;
-                        font-size: 16px;
-                    }
-                    QLabel {
-                    background-color: transparent; /* Make the label background transparent */
-                    }
-                    QPushButton {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(47, 54, 66, 255),
-                            stop: 1 rgba(75, 85, 98, 255)
-                        );
-                        color: white;
-                        border-radius: 10px;
-                        border: 1px solid rgba(0, 0, 0, 0.5);
-                        padding: 4px;
-                        font-size: 16px;
-                    }
-                    QPushButton:hover {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(60, 68, 80, 255),
-                            stop: 1 rgba(90, 100, 118, 255)
-                        );
-                    }
-                    QPushButton:pressed {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(35, 41, 51, 255),
-                            stop: 1 rgba(65, 75, 88, 255)
-                        );
-                    }
-                """)
-                msg_box.exec()
-        self.hide()
-
-    def set_background(self):
-        self.setStyleSheet("""
-            QWidget {
-                background: qlineargradient(
-                    x1: 0, y1: 0, x2: 1, y2: 1,
-                    stop: 0 #b0b0b0,
-                    stop: 1 #505050
-                );
-            }
-        """)
-
-    def style_button(self, button):
-        button.setFixedSize(150, 40)  # Adjust the size as needed
-        button.setFont(QFont("Arial", 15))
-        button.setStyleSheet("""
-            QPushButton {
-                background: qlineargradient(
-                    x1: 0, y1: 0, x2: 1, y2: 0,
-                    stop: 0 rgba(47, 54, 66, 255),   /* Dark Color */
-                    stop: 1 rgba(75, 85, 98, 255)    /* Light Color */
-                );
-                color: white;
-                border-radius: 18px;
-                border: 1px solid rgba(0, 0, 0, 0.5);
-                padding: 6px;
-                font-weight: bold;
-                font-size: 14px;
-            }
-            QPushButton:hover {
-                background: qlineargradient(
-                    x1: 0, y1: 0, x2: 1, y2: 0,
-                    stop: 0 rgba(60, 68, 80, 255),   /* Lightened Dark Color */
-                    stop: 1 rgba(90, 100, 118, 255)  /* Lightened Light Color */
-                );
-            }
-            QPushButton:pressed {
-                background: qlineargradient(
-                    x1: 0, y1: 0, x2: 1, y2: 0,
-                    stop: 0 rgba(35, 41, 51, 255),   /* Darker on press */
-                    stop: 1 rgba(65, 75, 88, 255)    /* Darker on press */
-                );
-            }
-        """)
-
-        # Adding a constant glow effect to the button
-        glow_effect = QGraphicsDropShadowEffect()
-        glow_effect.setBlurRadius(15)  # Adjust the blur radius for a softer glow
-        glow_effect.setXOffset(0)       # Center the glow horizontally
-        glow_effect.setYOffset(0)       # Center the glow vertically
-        glow_effect.setColor(QColor(255, 255, 255, 100))  # Soft white glow with some transparency
-        button.setGraphicsEffect(glow_effect)
-
-    def style_label(self, label):
-        label.setStyleSheet("""
-            color: #FFFFFF;
-            background-color: transparent;  /* Set the background to transparent */
-            font-size: 20px;
-        """)
-
-    def style_input(self, input_field):
-        input_field.setStyleSheet("""
-            QLineEdit {
-                color: #FFFFFF;
-                background-color: transparent;
-                border: 1px solid #444;
-                border-radius: 4px;
-                padding: 5px;
-                caret-color: #00FF00;  /* Green cursor color */
-            }
-            QLineEdit:focus {
-                border: 2px solid #333333;  /* Dark grey border on focus */
-                caret-color: #00FF00;  /* Green cursor color on focus */
-                background-color: rgba(255, 255, 255, 0.1); /* Slightly opaque background on focus */
-            }
-        """)
-
-    def center_window(self):
-        screen = QScreen.availableGeometry(QApplication.primaryScreen())
-        window_width, window_height = 400, 200
-        x = (screen.width() - window_width) // 2
-        y = (screen.height() - window_height) // 2
-        self.setGeometry(x, y, window_width, window_height)
-        #com.an.Datadash
-
-
-# if __name__ == '__main__':
-#     app = QApplication(sys.argv)
-#     dialog = PasswordDialog()
-    
-#     if dialog.exec() == QDialog.DialogCode.Accepted:
-#         password = dialog.getPassword()
-#         print(f'Password entered: {password}')
-
-#     sys.exit(app.exec())
-
+                    dst.write(decrypted_data)
+        except Exception:
+            # A wrong password fails on the first chunk; never leave partial plaintext behind
+            os.remove(output_file_path)
+            raise
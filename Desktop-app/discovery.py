@@ -0,0 +1,396 @@
+import ipaddress
+import json
+import platform
+import selectors
+import socket
+import threading
+import time
+import netifaces
+from compression import COMPRESSION_CODECS
+from constant import BROADCAST_PORT, LISTEN_PORT, MULTICAST_GROUP, get_config, logger
+from framing import SUPPORTED_PROTOCOLS
+from integrity import INTEGRITY_ALGORITHM
+
+DISCOVER_MESSAGE = b'DISCOVER'
+RECEIVER_PREFIX = 'RECEIVER:'
+# Multicast mode: senders query the group on BROADCAST_PORT, receivers answer
+# and announce themselves to the group on LISTEN_PORT with ANNOUNCE_PREFIX + JSON
+QUERY_MESSAGE = b'DATADASH?'
+ANNOUNCE_PREFIX = b'DATADASH:'
+# Announcements never leave the local network
+MULTICAST_TTL = 1
+# DISCOVER is repeated after these delays, then every DISCOVERY_MAX_INTERVAL seconds
+DISCOVERY_INITIAL_INTERVAL = 0.25
+DISCOVERY_MAX_INTERVAL = 5.0
+# A peer that has not answered for this long is dropped from the table
+PEER_TTL = 3 * DISCOVERY_MAX_INTERVAL
+
+
+def broadcast_addresses():
+    """(local IP, broadcast address) for every IPv4 interface that is up, loopback excluded.
+
+    The broadcast address comes from the interface itself, or from its
+    netmask when the platform does not report one.
+    """
+    result = []
+    for interface in netifaces.interfaces():
+        try:
+            addrs = netifaces.ifaddresses(interface).get(netifaces.AF_INET, [])
+        except ValueError:
+            continue
+        for addr in addrs:
+            ip = addr.get('addr')
+            if not ip or ip.startswith('127.'):
+                continue
+            broadcast = addr.get('broadcast')
+            if not broadcast and addr.get('netmask'):
+                network = ipaddress.IPv4Network(f"{ip}/{addr['netmask']}", strict=False)
+                if network.prefixlen >= 31:
+                    # Point-to-point links have no broadcast address
+                    continue
+                broadcast = str(network.broadcast_address)
+            if broadcast and (ip, broadcast) not in result:
+                result.append((ip, broadcast))
+    return result
+
+
+def device_data():
+    """What this device tells peers about itself, in the RECEIVER_JSON handshake and in announcements."""
+    return {
+        'device_type': 'python',
+        'os': platform.system(),
+        'streams': get_config().get('parallel_streams', 1),
+        'resume': True,
+        'sessions': True,
+        'integrity': INTEGRITY_ALGORITHM,
+        'sync': True,
+        'compression': COMPRESSION_CODECS,
+        'protocols': SUPPORTED_PROTOCOLS
+    }
+
+
+def pack_announcement(name, info, state='up'):
+    return ANNOUNCE_PREFIX + json.dumps(dict(info, name=name, state=state)).encode()
+
+
+def parse_announcement(message):
+    """The dict carried by an announcement, or None if `message` is not a valid one."""
+    if not message.startswith(ANNOUNCE_PREFIX):
+        return None
+    try:
+        data = json.loads(message[len(ANNOUNCE_PREFIX):].decode())
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('name'), str):
+        return None
+    return data
+
+
+def join_multicast(sock, local_ips):
+    for local_ip in local_ips:
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton(local_ip))
+        except OSError as e:
+            logger.debug("Joining %s on %s failed: %s", MULTICAST_GROUP, local_ip, e)
+
+
+def send_multicast(sock, message, port, local_ips):
+    for local_ip in local_ips:
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(local_ip))
+            sock.sendto(message, (MULTICAST_GROUP, port))
+        except OSError as e:
+            logger.debug("Multicast via %s failed: %s", local_ip, e)
+
+
+class PeerTable:
+    """Receivers seen recently, keyed by IP, each with a last-seen timestamp."""
+
+    def __init__(self, ttl=PEER_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.peers = {}
+
+    def update(self, ip, name, **info):
+        """Record a reply; returns True when the peer is new or its details changed.
+
+        Details from an announcement are kept when a plain broadcast reply
+        from the same peer follows.
+        """
+        previous = self.peers.get(ip)
+        entry = {k: v for k, v in (previous or {}).items() if k != 'last_seen'}
+        entry.update(info, ip=ip, name=name)
+        self.peers[ip] = dict(entry, last_seen=self.clock())
+        return previous is None or any(previous.get(k) != v for k, v in entry.items())
+
+    def remove(self, ip):
+        return self.peers.pop(ip, None)
+
+    def get(self, ip):
+        """The peer at `ip` without its bookkeeping, or None."""
+        peer = self.peers.get(ip)
+        return {k: v for k, v in peer.items() if k != 'last_seen'} if peer else None
+
+    def expire(self):
+        """Drop and return the peers whose TTL ran out."""
+        cutoff = self.clock() - self.ttl
+        expired = [peer for peer in self.peers.values() if peer['last_seen'] < cutoff]
+        for peer in expired:
+            del self.peers[peer['ip']]
+        return expired
+
+    def snapshot(self):
+        return [dict(peer) for peer in self.peers.values()]
+
+
+class DiscoveryService:
+    """Announces DISCOVER on every interface and tracks the receivers that answer.
+
+    With `multicast` it also queries MULTICAST_GROUP and listens for
+    receivers announcing themselves there; those peers carry their
+    handshake details (device type, OS, protocols). run() blocks until
+    stop() is called; `on_added(peer)` and `on_removed(peer)` are called
+    from the thread running it.
+    """
+
+    def __init__(self, on_added=None, on_removed=None, ttl=PEER_TTL, multicast=True, clock=time.monotonic):
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.multicast = multicast
+        self.joined = set()
+        self.clock = clock
+        self.table = PeerTable(ttl, clock)
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.interval = DISCOVERY_INITIAL_INTERVAL
+        self.next_announce = 0.0
+        self.socket = None
+
+    def refresh(self):
+        """Announce again right away and restart the backoff, e.g. for a Refresh button."""
+        with self.lock:
+            self.interval = DISCOVERY_INITIAL_INTERVAL
+            self.next_announce = 0.0
+
+    def stop(self):
+        self.stopped.set()
+
+    def announce(self, sock):
+        targets = broadcast_addresses()
+        if not targets:
+            logger.warning("No IPv4 interface to send DISCOVER on")
+        for local_ip, broadcast in targets:
+            try:
+                sock.sendto(DISCOVER_MESSAGE, (broadcast, BROADCAST_PORT))
+            except OSError as e:
+                logger.debug("DISCOVER to %s via %s failed: %s", broadcast, local_ip, e)
+        if self.multicast:
+            local_ips = [local_ip for local_ip, _ in targets]
+            # Interfaces that came up since the last announce join the group too
+            join_multicast(sock, [ip for ip in local_ips if ip not in self.joined])
+            self.joined.update(local_ips)
+            send_multicast(sock, QUERY_MESSAGE, BROADCAST_PORT, local_ips)
+        with self.lock:
+            self.next_announce = self.clock() + self.interval
+            self.interval = min(self.interval * 2, DISCOVERY_MAX_INTERVAL)
+
+    def handle_reply(self, message, address):
+        ip = address[0]
+        announcement = parse_announcement(message) if self.multicast else None
+        if announcement is not None:
+            name = announcement.pop('name')
+            if announcement.pop('state', 'up') == 'down':
+                # Goodbye: the receiver closed, drop it without waiting for the TTL
+                peer = self.table.remove(ip)
+                if peer and self.on_removed:
+                    self.on_removed(peer)
+                return
+            changed = self.table.update(ip, name, **announcement)
+        else:
+            try:
+                text = message.decode()
+            except UnicodeDecodeError:
+                return
+            if not text.startswith(RECEIVER_PREFIX):
+                return
+            name = text[len(RECEIVER_PREFIX):]
+            changed = self.table.update(ip, name)
+        if changed:
+            logger.info("Found device: %s (%s)", name, ip)
+            if self.on_added:
+                self.on_added(self.table.get(ip))
+
+    def run(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(('', LISTEN_PORT))
+            if self.multicast:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+            self.socket = sock
+            while not self.stopped.is_set():
+                if self.clock() >= self.next_announce:
+                    self.announce(sock)
+                for peer in self.table.expire():
+                    logger.info("Device %s (%s) went away", peer['name'], peer['ip'])
+                    if self.on_removed:
+                        self.on_removed(peer)
+                # Wake for the next announce, or at least twice a second to notice stop()
+                sock.settimeout(max(0.01, min(self.next_announce - self.clock(), 0.5)))
+                try:
+                    message, address = sock.recvfrom(4096)
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    logger.error("Error during discovery: %s", e)
+                    break
+                self.handle_reply(message, address)
+            self.socket = None
+
+
+# A source IP gets at most one RECEIVER reply per this many seconds
+RESPONDER_MIN_INTERVAL = 0.2
+# Rate-limit entries are pruned once the table holds this many addresses
+RESPONDER_TABLE_LIMIT = 4096
+# Room for a burst of DISCOVERs from many senders scanning at once
+RESPONDER_RECEIVE_BUFFER = 1024 * 1024
+
+
+class BroadcastResponder:
+    """Answers DISCOVER datagrams on BROADCAST_PORT as soon as they arrive.
+
+    One socket both receives the broadcasts and sends the replies. The
+    thread running run() sleeps in select() until a datagram arrives or
+    pause()/resume()/stop() wakes it; while paused the socket is not
+    watched at all.
+
+    With `announcement`, a callable returning the device_data() dict, the
+    responder also joins MULTICAST_GROUP: it answers multicast queries
+    with that dict, announces itself when it starts or resumes, and says
+    goodbye when it stops.
+    """
+
+    def __init__(self, device_name, port=BROADCAST_PORT, reply_port=LISTEN_PORT,
+                 min_interval=RESPONDER_MIN_INTERVAL, clock=time.monotonic, announcement=None):
+        # device_name is a string or a callable returning the current name
+        self.device_name = device_name
+        self.announcement = announcement
+        self.port = port
+        self.reply_port = reply_port
+        self.min_interval = min_interval
+        self.clock = clock
+        self.last_reply = {}
+        self.paused = False
+        self.stopped = False
+        self.replies = 0
+        self.limited = 0
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Already pending, or the responder is gone
+            pass
+
+    def pause(self):
+        self.paused = True
+        self._wake()
+
+    def resume(self):
+        self.paused = False
+        self._wake()
+
+    def stop(self):
+        self.stopped = True
+        self._wake()
+
+    def allow(self, key):
+        """Rate limit per (source IP, query kind); True when `key` may get a reply now."""
+        now = self.clock()
+        last = self.last_reply.get(key)
+        if last is not None and now - last < self.min_interval:
+            self.limited += 1
+            return False
+        if len(self.last_reply) >= RESPONDER_TABLE_LIMIT:
+            cutoff = now - self.min_interval
+            self.last_reply = {k: t for k, t in self.last_reply.items() if t >= cutoff}
+        self.last_reply[key] = now
+        return True
+
+    def _name(self):
+        return self.device_name() if callable(self.device_name) else self.device_name
+
+    def _announcement(self, state='up'):
+        return pack_announcement(self._name(), self.announcement(), state)
+
+    def announce(self, sock, state='up'):
+        local_ips = [local_ip for local_ip, _ in broadcast_addresses()]
+        send_multicast(sock, self._announcement(state), self.reply_port, local_ips)
+
+    def handle_datagrams(self, sock):
+        # Drain everything queued so one wakeup answers a whole burst
+        while True:
+            try:
+                message, address = sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # ICMP errors from earlier replies surface here on some platforms
+                logger.debug("Broadcast socket error: %s", e)
+                return
+            if message == DISCOVER_MESSAGE:
+                query = 'broadcast'
+            elif message == QUERY_MESSAGE and self.announcement:
+                query = 'multicast'
+            else:
+                continue
+            if not self.allow((address[0], query)):
+                continue
+            if query == 'broadcast':
+                reply = f'{RECEIVER_PREFIX}{self._name()}'.encode()
+            else:
+                reply = self._announcement()
+            try:
+                sock.sendto(reply, (address[0], self.reply_port))
+                self.replies += 1
+            except OSError as e:
+                logger.debug("Reply to %s failed: %s", address[0], e)
+
+    def run(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, selectors.DefaultSelector() as selector:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RESPONDER_RECEIVE_BUFFER)
+            sock.bind(('', self.port))
+            sock.setblocking(False)
+            if self.announcement:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+                join_multicast(sock, [local_ip for local_ip, _ in broadcast_addresses()])
+            selector.register(self._wakeup_r, selectors.EVENT_READ)
+            watching = False
+            while not self.stopped:
+                if watching == self.paused:
+                    if self.paused:
+                        selector.unregister(sock)
+                    else:
+                        selector.register(sock, selectors.EVENT_READ)
+                        if self.announcement:
+                            self.announce(sock)
+                    watching = not self.paused
+                for key, _ in selector.select():
+                    if key.fileobj is sock:
+                        self.handle_datagrams(sock)
+                    else:
+                        try:
+                            while self._wakeup_r.recv(64):
+                                pass
+                        except BlockingIOError:
+                            pass
+            if self.announcement:
+                self.announce(sock, 'down')
+        self._wakeup_r.close()
+        self._wakeup_w.close()
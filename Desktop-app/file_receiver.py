@@ -1,10 +1,7 @@
 import os
 import platform
-import socket
-import struct
 import threading
-import json
-from time import sleep
+from concurrent.futures import CancelledError
 import subprocess
 import shutil
 from PyQt6.QtCore import QThread, pyqtSignal, QTimer, Qt, QMetaObject
@@ -14,280 +11,65 @@ from PyQt6.QtWidgets import (
     QApplication, QHBoxLayout, QPushButton
 )
 from PyQt6.QtGui import QScreen, QMovie, QKeySequence, QKeyEvent, QFont
-from constant import (
-    BROADCAST_PORT, LISTEN_PORT, get_config, logger, 
-    RECEIVER_JSON, RECEIVER_DATA, SENDER_DATA
-)
-from crypt_handler import decrypt_file, Decryptor
-
-class BaseReceiveWorker(QThread):
+from constant import get_config, logger
+from discovery import BroadcastResponder, device_data
+from progress import format_progress
+from receiver_server import ReceiverServer
+from transfer_core import HandshakeServer, Receiver, TransferEvents, submit
+from transfer_io import RECEIVE_BUFFER_SIZE
+
+class BaseReceiveWorker(QThread, TransferEvents):
+    """Runs a transfer_core.Receiver on the shared transfer loop and turns its events into signals."""
     progress_update = pyqtSignal(int)
+    progress_details = pyqtSignal(dict)
     decrypt_signal = pyqtSignal(list)
     receiving_started = pyqtSignal()
     transfer_finished = pyqtSignal()
     error_occurred = pyqtSignal(str, str, str)
     password = None
 
-    def __init__(self, client_ip):
+    def __init__(self, client_ip, buffer_size=RECEIVE_BUFFER_SIZE, session_token=None, listener=None):
         super().__init__()
-        self.client_skt = None
-        self.server_skt = None
-        self.encrypted_files = []
-        self.broadcasting = True
-        self.metadata = None
-        self.destination_folder = None
         self.store_client_ip = client_ip
-        self.base_folder_name = ''
+        self.core = Receiver(client_ip, listener=listener, session_token=session_token, events=self,
+                             buffer_size=buffer_size)
+        self.future = None
         logger.debug(f"Client IP address stored: {self.store_client_ip}")
 
-    def initialize_connection(self):
-        try:
-            if self.server_skt:
-                try:
-                    self.server_skt.shutdown(socket.SHUT_RDWR)
-                    self.server_skt.close()
-                except:
-                    pass
-                
-            self.server_skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            if platform.system() != 'Windows':
-                try:
-                    self.server_skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-                except AttributeError:
-                    logger.debug("SO_REUSEPORT not available on this platform")
-            
-            self.server_skt.settimeout(60)
-            self.server_skt.bind(('', RECEIVER_DATA))
-            self.server_skt.listen(1)
-            logger.debug("Server initialized on port %d", RECEIVER_DATA)
-            
-        except OSError as e:
-            if e.errno == 48:
-                logger.error("Port %d is in use, waiting to retry...", RECEIVER_DATA)
-                sleep(1)
-                self.initialize_connection()
-            else:
-                raise
-        except Exception as e:
-            logger.error("Failed to initialize server: %s", str(e))
-            raise
-
-    def accept_connection(self):
-        if self.client_skt:
-            self.client_skt.close()
-        try:
-            self.client_skt, self.client_address = self.server_skt.accept()
-            print(f"Connected to {self.client_address}")
-        except Exception as e:
-            error_message = f"Failed to accept connection: {str(e)}"
-            logger.error(error_message)
-            self.error_occurred.emit("Connection Error", error_message, "")
-            return None
-
     def run(self):
-        self.initialize_connection()
-        self.accept_connection()
-        if self.client_skt:
-            self.receiving_started.emit()
-            self.receive_files()
-        else:
-            logger.error("Failed to establish a connection.")
-
-        if self.client_skt:
-            self.client_skt.close()
-        if self.server_skt:
-            self.server_skt.close()
+        self.future = submit(self.core.run())
+        try:
+            self.future.result()
+        except CancelledError:
+            logger.info("Receiving from %s cancelled", self.store_client_ip)
 
-    def receive_files(self):
-        self.broadcasting = False
-        logger.debug("File reception started.")
-        is_folder_transfer = False
+    def on_started(self):
+        self.receiving_started.emit()
 
-        while True:
-            try:
-                encryption_flag = self.client_skt.recv(8).decode()
-                logger.debug("Received encryption flag: %s", encryption_flag)
-
-                if not encryption_flag:
-                    logger.debug("Dropped redundant data: %s", encryption_flag)
-                    break
-
-                if encryption_flag[-1] == 't':
-                    encrypted_transfer = True
-                elif encryption_flag[-1] == 'h':
-                    if self.encrypted_files:
-                        self.decrypt_signal.emit(self.encrypted_files)
-                    self.encrypted_files = []
-                    logger.debug("Received halt signal. Stopping file reception.")
-                    self.transfer_finished.emit()
-                    break
-                else:
-                    encrypted_transfer = False
-
-                file_name_size_data = self.client_skt.recv(8)
-                file_name_size = struct.unpack('<Q', file_name_size_data)[0]
-                logger.debug("File name size received: %d", file_name_size)
-                
-                if file_name_size == 0:
-                    logger.debug("End of transfer signal received.")
-                    break
-
-                file_name = self._receive_data(self.client_skt, file_name_size).decode()
-                file_name = file_name.replace('\\', '/')
-                logger.debug("Original file name: %s", file_name)
-
-                file_size_data = self.client_skt.recv(8)
-                file_size = struct.unpack('<Q', file_size_data)[0]
-
-                try:
-                    if file_name == 'metadata.json':
-                        logger.debug("Receiving metadata file.")
-                        self.metadata = self.receive_metadata(file_size)
-                        is_folder_transfer = any(file_info.get('path', '').endswith('/') 
-                                            for file_info in self.metadata)
-                        if is_folder_transfer:
-                            self.destination_folder = self.create_folder_structure(self.metadata)
-                        else:
-                            self.destination_folder = get_config()["save_to_directory"]
-                        continue
-
-                    if is_folder_transfer and self.metadata:
-                        relative_file_path = file_name
-                        if self.base_folder_name and relative_file_path.startswith(self.base_folder_name + '/'):
-                            relative_file_path = relative_file_path[len(self.base_folder_name) + 1:]
-                        full_file_path = os.path.join(self.destination_folder, relative_file_path)
-                    else:
-                        full_file_path = os.path.join(self.destination_folder, os.path.basename(file_name))
-
-                    os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
-                    full_file_path = self._get_unique_file_name(full_file_path)
-                    logger.debug(f"Saving file to: {full_file_path}")
-
-                    with open(full_file_path, "wb") as f:
-                        received_size = 0
-                        remaining = file_size
-                        while remaining > 0:
-                            chunk_size = min(4096, remaining)
-                            data = self.client_skt.recv(chunk_size)
-                            if not data:
-                                raise ConnectionError("Connection lost during file reception.")
-                            f.write(data)
-                            received_size += len(data)
-                            remaining -= len(data)
-                            progress = int(received_size * 100 / file_size)
-                            self.progress_update.emit(progress)
-
-                    if encrypted_transfer:
-                        self.encrypted_files.append(full_file_path)
-
-                except Exception as e:
-                    logger.error(f"Error saving file {file_name}: {str(e)}")
+    def on_progress(self, snapshot):
+        self.progress_update.emit(snapshot['percent'])
+        self.progress_details.emit(snapshot)
 
-            except Exception as e:
-                logger.error("Error during file reception: %s", str(e))
-                break
-
-        self.broadcasting = True
-        logger.debug("File reception completed.")
-
-    def _receive_data(self, socket, size):
-        received_data = b""
-        while len(received_data) < size:
-            chunk = socket.recv(size - len(received_data))
-            if not chunk:
-                raise ConnectionError("Connection closed before data was completely received.")
-            received_data += chunk
-        return received_data
-
-    def receive_metadata(self, file_size):
-        received_data = self._receive_data(self.client_skt, file_size)
-        try:
-            metadata_json = received_data.decode('utf-8')
-            return json.loads(metadata_json)
-        except UnicodeDecodeError as e:
-            logger.error("Unicode decode error: %s", e)
-            raise
-        except json.JSONDecodeError as e:
-            logger.error("JSON decode error: %s", e)
-            raise
-
-    def create_folder_structure(self, metadata):
-        default_dir = get_config()["save_to_directory"]
-        
-        if not default_dir:
-            raise ValueError("No save_to_directory configured")
-        
-        base_folder_name = None
-        for file_info in metadata:
-            path = file_info.get('path', '')
-            if path.endswith('/'):
-                base_folder_name = path.rstrip('/').split('/')[0]
-                logger.debug("Found base folder name: %s", base_folder_name)
-                break
-
-        if not base_folder_name:
-            base_folder_name = metadata[-1].get('base_folder_name', '')
-            logger.debug("Base folder name from last metadata entry: %s", base_folder_name)
-
-        if not base_folder_name:
-            raise ValueError("Base folder name not found in metadata")
-        
-        destination_folder = os.path.join(default_dir, base_folder_name)
-        destination_folder = self._get_unique_folder_name(destination_folder)
-        logger.debug("Destination folder: %s", destination_folder)
-        
-        if not os.path.exists(destination_folder):
-            os.makedirs(destination_folder)
-            logger.debug("Created root folder: %s", destination_folder)
-        
-        self.base_folder_name = base_folder_name
-        
-        return destination_folder
+    def on_finished(self, encrypted_files):
+        if encrypted_files:
+            self.decrypt_signal.emit(encrypted_files)
+        self.transfer_finished.emit()
 
-    def _get_unique_file_name(self, file_path):
-        if not os.path.exists(file_path):
-            return file_path
-        
-        base_name, extension = os.path.splitext(file_path)
-        counter = 1
-        
-        while os.path.exists(f"{base_name} ({counter}){extension}"):
-            counter += 1
-            
-        return f"{base_name} ({counter}){extension}"
-
-    def _get_unique_folder_name(self, folder_path):
-        if not os.path.exists(folder_path):
-            return folder_path
-        
-        counter = 1
-        while os.path.exists(f"{folder_path} ({counter})"):
-            counter += 1
-            
-        return f"{folder_path} ({counter})"
+    def on_error(self, title, message, details=''):
+        self.error_occurred.emit(title, message, details)
 
     def stop(self):
-        self.broadcasting = False
-        if hasattr(self, 'server_skt') and self.server_skt:
-            try:
-                self.server_skt.close()
-            except:
-                pass
-        if hasattr(self, 'client_skt') and self.client_skt:
-            try:
-                self.client_skt.close()
-            except:
-                pass
+        if self.future:
+            self.future.cancel()
 
     def close_connection(self):
         self.stop()
 
 class ReceiveWorkerPython(BaseReceiveWorker):
-    def __init__(self, client_ip):
-        super().__init__(client_ip)
-        self.close_connection_signal = pyqtSignal()
+    close_connection_signal = pyqtSignal()
+
+    def __init__(self, client_ip, listener=None):
+        super().__init__(client_ip, listener=listener)
         self.close_connection_signal.connect(self.close_connection)
 
 class ReceiveWorkerJava(BaseReceiveWorker):
@@ -389,6 +171,7 @@ class BaseReceiveApp(QWidget):
 
     def setup_receiver(self):
         self.file_receiver.progress_update.connect(self.updateProgressBar)
+        self.file_receiver.progress_details.connect(self.updateProgressDetails)
         self.file_receiver.decrypt_signal.connect(self.decryptor_init)
         self.file_receiver.receiving_started.connect(self.show_progress_bar)
         self.file_receiver.transfer_finished.connect(self.onTransferFinished)
@@ -451,6 +234,11 @@ class BaseReceiveApp(QWidget):
     def show_progress_bar(self):
         self.progress_bar.setVisible(True)
         self.label.setText(self.get_progress_text())
+        if self.loading_label.movie() is not self.receiving_movie:
+            # Another batch of the same session
+            self.success_movie.stop()
+            self.loading_label.setMovie(self.receiving_movie)
+            self.receiving_movie.start()
 
     def update_typewriter_effect(self):
         if self.char_index < len(self.current_text):
@@ -463,6 +251,9 @@ class BaseReceiveApp(QWidget):
     def updateProgressBar(self, value):
         self.progress_bar.setValue(value)
 
+    def updateProgressDetails(self, snapshot):
+        self.progress_bar.setFormat(format_progress(snapshot))
+
     def onTransferFinished(self):
         self.label.setText("File received successfully!")
         self.open_dir_button.setVisible(True)
@@ -477,6 +268,7 @@ class BaseReceiveApp(QWidget):
     def decryptor_init(self, value):
         logger.debug("Received decrypt signal with filelist %s", value)
         if value:
+            from decryptor import Decryptor
             self.decryptor = Decryptor(value)
             self.decryptor.show()
 
@@ -517,10 +309,10 @@ class BaseReceiveApp(QWidget):
             event.accept()
 
 class ReceiveAppP(BaseReceiveApp):
-    def __init__(self, client_ip, sender_os):
+    def __init__(self, client_ip, sender_os, listener=None):
         self.sender_os = sender_os
+        self.file_receiver = ReceiveWorkerPython(client_ip, listener)
         super().__init__(client_ip)
-        self.file_receiver = ReceiveWorkerPython(client_ip)
         self.current_text = self.displaytxt()
 
     def displaytxt(self):
@@ -546,100 +338,63 @@ class ReceiveAppP(BaseReceiveApp):
                 return 'Receiving files from Desktop app'
 
 class ReceiveAppPJava(BaseReceiveApp):
-    def __init__(self, client_ip):
+    def __init__(self, client_ip, listener=None):
+        self.file_receiver = ReceiveWorkerJava(client_ip, listener=listener)
         super().__init__(client_ip)
-        self.file_receiver = ReceiveWorkerJava(client_ip)
         self.current_text = "Waiting to receive files from an Android device"
 
     def get_progress_text(self):
         return "Receiving files from an Android device"
 
 class ReceiveAppPSwift(BaseReceiveApp):
-    def __init__(self, client_ip):
+    def __init__(self, client_ip, listener=None):
+        self.file_receiver = ReceiveWorkerSwift(client_ip, listener=listener)
         super().__init__(client_ip)
-        self.file_receiver = ReceiveWorkerSwift(client_ip)
         self.current_text = "Waiting to receive files from a Swift device"
 
     def get_progress_text(self):
         return "Receiving files from a Swift device"
 
 class FileReceiver(QThread):
-    show_receive_app_p_signal = pyqtSignal(str)
-    show_receive_app_p_signal_java = pyqtSignal()
-    show_receive_app_p_signal_swift = pyqtSignal()
+    # Each carries the SenderListener registered for that sender
+    show_receive_app_p_signal = pyqtSignal(str, object)
+    show_receive_app_p_signal_java = pyqtSignal(object)
+    show_receive_app_p_signal_swift = pyqtSignal(object)
 
     def __init__(self):
         super().__init__()
-        self.encrypted_files = []
-        self.broadcasting = True
-        self.metadata = None
-        self.destination_folder = None
-        self.client_ip = None
-        self.server_socket = None
-        self.client_socket = None
-        self.receiver_worker = None
+        # Announcements carry the handshake details so senders can skip waiting for them
+        announcement = device_data if get_config().get("multicast_discovery", True) else None
+        self.responder = BroadcastResponder(lambda: get_config()["device_name"], announcement=announcement)
+        # One RECEIVER_DATA server shared by every sender's receive window
+        self.data_server = ReceiverServer()
+        self.handshakes = HandshakeServer(self.data_server, self.on_paired)
+        self.future = None
 
     def run(self):
+        self.data_server.start()
+        self.future = submit(self.handshakes.serve())
         try:
-            if self.server_socket:
-                self.server_socket.close()
-                sleep(0.5)
-            if self.client_socket:
-                self.client_socket.close()
-                sleep(0.5)
-            if self.receiver_worker:
-                self.receiver_worker.terminate()
-        except Exception:
+            self.future.result()
+        except CancelledError:
             pass
+        except OSError as e:
+            logger.error("Cannot accept senders: %s", e)
+        finally:
+            self.data_server.stop()
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind(('0.0.0.0', RECEIVER_JSON))
-        self.server_socket.listen(5)
-
-        while True:
-            self.client_socket, addr = self.server_socket.accept()
-            self.store_client_ip()
-            self.handle_device_type()
-            self.client_socket.close()
-
-    def store_client_ip(self):
-        self.client_ip = self.client_socket.getpeername()[0]
-        logger.debug(f"Client IP address stored: {self.client_ip}")
-        return self.client_ip
-
-    def handle_device_type(self):
-        device_data = {
-            "device_type": "python",
-            "os": platform.system()
-        }
-        device_data_json = json.dumps(device_data)
-        self.client_socket.send(struct.pack('<Q', len(device_data_json)))
-        self.client_socket.send(device_data_json.encode())
-
-        device_json_size = struct.unpack('<Q', self.client_socket.recv(8))[0]
-        device_json = self.client_socket.recv(device_json_size).decode()
-        self.device_info = json.loads(device_json)
-        
-        match self.device_info.get("device_type", "unknown"):
+    def on_paired(self, device_info, listener):
+        match device_info["device_type"]:
             case "python":
-                logger.debug("Connected to a Python device.")
-                self.show_receive_app_p_signal.emit(self.device_info.get("os", "unknown"))
+                self.show_receive_app_p_signal.emit(device_info.get("os", "unknown"), listener)
             case "java":
-                logger.debug("Connected to a Java device.")
-                self.show_receive_app_p_signal_java.emit()
+                self.show_receive_app_p_signal_java.emit(listener)
             case "swift":
-                logger.debug("Connected to a Swift device.")
-                self.show_receive_app_p_signal_swift.emit()
-            case _:
-                logger.debug("Unknown device type received.")
-        
-        sleep(1)
-        self.cleanup_sockets()
+                self.show_receive_app_p_signal_swift.emit(listener)
 
-    def cleanup_sockets(self):
-        if self.client_socket:
-            self.client_socket.close()
+    def stop(self):
+        if self.future:
+            self.future.cancel()
 
 class ReceiveApp(QWidget):
     def __init__(self):
@@ -689,13 +444,14 @@ class ReceiveApp(QWidget):
 
         self.setLayout(layout)
 
+        self.receive_windows = []
         self.file_receiver = FileReceiver()
         self.file_receiver.show_receive_app_p_signal.connect(self.show_receive_app_p)
         self.file_receiver.show_receive_app_p_signal_java.connect(self.show_receive_app_p_java)
         self.file_receiver.show_receive_app_p_signal_swift.connect(self.show_receive_app_p_swift)
         self.file_receiver.start()
 
-        self.broadcast_thread = threading.Thread(target=self.listenForBroadcast, daemon=True)
+        self.broadcast_thread = threading.Thread(target=self.file_receiver.responder.run, daemon=True)
         self.broadcast_thread.start()
 
         self.start_typewriter_effect("Waiting to connect to sender")
@@ -723,45 +479,33 @@ class ReceiveApp(QWidget):
         if self.text_index >= len(self.full_text):
             self.timer.stop()
 
-    def listenForBroadcast(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            s.bind(('', BROADCAST_PORT))
-
-            while True:
-                if self.file_receiver.broadcasting:
-                    message, address = s.recvfrom(1024)
-                    message = message.decode()
-                    if message == 'DISCOVER':
-                        response = f'RECEIVER:{get_config()["device_name"]}'
-                        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as response_socket:
-                            response_socket.sendto(response.encode(), (address[0], LISTEN_PORT))
-                sleep(1)
-
     def connection_successful(self):
         self.movie.stop()
         self.loading_label.hide()
         self.label.setText("Connected successfully!")
         self.label.setStyleSheet("color: #00FF00;")
 
-    def show_receive_app_p(self, sender_os):
-        client_ip = self.file_receiver.client_ip
+    def show_receive_app_p(self, sender_os, listener):
         self.hide()
-        self.receive_app_p = ReceiveAppP(client_ip, sender_os)
-        self.receive_app_p.show()
+        self.receive_app_p = ReceiveAppP(listener.peer_ip, sender_os, listener)
+        self.show_receive_window(self.receive_app_p)
 
-    def show_receive_app_p_java(self):
-        client_ip = self.file_receiver.client_ip
+    def show_receive_app_p_java(self, listener):
         self.hide()
-        self.receive_app_p_java = ReceiveAppPJava(client_ip)
-        self.receive_app_p_java.show()
+        self.receive_app_p_java = ReceiveAppPJava(listener.peer_ip, listener)
+        self.show_receive_window(self.receive_app_p_java)
 
-    def show_receive_app_p_swift(self):
-        client_ip = self.file_receiver.client_ip
+    def show_receive_app_p_swift(self, listener):
         self.hide()
-        self.receive_app_p_swift = ReceiveAppPSwift(client_ip)
-        self.receive_app_p_swift.show()
+        self.receive_app_p_swift = ReceiveAppPSwift(listener.peer_ip, listener)
+        self.show_receive_window(self.receive_app_p_swift)
+
+    def show_receive_window(self, window):
+        # Several senders can be served at once; keep every window alive until it closes
+        self.receive_windows.append(window)
+        window.destroyed.connect(lambda: self.receive_windows.remove(window))
+        window.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        window.show()
 
     def center_window(self):
         screen = QScreen.availableGeometry(QApplication.primaryScreen())
@@ -771,20 +515,12 @@ class ReceiveApp(QWidget):
         self.setGeometry(x, y, window_width, window_height)
 
     def closeEvent(self, event):
-        try:
-            if self.file_receiver:
-                self.file_receiver.terminate()
-                self.stop()
-        except AttributeError:
-            pass
-        self.file_receiver.broadcasting = False
+        self.stop()
         event.accept()
 
     def stop(self):
-        self.file_receiver.broadcasting = False
-        self.file_receiver.server_socket.close()
-        self.file_receiver.client_socket.close()
-        self.file_receiver.receiver_worker.terminate()
+        self.file_receiver.responder.stop()
+        self.file_receiver.stop()
 
 class BaseReceiveApp(QWidget):
     def __init__(self, client_ip):
@@ -880,6 +616,7 @@ class BaseReceiveApp(QWidget):
         # Connect signals
         if hasattr(self, 'file_receiver'):
             self.file_receiver.progress_update.connect(self.updateProgressBar)
+            self.file_receiver.progress_details.connect(self.updateProgressDetails)
             self.file_receiver.receiving_started.connect(self.show_progress_bar)
             self.file_receiver.decrypt_signal.connect(self.decryptor_init)
             self.file_receiver.transfer_finished.connect(self.onTransferFinished)
@@ -938,6 +675,9 @@ class BaseReceiveApp(QWidget):
         if value >= 100:
             self.onTransferFinished()
 
+    def updateProgressDetails(self, snapshot):
+        self.progress_bar.setFormat(format_progress(snapshot))
+
     def onTransferFinished(self):
         self.label.setText("File received successfully!")
         self.open_dir_button.setVisible(True)
@@ -953,6 +693,7 @@ class BaseReceiveApp(QWidget):
     def decryptor_init(self, value):
         logger.debug("Received decrypt signal with filelist %s", value)
         if value:
+            from decryptor import Decryptor
             self.decryptor = Decryptor(value)
             self.decryptor.show()
 
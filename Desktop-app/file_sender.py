@@ -1,7 +1,5 @@
-import json
 import platform
-import tempfile
-from pathlib import Path
+from concurrent.futures import CancelledError
 from PyQt6.QtWidgets import (
     QMessageBox, QWidget, QVBoxLayout, QPushButton, QListWidget, 
     QProgressBar, QLabel, QFileDialog, QApplication, QListWidgetItem, QTextEdit, QLineEdit,
@@ -10,21 +8,32 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtGui import QScreen, QFont, QColor, QKeyEvent, QKeySequence
 from PyQt6.QtCore import QThread, pyqtSignal, Qt
 import os
-import socket
-import struct
 from constant import get_config, logger
-from crypt_handler import encrypt_file
-from time import sleep
+from progress import format_progress
+from scheduling import PINNED, URGENT, SendQueue
+from session import close_session
+from transfer_core import Sender, TransferEvents, submit
 
 SENDER_DATA = 57000
-RECEIVER_DATA = 58000
 
-class FileSender(QThread):
+class FileSender(QThread, TransferEvents):
+    """Runs a transfer_core.Sender on the shared transfer loop and turns its events into signals.
+
+    Subclasses for mobile receivers name the setting that turns encryption
+    on for them; the core falls back to the legacy protocol by itself.
+    """
     progress_update = pyqtSignal(int)
+    progress_details = pyqtSignal(dict)
     file_send_completed = pyqtSignal(str)
     transfer_finished = pyqtSignal()
+    queue_changed = pyqtSignal(list)
+    error_occurred = pyqtSignal(str, str, str)
 
     password = None
+    # Config key deciding encryption; None for the "encryption" setting of desktop receivers
+    encryption_setting = None
+    # Whether the window lets the user reorder files while they are sent
+    interactive_queue = True
 
     def __init__(self, ip_address, file_paths, password=None, receiver_data=None):
         super().__init__()
@@ -32,208 +41,41 @@ class FileSender(QThread):
         self.file_paths = file_paths
         self.password = password
         self.receiver_data = receiver_data
+        queue = SendQueue(get_config().get("send_order", "listed"), interactive=self.interactive_queue)
+        encryption = get_config()[self.encryption_setting] if self.encryption_setting else None
+        self.core = Sender(ip_address, file_paths, password, receiver_data, events=self, encryption=encryption,
+                           queue=queue)
+        self.future = None
 
-
-    def initialize_connection(self):
-        # Ensure previous socket is closed before re-binding
+    def run(self):
+        self.future = submit(self.core.run())
         try:
-            if hasattr(self, 'client_skt'):
-                self.client_skt.close()
-                logger.debug("Socket closed successfully before rebinding.")
-            sleep(1)  # Delay to ensure the OS releases the port
-        except Exception as e:
-            logger.error(f"Error closing socket: {e}")
-        
-        # Create a new TCP socket
-        self.client_skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.client_skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.future.result()
+        except CancelledError:
+            logger.info("Transfer to %s cancelled", self.ip_address)
         #com.an.Datadash
 
-        # Use dynamic port assignment to avoid WinError 10048
-        try:
-            self.client_skt.bind(('', 0))  # Bind to any available port assigned by the OS
-            logger.debug(f"Bound to port {self.client_skt.getsockname()[1]}")  # Log the assigned port for debugging
-            self.client_skt.connect((self.ip_address, RECEIVER_DATA))  # Connect to receiver's IP and port
-            logger.debug(f"Successfully connected to {self.ip_address} on port {RECEIVER_DATA}")
-        except ConnectionRefusedError:
-            logger.error("Connection refused: Failed to connect to the specified IP address.")
-            self.show_message_box("Connection Error", "Failed to connect to the specified IP address.")
-            return False
-        except OSError as e:
-            logger.error(f"Binding error: {e}")
-            self.show_message_box("Binding Error", f"Failed to bind to the specified port: {e}")
-            return False
-
-        return True
-
-
-
-    def run(self):
-        try:
-            if self.client_skt:
-                self.client_skt.close()
-        except:
-            pass
+    def on_progress(self, snapshot):
+        self.progress_update.emit(snapshot['percent'])
+        self.progress_details.emit(snapshot)
 
-        metadata_file_path = None
-        self.metadata_created = False
-        if not self.initialize_connection():
-            return
-        
-        self.encryption_flag = get_config()["encryption"]
-
-        for file_path in self.file_paths:
-            if os.path.isdir(file_path):
-                self.send_folder(file_path)
-            else:
-                if not self.metadata_created:
-                    metadata_file_path = self.create_metadata(file_paths=self.file_paths)
-                    self.send_file(metadata_file_path)
-                self.send_file(file_path, encrypted_transfer=self.encryption_flag)
-        
-        if self.metadata_created and metadata_file_path:
-            os.remove(metadata_file_path)
-            
-        logger.debug("Sent halt signal")
-        self.client_skt.send('encyp: h'.encode())
-        self.client_skt.close()
+    def on_finished(self, encrypted_files):
         self.transfer_finished.emit()
-        #com.an.Datadash
-
-    def get_temp_dir(self):
-        system = platform.system()
-        if system == "Windows":
-            temp_dir = Path(os.getenv('LOCALAPPDATA')) / 'Temp' / 'DataDash'
-        elif system == "Darwin":  # macOS
-            temp_dir = Path.home() / 'Library' / 'Caches' / 'DataDash'
-        elif system == "Linux":  # Linux and others
-            temp_dir = Path.home() / '.cache' / 'DataDash'
-        else:
-            logger.error(f"Unsupported platform: {system}")
-        
-        try:
-            os.makedirs(str(temp_dir), exist_ok=True)
-            logger.debug(f"Created/verified temp directory: {temp_dir}")
-        except Exception as e:
-            logger.error(f"Failed to create temp directory: {e}")
-            # Fallback to system temp directory
-            temp_dir = Path(tempfile.gettempdir()) / 'DataDash'
-            os.makedirs(str(temp_dir), exist_ok=True)
-            logger.debug(f"Using fallback temp directory: {temp_dir}")
-        
-        return temp_dir
-
-    def create_metadata(self, folder_path=None, file_paths=None):
-        temp_dir = self.get_temp_dir()
-        if folder_path:
-            metadata = []
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, folder_path).replace('\\', '/')
-                    file_size = os.path.getsize(file_path)
-                    metadata.append({
-                        'path': relative_path,
-                        'size': file_size
-                    })
-                for dir in dirs:
-                    dir_path = os.path.join(root, dir)
-                    relative_path = os.path.relpath(dir_path, folder_path).replace('\\', '/')
-                    metadata.append({
-                        'path': relative_path + '/',
-                        'size': 0
-                    })
-            metadata.append({'base_folder_name': os.path.basename(folder_path), 'path': '.delete', 'size': 0})
-            metadata_json = json.dumps(metadata)
-            metadata_file_path = os.path.join(temp_dir, 'metadata.json')
-            with open(metadata_file_path, 'w') as f:
-                f.write(metadata_json)
-            self.metadata_created = True
-            return metadata_file_path
-        elif file_paths:
-            metadata = []
-            for file_path in file_paths:
-                file_size = os.path.getsize(file_path)
-                metadata.append({
-                    'path': os.path.basename(file_path),
-                    'size': file_size
-                })
-            metadata_json = json.dumps(metadata)
-            metadata_file_path = os.path.join(temp_dir, 'metadata.json')
-            with open(metadata_file_path, 'w') as f:
-                f.write(metadata_json)
-            self.metadata_created = True
-            return metadata_file_path
-            
-    def send_folder(self, folder_path):
-        print("Sending folder")
-        #com.an.Datadash
-        
-        if not self.metadata_created:
-            metadata_file_path = self.create_metadata(folder_path=folder_path)
-            metadata = json.loads(open(metadata_file_path).read())
-            self.send_file(metadata_file_path)
-
-        for file_info in metadata:
-            relative_file_path = file_info['path']
-            file_path = os.path.join(folder_path, relative_file_path)
-            if not relative_file_path.endswith('.delete'):
-                if file_info['size'] > 0:
-                    if self.encryption_flag:
-                        relative_file_path += ".crypt"
-                    self.send_file(file_path, relative_file_path=relative_file_path, encrypted_transfer=self.encryption_flag)
-
-        os.remove(metadata_file_path)
-
-    def send_file(self, file_path, relative_file_path=None, encrypted_transfer=False):
-        logger.debug("Sending file: %s", file_path)
-
-        if encrypted_transfer:
-            logger.debug("Encrypted transfer with password: %s", self.password)
-            file_path = encrypt_file(file_path, self.password)
-
-        sent_size = 0
-        file_size = os.path.getsize(file_path)
-        if relative_file_path is None:
-            relative_file_path = os.path.basename(file_path)
-        file_name_size = len(relative_file_path.encode())
-        logger.debug("Sending %s, %s", relative_file_path, file_size)
-
-        encryption_flag = 'encyp: t' if encrypted_transfer else 'encyp: f'
-
-        self.client_skt.send(encryption_flag.encode())
-        logger.debug("Sent encryption flag: %s", encryption_flag)
-
-        self.client_skt.send(struct.pack('<Q', file_name_size))
-        self.client_skt.send(relative_file_path.encode('utf-8'))
-        self.client_skt.send(struct.pack('<Q', file_size))
-        #com.an.Datadash
 
-        with open(file_path, 'rb') as f:
-            while sent_size < file_size:
-                data = f.read(4096)
-                self.client_skt.sendall(data)
-                sent_size += len(data)
-                self.progress_update.emit(sent_size * 100 // file_size)
+    def on_queue(self, files):
+        self.queue_changed.emit(files)
 
-        if encrypted_transfer:
-            os.remove(file_path)
+    def on_error(self, title, message, details=''):
+        self.error_occurred.emit(title, message, details)
 
-        return True
-    
-    def closeEvent(self, event):
-        #close all sockets and unbind the sockets
-        self.client_skt.close()
-        event.accept()
+    def prioritize(self, name, priority):
+        return self.core.prioritize(name, priority)
 
     def stop(self):
-        """Sets the stop signal to True and closes the socket if it's open."""
+        """Cancels the transfer; its sockets are closed as it unwinds."""
         self.stop_signal = True
-        if self.client_skt:
-            try:
-                self.client_skt.close()
-            except Exception as e:
-                logger.error(f"Error while closing socket: {e}")
+        if self.future:
+            self.future.cancel()
 
 class SendApp(QWidget):
 
@@ -303,6 +145,32 @@ class SendApp(QWidget):
         """)
         content_layout.addWidget(self.file_path_display)
 
+        # Files still to send, in place of the selection while sending; any of them can be moved up
+        self.queue_list = QListWidget()
+        self.queue_list.setStyleSheet("""
+            QListWidget {
+                background-color: #2f3642;
+                color: white;
+                border: 1px solid #4b5562;
+                border-radius: 5px;
+                padding: 5px;
+            }
+        """)
+        self.queue_list.setVisible(False)
+        content_layout.addWidget(self.queue_list)
+
+        queue_button_layout = QHBoxLayout()
+        self.send_next_button = self.create_styled_button('Send Next')
+        self.send_next_button.clicked.connect(lambda: self.prioritizeSelected(PINNED))
+        queue_button_layout.addWidget(self.send_next_button)
+
+        self.send_now_button = self.create_styled_button('Send Now')
+        self.send_now_button.clicked.connect(lambda: self.prioritizeSelected(URGENT))
+        queue_button_layout.addWidget(self.send_now_button)
+        content_layout.addLayout(queue_button_layout)
+        self.send_next_button.setVisible(False)
+        self.send_now_button.setVisible(False)
+
         # Password input (if encryption is enabled)
         if get_config()["encryption"]:
             password_layout = QHBoxLayout()
@@ -363,6 +231,12 @@ class SendApp(QWidget):
         self.mainmenu_button.clicked.connect(self.openMainWindow)
         content_layout.addWidget(self.mainmenu_button)
 
+        # Next batch over the same session, without a new handshake
+        self.send_more_button = self.create_styled_button_close('Send More Files')
+        self.send_more_button.setVisible(False)
+        self.send_more_button.clicked.connect(self.sendMoreFiles)
+        content_layout.addWidget(self.send_more_button)
+
         main_layout.addLayout(content_layout)
         self.setLayout(main_layout)
 
@@ -517,55 +391,7 @@ class SendApp(QWidget):
         if get_config()["encryption"]:
             password = self.password_input.text()
             if not password:
-                msg_box = QMessageBox(self)
-                msg_box.setWindowTitle("Input Error")
-                msg_box.setText("Please Enter a Password.")
-                msg_box.setIcon(QMessageBox.Icon.Critical)
-                msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
-
-                # Apply custom style with gradient background
-                msg_box.setStyleSheet("""
-                    QMessageBox {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 1,
-                            stop: 0 #b0b0b0,
-                            stop: 1 #505050
-                        );
-                        color: #FFFFFF;
-                        font-size: 16px;
-                    }
-                    QLabel {
-                    background-color: transparent; /* Make the label background transparent */
-                    }
-                    QPushButton {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(47, 54, 66, 255),
-                            stop: 1 rgba(75, 85, 98, 255)
-                        );
-                        color: white;
-                        border-radius: 10px;
-                        border: 1px solid rgba(0, 0, 0, 0.5);
-                        padding: 4px;
-                        font-size: 16px;
-                    }
-                    QPushButton:hover {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(60, 68, 80, 255),
-                            stop: 1 rgba(90, 100, 118, 255)
-                        );
-                    }
-                    QPushButton:pressed {
-                        background: qlineargradient(
-                            x1: 0, y1: 0, x2: 1, y2: 0,
-                            stop: 0 rgba(35, 41, 51, 255),
-                            stop: 1 rgba(65, 75, 88, 255)
-                        );
-                    }
-                """)
-                msg_box.exec()
-            
+                self.showErrorBox("Input Error", "Please Enter a Password.")
                 return
 
         self.send_button.setVisible(False)
@@ -573,21 +399,139 @@ class SendApp(QWidget):
         self.file_sender = FileSender(self.ip_address, self.file_paths, password, self.receiver_data)
         self.progress_bar.setVisible(True)
         self.file_sender.progress_update.connect(self.updateProgressBar)
+        self.file_sender.progress_details.connect(self.updateProgressDetails)
         self.file_sender.file_send_completed.connect(self.fileSent)
         self.file_sender.transfer_finished.connect(self.onTransferFinished)
+        self.file_sender.queue_changed.connect(self.updateQueue)
+        self.file_sender.error_occurred.connect(self.onTransferError)
+        self.file_path_display.setVisible(False)
+        self.queue_list.clear()
+        self.queue_list.setVisible(True)
+        self.send_next_button.setVisible(True)
+        self.send_now_button.setVisible(True)
         self.file_sender.start()
         #com.an.Datadash
 
+    def showErrorBox(self, title, message, details=''):
+        msg_box = QMessageBox(self)
+        msg_box.setWindowTitle(title)
+        msg_box.setText(message)
+        if details:
+            msg_box.setDetailedText(details)
+        msg_box.setIcon(QMessageBox.Icon.Critical)
+        msg_box.setStandardButtons(QMessageBox.StandardButton.Ok)
+
+        # Apply custom style with gradient background
+        msg_box.setStyleSheet("""
+            QMessageBox {
+                background: qlineargradient(
+                    x1: 0, y1: 0, x2: 1, y2: 1,
+                    stop: 0 #b0b0b0,
+                    stop: 1 #505050
+                );
+                color: #FFFFFF;
+                font-size: 16px;
+            }
+            QLabel {
+            background-color: transparent; /* Make the label background transparent */
+            }
+            QPushButton {
+                background: qlineargradient(
+                    x1: 0, y1: 0, x2: 1, y2: 0,
+                    stop: 0 rgba(47, 54, 66, 255),
+                    stop: 1 rgba(75, 85, 98, 255)
+                );
+                color: white;
+                border-radius: 10px;
+                border: 1px solid rgba(0, 0, 0, 0.5);
+                padding: 4px;
+                font-size: 16px;
+            }
+            QPushButton:hover {
+                background: qlineargradient(
+                    x1: 0, y1: 0, x2: 1, y2: 0,
+                    stop: 0 rgba(60, 68, 80, 255),
+                    stop: 1 rgba(90, 100, 118, 255)
+                );
+            }
+            QPushButton:pressed {
+                background: qlineargradient(
+                    x1: 0, y1: 0, x2: 1, y2: 0,
+                    stop: 0 rgba(35, 41, 51, 255),
+                    stop: 1 rgba(65, 75, 88, 255)
+                );
+            }
+        """)
+        msg_box.exec()
+
     def updateProgressBar(self, value):
         self.progress_bar.setValue(value)
 
+    def updateProgressDetails(self, snapshot):
+        self.progress_bar.setFormat(format_progress(snapshot))
+        if snapshot['file_name']:
+            self.status_label.setText(
+                f"Sending {snapshot['file_name']} ({snapshot['files_done']}/{snapshot['total_files']} files)")
+
+    def updateQueue(self, files):
+        selected = self.queue_list.currentItem()
+        selected_name = selected.data(Qt.ItemDataRole.UserRole) if selected else None
+        self.queue_list.clear()
+        for file_info in files:
+            text = f"{file_info['name']}  ({file_info['size'] / (1024 * 1024):.1f} MB)"
+            if file_info['state'] == 'sending':
+                text = f"Sending: {text}"
+            elif file_info['state'] == 'interrupted':
+                text = f"Paused: {text}"
+            elif file_info['priority'] == URGENT:
+                text += "  - now"
+            elif file_info['priority'] == PINNED:
+                text += "  - next"
+            item = QListWidgetItem(text)
+            item.setData(Qt.ItemDataRole.UserRole, file_info['name'])
+            if file_info['state'] != 'waiting':
+                # Already on its way
+                item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsSelectable)
+            self.queue_list.addItem(item)
+            if file_info['name'] == selected_name and file_info['state'] == 'waiting':
+                self.queue_list.setCurrentItem(item)
+
+    def prioritizeSelected(self, priority):
+        item = self.queue_list.currentItem()
+        if item:
+            self.file_sender.prioritize(item.data(Qt.ItemDataRole.UserRole), priority)
+
     def fileSent(self, file_path):
         self.status_label.setText(f"File sent: {file_path}")
 
     def onTransferFinished(self):
+        self.hideQueue()
         self.close_button.setVisible(True)
+        self.send_more_button.setVisible(bool((self.receiver_data or {}).get("sessions")))
         self.status_label.setText("File transfer completed!")
         self.status_label.setStyleSheet("color: white; font-size: 18px; background-color: transparent;")
+
+    def onTransferError(self, title, message, details):
+        self.hideQueue()
+        self.close_button.setVisible(True)
+        self.status_label.setText("File transfer failed.")
+        self.status_label.setStyleSheet("color: #ff6b6b; font-size: 18px; background-color: transparent;")
+        self.showErrorBox(title, message, details)
+
+    def hideQueue(self):
+        self.queue_list.setVisible(False)
+        self.send_next_button.setVisible(False)
+        self.send_now_button.setVisible(False)
+        self.file_path_display.setVisible(True)
+
+    def sendMoreFiles(self):
+        self.file_paths = []
+        self.file_path_display.clear()
+        self.progress_bar.setValue(0)
+        self.progress_bar.setVisible(False)
+        self.status_label.setText("")
+        self.close_button.setVisible(False)
+        self.send_more_button.setVisible(False)
             
 
     def closeEvent(self, event):
@@ -599,6 +543,7 @@ class SendApp(QWidget):
         except Exception as e:
             pass
         finally:
+            close_session(self.ip_address)
             event.accept()
 
     def stop(self):
@@ -1,216 +1,20 @@
-import json
 import platform
-import tempfile
-from pathlib import Path
 from PyQt6.QtWidgets import (
     QMessageBox, QWidget, QVBoxLayout, QPushButton, QListWidget, 
     QProgressBar, QLabel, QFileDialog, QApplication, QListWidgetItem, QTextEdit, QLineEdit, QHBoxLayout, QFrame
 )
 from PyQt6.QtGui import QScreen, QFont, QKeyEvent, QKeySequence
 import os
-import socket
-import struct
-from PyQt6.QtCore import QThread, pyqtSignal, Qt
+from PyQt6.QtCore import Qt
 from constant import get_config, logger
-from crypt_handler import encrypt_file
-from time import sleep
+from file_sender import FileSender
+from progress import format_progress
 
-RECEIVER_DATA = 57341
+class FileSenderSwift(FileSender):
+    """Sends to the iOS app, which only speaks the legacy protocol and has no queue to reorder."""
+    encryption_setting = 'swift_encryption'
+    interactive_queue = False
 
-class FileSenderSwift(QThread):
-    progress_update = pyqtSignal(int)
-    file_send_completed = pyqtSignal(str)
-    config = get_config()
-    password = None
-
-    def __init__(self, ip_address, file_paths, password=None, receiver_data=None):
-        super().__init__()
-        self.ip_address = ip_address
-        self.file_paths = file_paths
-        self.password = password
-        self.receiver_data = receiver_data
-        #com.an.Datadash
-
-    def initialize_connection(self):
-        try:
-            if hasattr(self, 'client_skt'):
-                self.client_skt.close()
-                logger.debug("Socket closed successfully before rebinding.")
-            sleep(1)  # Wait for socket cleanup
-            
-            self.client_skt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_skt.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.client_skt.settimeout(30)  # 30 second timeout
-            
-            self.client_skt.connect((self.ip_address, 57341))
-            logger.debug(f"Successfully connected to {self.ip_address} on port 57341")
-            return True
-            
-        except (ConnectionRefusedError, OSError) as e:
-            logger.error(f"Connection failed: {e}")
-            self.show_message_box("Connection Error", f"Failed to connect: {e}")
-            return False
-
-    def run(self):
-        metadata_file_path = None
-        self.metadata_created = False
-        metadata_file_path = None
-        if not self.initialize_connection():
-            return
-        
-        # Reload config on each file transfer session
-        self.config = get_config()
-
-        self.encryption_flag = self.config['swift_encryption']
-        # logger.debug("Encryption flag: %s", self.encryption_flag)
-
-        for file_path in self.file_paths:
-            if os.path.isdir(file_path):
-                self.send_folder(file_path)
-            else:
-                if not self.metadata_created:
-                    metadata_file_path = self.create_metadata(file_paths=self.file_paths)
-                    self.send_file(metadata_file_path)
-                self.send_file(file_path, encrypted_transfer=self.encryption_flag)
-        
-        # Delete metadata file
-        if self.metadata_created and metadata_file_path:
-            os.remove(metadata_file_path)
-            
-        logger.debug("Sent halt signal")
-        self.client_skt.send('encyp: h'.encode())
-        self.client_skt.close()
-
-    def get_temp_dir(self):
-        system = platform.system()
-        if system == "Windows":
-            temp_dir = Path(os.getenv('LOCALAPPDATA')) / 'Temp' / 'DataDash'
-        elif system == "Darwin":  # macOS
-            temp_dir = Path.home() / 'Library' / 'Caches' / 'DataDash'
-        elif system == "Linux":  # Linux and others
-            temp_dir = Path.home() / '.cache' / 'DataDash'
-        else:
-            logger.error(f"Unsupported platform: {system}")
-        
-        try:
-            os.makedirs(str(temp_dir), exist_ok=True)
-            logger.debug(f"Created/verified temp directory: {temp_dir}")
-        except Exception as e:
-            logger.error(f"Failed to create temp directory: {e}")
-            # Fallback to system temp directory
-            temp_dir = Path(tempfile.gettempdir()) / 'DataDash'
-            os.makedirs(str(temp_dir), exist_ok=True)
-            logger.debug(f"Using fallback temp directory: {temp_dir}")
-        
-        return temp_dir
-
-    def create_metadata(self, folder_path=None,file_paths=None):
-        temp_dir = self.get_temp_dir()
-        if folder_path:
-            metadata = []
-            for root, dirs, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, folder_path)
-                    file_size = os.path.getsize(file_path)
-                    metadata.append({
-                        'path': relative_path,
-                        'size': file_size
-                    })
-                for dir in dirs:
-                    dir_path = os.path.join(root, dir)
-                    relative_path = os.path.relpath(dir_path, folder_path)
-                    metadata.append({
-                        'path': relative_path + '/',
-                        'size': 0  # Size is 0 for directories
-                    })
-            metadata.append({'base_folder_name': os.path.basename(folder_path), 'path': '.delete', 'size': 0})
-            metadata_json = json.dumps(metadata)
-            metadata_file_path = os.path.join(temp_dir, 'metadata.json')
-            with open(metadata_file_path, 'w') as f:
-                f.write(metadata_json)
-            self.metadata_created = True
-            return metadata_file_path
-        elif file_paths:
-            metadata = []
-            for file_path in file_paths:
-                file_size = os.path.getsize(file_path)
-                metadata.append({
-                    'path': os.path.basename(file_path),
-                    'size': file_size
-                })
-            metadata_json = json.dumps(metadata)
-            metadata_file_path = os.path.join(temp_dir, 'metadata.json')
-            with open(metadata_file_path, 'w') as f:
-                f.write(metadata_json)
-            self.metadata_created = True
-            return metadata_file_path
-            
-    def send_folder(self, folder_path):
-        print("Sending folder")
-        
-        if not self.metadata_created:
-            metadata_file_path = self.create_metadata(folder_path=folder_path)
-            metadata = json.loads(open(metadata_file_path).read())
-            # Send metadata file
-            self.send_file(metadata_file_path)
-            #com.an.Datadash
-
-        # Send all files
-        for file_info in metadata:
-            relative_file_path = file_info['path']
-            file_path = os.path.join(folder_path, relative_file_path)
-            if not relative_file_path.endswith('.delete'):
-                if file_info['size'] > 0:
-                    if self.encryption_flag:
-                        relative_file_path += ".crypt"
-                    self.send_file(file_path, relative_file_path=relative_file_path, encrypted_transfer=self.encryption_flag)
-                else:
-                    # Handle directory creation (if needed, in receiver)
-                    pass
-
-        # Clean up metadata file
-        os.remove(metadata_file_path)
-
-    def send_file(self, file_path, relative_file_path=None, encrypted_transfer=False):
-        logger.debug("Sending file: %s", file_path)
-        # if self.metadata_created:
-        #     self.createmetadata(file_path=file_path)
-
-        # Encrypt the file if encrypted_transfer argument is present
-        if encrypted_transfer:
-            logger.debug("Encrypted transfer with password: %s", self.password)
-
-            file_path = encrypt_file(file_path, self.password)
-
-        sent_size = 0
-        file_size = os.path.getsize(file_path)
-        if relative_file_path is None:
-            relative_file_path = os.path.basename(file_path)  # Default to the base name if relative path isn't provided
-        file_name_size = len(relative_file_path.encode())
-        logger.debug("Sending %s, %s", relative_file_path, file_size)
-
-        encryption_flag = 'encyp: t' if encrypted_transfer else 'encyp: f'
-
-        self.client_skt.send(encryption_flag.encode())
-        logger.debug("Sent encryption flag: %s", encryption_flag)
-
-        # Send the relative file path size and the path
-        self.client_skt.send(struct.pack('<Q', file_name_size))
-        self.client_skt.send(relative_file_path.encode('utf-8'))
-        self.client_skt.send(struct.pack('<Q', file_size))
-
-        with open(file_path, 'rb') as f:
-            while sent_size < file_size:
-                data = f.read(4096)
-                self.client_skt.sendall(data)
-                sent_size += len(data)
-                self.progress_update.emit(sent_size * 100 // file_size)
-
-        if encrypted_transfer:
-            os.remove(file_path)
-
-        return True
 
 class Receiver(QListWidgetItem):
     def __init__(self, name, ip_address):
@@ -461,7 +265,6 @@ class SendAppSwift(QWidget):
             self.file_path_display.clear()
             self.file_path_display.append(folder_path)
             self.file_paths = [folder_path]
-            print(self.file_paths)
             self.checkReadyToSend()
 
     def get_default_path(self):
@@ -487,7 +290,6 @@ class SendAppSwift(QWidget):
             QMessageBox.critical(None, "Selection Error", "Please select a device to send the file.")
             return
         ip_address = self.ip_address
-        print(self.file_paths)
 
         if self.config['swift_encryption']:
             password = self.password_input.text()
@@ -499,7 +301,9 @@ class SendAppSwift(QWidget):
         self.file_sender_swift = FileSenderSwift(ip_address, self.file_paths, password, self.receiver_data)
         self.progress_bar.setVisible(True)
         self.file_sender_swift.progress_update.connect(self.updateProgressBar)
+        self.file_sender_swift.progress_details.connect(self.updateProgressDetails)
         self.file_sender_swift.file_send_completed.connect(self.fileSent)
+        self.file_sender_swift.error_occurred.connect(self.onTransferError)
         self.file_sender_swift.start()
         #com.an.Datadash
 
@@ -515,16 +319,29 @@ class SendAppSwift(QWidget):
             self.close_button.setVisible(True)
             # self.mainmenu_button.setVisible(True)
 
+    def updateProgressDetails(self, snapshot):
+        self.progress_bar.setFormat(format_progress(snapshot))
+        # The last snapshot arrives after updateProgressBar() said the transfer completed
+        if snapshot['file_name'] and snapshot['percent'] < 100:
+            self.status_label.setText(
+                f"Sending {snapshot['file_name']} ({snapshot['files_done']}/{snapshot['total_files']} files)")
+
 
     def fileSent(self, file_path):
         self.status_label.setText(f"File sent: {file_path}")
 
+    def onTransferError(self, title, message, details):
+        self.close_button.setEnabled(True)
+        self.close_button.setVisible(True)
+        self.status_label.setText("File transfer failed.")
+        QMessageBox.critical(self, title, f"{message}\n\n{details}" if details else message)
+
     def closeEvent(self, event):
         try:
             """Override the close event to ensure everything is stopped properly."""
-            if self.file_sender and self.file_sender.isRunning():
-                self.file_sender.stop()  # Signal the sender to stop
-                self.file_sender.wait()  # Wait until the thread fully stops
+            if self.file_sender_swift and self.file_sender_swift.isRunning():
+                self.file_sender_swift.stop()  # Signal the sender to stop
+                self.file_sender_swift.wait()  # Wait until the thread fully stops
         except Exception as e:
             pass
         finally:
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import struct
+from collections import namedtuple
+from transfer_io import recv_exact, recv_exact_async
+
+# Framed protocol versions this build speaks, advertised as "protocols" in the
+# RECEIVER_JSON handshake. Version 0 is the legacy 'encyp: x' stream.
+SUPPORTED_PROTOCOLS = [1]
+LEGACY_PROTOCOL = 0
+
+# Every frame starts with this fixed header; the first two bytes can never be
+# the start of a legacy 'encyp: x' flag, so receivers can accept both.
+FRAME_MAGIC = b'DF'
+# magic, version, type, flags, streams, file id, offset, length, name length
+_FRAME_HEADER = struct.Struct('<2sBBHHIQQI')
+FRAME_HEADER_SIZE = _FRAME_HEADER.size
+
+# Frame types
+FRAME_FILE = 1      # announce file `file_id`: total size `length`, body starts at `offset`
+FRAME_DATA = 2      # `length` bytes of an announced file at `offset` follow
+FRAME_RESUME = 3    # `length` bytes of JSON follow (resume query or reply)
+FRAME_HALT = 4      # end of the batch
+FRAME_PACK = 5      # `file_id` small files back to back: `offset` bytes of JSON index, then the bodies
+FRAME_HELLO = 6     # first frame of a session connection, the session token in `name`
+FRAME_DIGEST = 7    # block digests of file `file_id`: `length` bytes follow, one per `offset` bytes of file
+FRAME_VERIFY = 8    # `length` bytes of JSON follow: the sender's manifest, or the receiver's verdict on it
+FRAME_SYNC = 9      # sync mode: `length` bytes of JSON follow (query, or which files the receiver already has)
+
+# FRAME_FILE flags
+FLAG_ENCRYPTED = 0x01
+FLAG_INLINE = 0x02      # body (length - offset bytes) follows the name directly
+FLAG_PARALLEL = 0x04    # body arrives over `streams` range connections
+FLAG_REPAIR = 0x08      # rewrites ranges of a file already on the receiver in place, as FRAME_DATA chunks
+FLAG_DIGEST = 0x10      # FRAME_DIGEST follows once the body is complete
+FLAG_COMPRESSED = 0x20  # the inline body is a series of compressed blocks (see compression.py)
+# FRAME_DATA flags
+FLAG_LAST = 0x01        # last chunk: the file is complete after it
+
+# Names longer than this are refused rather than allocated
+MAX_NAME_LENGTH = 64 * 1024
+# Frames and small bodies are gathered up to this size before one send
+COALESCE_LIMIT = 256 * 1024
+# Files up to PACK_FILE_SIZE travel in FRAME_PACK batches of about PACK_SIZE bytes
+PACK_FILE_SIZE = 64 * 1024
+PACK_SIZE = 4 * 1024 * 1024
+PACK_MAX_FILES = 4096
+# Packs larger than this are refused rather than buffered
+MAX_PACK_SIZE = 64 * 1024 * 1024
+
+Frame = namedtuple('Frame', 'version type flags streams file_id offset length name')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def negotiate_protocol(peer_data):
+    """Highest framed protocol both sides speak, or LEGACY_PROTOCOL."""
+    try:
+        common = set(SUPPORTED_PROTOCOLS) & set((peer_data or {}).get('protocols', []))
+    except TypeError:
+        return LEGACY_PROTOCOL
+    return max(common, default=LEGACY_PROTOCOL)
+
+
+def pack_frame(frame_type, file_id=0, offset=0, length=0, flags=0, streams=0, name=''):
+    encoded_name = name.encode('utf-8')
+    return _FRAME_HEADER.pack(FRAME_MAGIC, SUPPORTED_PROTOCOLS[-1], frame_type, flags, streams,
+                              file_id, offset, length, len(encoded_name)) + encoded_name
+
+
+def pack_legacy_header(flag, name, size, *extra):
+    """A legacy 'encyp: x' file header as one buffer; `extra` are trailing <Q fields."""
+    encoded_name = name.encode('utf-8')
+    return b''.join([flag.encode(), struct.pack('<Q', len(encoded_name)), encoded_name,
+                     struct.pack('<Q', size)] + [struct.pack('<Q', value) for value in extra])
+
+
+def is_frame(first_bytes):
+    return first_bytes[:len(FRAME_MAGIC)] == FRAME_MAGIC
+
+
+# The readers below are generators that yield how many bytes they need next
+# and are sent those bytes back, so one parser serves blocking sockets and
+# the asyncio transfer core alike.
+
+def _parse_frame(first_bytes):
+    header = first_bytes + (yield FRAME_HEADER_SIZE - len(first_bytes))
+    magic, version, frame_type, flags, streams, file_id, offset, length, name_length = \
+        _FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ProtocolError("Not a DataDash frame")
+    if version not in SUPPORTED_PROTOCOLS:
+        raise ProtocolError(f"Unsupported frame version {version}")
+    if name_length > MAX_NAME_LENGTH:
+        raise ProtocolError(f"File name of {name_length} bytes is too long")
+    if offset > length and frame_type == FRAME_FILE:
+        raise ProtocolError(f"Start offset {offset} is past the end of the file")
+    name = (yield name_length).decode('utf-8') if name_length else ''
+    return Frame(version, frame_type, flags, streams, file_id, offset, length, name)
+
+
+def _parse_legacy_header(flag):
+    kind = flag[-1:]
+    if kind == 'h':
+        return Frame(LEGACY_PROTOCOL, FRAME_HALT, 0, 0, 0, 0, 0, '')
+    if kind == 'r':
+        length = struct.unpack('<Q', (yield 8))[0]
+        return Frame(LEGACY_PROTOCOL, FRAME_RESUME, 0, 0, 0, 0, length, '')
+
+    name_length = struct.unpack('<Q', (yield 8))[0]
+    if name_length == 0:
+        return None
+    name = (yield name_length).decode()
+    size = struct.unpack('<Q', (yield 8))[0]
+    flags, streams, offset = FLAG_INLINE, 0, 0
+    if kind == 't':
+        flags |= FLAG_ENCRYPTED
+    elif kind == 'p':
+        flags = FLAG_PARALLEL
+        streams = struct.unpack('<Q', (yield 8))[0]
+    elif kind == 'o':
+        # Rest of a file an earlier connection delivered only partly
+        offset = struct.unpack('<Q', (yield 8))[0]
+    return Frame(LEGACY_PROTOCOL, FRAME_FILE, flags, streams, 0, offset, size, name)
+
+
+def _parse_pack(frame):
+    if frame.length > MAX_PACK_SIZE or frame.offset > frame.length:
+        raise ProtocolError(f"Pack of {frame.length} bytes refused")
+    data = memoryview((yield frame.length))
+    entries = []
+    position = frame.offset
+    # Senders verifying content add each file's hex digest as a fourth field
+    for name, flags, size, *digest in json.loads(bytes(data[:frame.offset]).decode('utf-8')):
+        if size < 0 or position + size > frame.length:
+            raise ProtocolError(f"Pack entry {name} runs past the end of the pack")
+        entries.append((name, flags, data[position:position + size], digest[0] if digest else None))
+        position += size
+    if len(entries) != frame.file_id or position != frame.length:
+        raise ProtocolError("Pack index does not match its contents")
+    return entries
+
+
+def _read(parser, sock):
+    try:
+        size = next(parser)
+        while True:
+            size = parser.send(recv_exact(sock, size))
+    except StopIteration as done:
+        return done.value
+
+
+async def _read_async(parser, sock):
+    try:
+        size = next(parser)
+        while True:
+            size = parser.send(await recv_exact_async(sock, size))
+    except StopIteration as done:
+        return done.value
+
+
+def read_frame(sock, first_bytes=b''):
+    """Read one frame header (and name) from `sock`; `first_bytes` were already read."""
+    return _read(_parse_frame(first_bytes), sock)
+
+
+async def read_frame_async(sock, first_bytes=b''):
+    return await _read_async(_parse_frame(first_bytes), sock)
+
+
+async def read_legacy_header_async(sock, flag):
+    """Translate a legacy header starting with the 8-byte `flag` into a Frame.
+
+    Returns None for the zero-length name some senders use to end a batch.
+    """
+    return await _read_async(_parse_legacy_header(flag), sock)
+
+
+def pack_files(entries):
+    """The parts of one FRAME_PACK holding `entries` of (name, flags, body, hex digest or None)."""
+    index = json.dumps([[name, flags, len(body)] + ([digest] if digest else [])
+                        for name, flags, body, digest in entries]).encode('utf-8')
+    length = len(index) + sum(len(body) for _, _, body, _ in entries)
+    header = pack_frame(FRAME_PACK, file_id=len(entries), offset=len(index), length=length)
+    return [header, index] + [body for _, _, body, _ in entries]
+
+
+async def read_pack_async(sock, frame):
+    """Read the payload of a FRAME_PACK and split it into (name, flags, body, hex digest or None) entries."""
+    return await _read_async(_parse_pack(frame), sock)
+
+
+class FrameWriter:
+    """Gathers frame headers and small bodies for one non-blocking socket into few sends."""
+
+    def __init__(self, sock, limit=COALESCE_LIMIT, throttle=None):
+        self.sock = sock
+        self.limit = limit
+        self.throttle = throttle
+        self.pending = []
+        self.pending_size = 0
+
+    async def write(self, *parts):
+        for part in parts:
+            self.pending.append(part)
+            self.pending_size += len(part)
+        if self.pending_size >= self.limit:
+            await self.flush()
+
+    async def flush(self):
+        if self.pending:
+            if self.throttle and self.throttle.limited():
+                await self.throttle.sendall(self.sock, b''.join(self.pending))
+            else:
+                await asyncio.get_running_loop().sock_sendall(self.sock, b''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
@@ -0,0 +1,159 @@
+"""Content digests that let a receiver verify every file it wrote.
+
+Files are hashed with BLAKE2b in INTEGRITY_BLOCK_SIZE blocks. A file's
+digest is the hash of its block digests, so a mismatch narrows down to
+the blocks that must be sent again instead of the whole file. A batch is
+summarized by a Manifest: a Merkle tree over the file digests with one
+node per directory, so two sides holding 100k files compare one root and
+only descend into the directories that differ.
+"""
+import hashlib
+import os
+
+# Advertised as "integrity" in the RECEIVER_JSON handshake
+INTEGRITY_ALGORITHM = 'blake2b-128'
+DIGEST_SIZE = 16
+INTEGRITY_BLOCK_SIZE = 4 * 1024 * 1024
+# Finer blocks for sync mode, where only changed blocks of a file cross the wire
+SYNC_BLOCK_SIZE = 128 * 1024
+# Reads when a file has to be hashed from disk (page cache, in practice)
+HASH_READ_SIZE = 1024 * 1024
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+class BlockHasher:
+    """Incremental per-block digests; update() takes the bytes of a file in order."""
+
+    def __init__(self, block_size=INTEGRITY_BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks = []
+        self.current = _new_hash()
+        self.filled = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while data:
+            take = min(len(data), self.block_size - self.filled)
+            self.current.update(data[:take])
+            self.filled += take
+            data = data[take:]
+            if self.filled == self.block_size:
+                self.blocks.append(self.current.digest())
+                self.current = _new_hash()
+                self.filled = 0
+
+    def digests(self):
+        """The block digests concatenated; an empty file has one, of no bytes."""
+        if self.filled or not self.blocks:
+            return b''.join(self.blocks) + self.current.digest()
+        return b''.join(self.blocks)
+
+
+def file_digest(block_digests):
+    return hashlib.blake2b(block_digests, digest_size=DIGEST_SIZE).digest()
+
+
+def hash_file(path, length=None, block_size=INTEGRITY_BLOCK_SIZE):
+    """BlockHasher fed with the first `length` bytes of `path` (all of it by default)."""
+    hasher = BlockHasher(block_size)
+    buffer = memoryview(bytearray(HASH_READ_SIZE))
+    remaining = os.path.getsize(path) if length is None else length
+    with open(path, 'rb', buffering=0) as f:
+        while remaining > 0:
+            n = f.readinto(buffer[:min(HASH_READ_SIZE, remaining)])
+            if not n:
+                break
+            hasher.update(buffer[:n])
+            remaining -= n
+    return hasher
+
+
+def damaged_ranges(expected, actual, size, block_size=INTEGRITY_BLOCK_SIZE):
+    """(offset, length) ranges of a `size` byte file whose blocks in `actual` differ or are missing, adjacent ones merged.
+
+    `expected` are the digests of the wanted content; `actual` may come
+    from an older version of the file, longer or shorter than `size`.
+    """
+    ranges = []
+    for index in range(0, len(expected), DIGEST_SIZE):
+        if expected[index:index + DIGEST_SIZE] == actual[index:index + DIGEST_SIZE]:
+            continue
+        offset = index // DIGEST_SIZE * block_size
+        length = min(block_size, size - offset)
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
+
+
+class Manifest:
+    """Merkle tree over the files of a batch, keyed by their wire names ("folder/sub/name").
+
+    Each directory node hashes its sorted entries: files by digest,
+    subdirectories by their own node. nodes() maps every directory ('' is
+    the root) to its hex digest.
+    """
+
+    def __init__(self):
+        self.files = {}
+
+    def add(self, name, digest):
+        self.files[name] = digest
+
+    def nodes(self):
+        entries = {'': {}}
+        for name, digest in self.files.items():
+            directory, _, base = name.rpartition('/')
+            entries.setdefault(directory, {})[base] = (b'f', digest)
+            # Link the directory into its parents, up to the first one already linked
+            while directory:
+                parent, _, base = directory.rpartition('/')
+                siblings = entries.setdefault(parent, {})
+                if base in siblings:
+                    break
+                siblings[base] = (b'd', directory)
+                directory = parent
+        nodes = {}
+        # Deepest directories first, so every subdirectory is hashed before its parent
+        for directory in sorted(entries, key=lambda path: path.count('/') + bool(path), reverse=True):
+            node = _new_hash()
+            for name in sorted(entries[directory]):
+                kind, value = entries[directory][name]
+                digest = bytes.fromhex(nodes[value]) if kind == b'd' else value
+                node.update(kind + name.encode('utf-8') + b'\0' + digest)
+            nodes[directory] = node.hexdigest()
+        return nodes
+
+    def root(self):
+        return self.nodes()['']
+
+    @staticmethod
+    def differing(ours, theirs):
+        """Directories whose nodes differ, reached from the root through differing nodes only."""
+        if ours.get('') == theirs.get(''):
+            return []
+        subdirectories = {}
+        for path in set(ours) | set(theirs):
+            if path:
+                subdirectories.setdefault(path.rpartition('/')[0], []).append(path)
+        result = []
+        pending = ['']
+        while pending:
+            directory = pending.pop()
+            result.append(directory)
+            pending.extend(path for path in subdirectories.get(directory, ())
+                           if ours.get(path) != theirs.get(path))
+        return result
+
+    def in_directories(self, directories):
+        """{name: hex digest} of the files directly inside `directories`."""
+        wanted = set(directories)
+        return {name: digest.hex() for name, digest in self.files.items() if name.rpartition('/')[0] in wanted}
+
+
+class IntegrityError(Exception):
+    """Files still differed from the sender's after every retransmit."""
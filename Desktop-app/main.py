@@ -4,13 +4,13 @@ from PyQt6.QtGui import QScreen, QFont, QColor, QIcon, QMovie
 from PyQt6.QtCore import Qt, QTimer, QSize, QThread, pyqtSignal
 import sys
 import os
-from file_receiver import ReceiveApp
-from broadcast import Broadcast
-from preferences import PreferencesApp
-from constant import logger, get_config
+from constant import logger, get_config, subscribe_config
 import platform
-import requests
-import ctypes
+
+# The update check starts this long after the main window, so it never delays the first paint
+UPDATE_CHECK_DELAY_MS = 1000
+# Seconds before an unanswered update check gives up
+UPDATE_CHECK_TIMEOUT = 10
 
 class VersionCheck(QThread):
     update_available = pyqtSignal()
@@ -27,11 +27,13 @@ class VersionCheck(QThread):
             self.update_available.emit()
 
     def fetch_platform_value(self):
+        # requests (and urllib3 behind it) is one of the slowest imports; only this thread needs it
+        import requests
         url = self.get_platform_link()
         logger.info(f"Fetching platform value from: {url}")
         
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=UPDATE_CHECK_TIMEOUT)
             response.raise_for_status()
 
             data = response.json()
@@ -97,10 +99,11 @@ class MainApp(QWidget):
         self.setGeometry(100, 100, 853, 480)
         self.center_window()
         self.set_background()
+        subscribe_config(self.on_config_changed)
         self.version_thread = VersionCheck()
         self.version_thread.update_available.connect(self.showmsgbox)
         if not skip_version_check:
-            self.check_update()
+            QTimer.singleShot(UPDATE_CHECK_DELAY_MS, self.check_update)
 
         main_layout = QVBoxLayout()
         main_layout.setContentsMargins(0, 0, 0, 0)
@@ -265,6 +268,12 @@ class MainApp(QWidget):
             os.makedirs(dest)
             logger.info("Created folder to receive files")
 
+    def on_config_changed(self, config, changed):
+        # A new receive folder picked in Preferences must exist before the next transfer
+        if "save_to_directory" in changed and config["save_to_directory"]:
+            os.makedirs(config["save_to_directory"], exist_ok=True)
+            logger.info("Created folder to receive files")
+
     def sendFile(self):
         # Check if warnings should be shown
         if get_config()["show_warning"]:
@@ -326,12 +335,14 @@ class MainApp(QWidget):
             if send_dialog.clickedButton() == proceed_button:
                 logger.info("Started Send File App")
                 self.hide()
+                from broadcast import Broadcast
                 self.broadcast_app = Broadcast()
                 self.broadcast_app.show()
                 #com.an.Datadash
         else:
             logger.info("Started Send File App without warning")
             self.hide()
+            from broadcast import Broadcast
             self.broadcast_app = Broadcast()
             self.broadcast_app.show()
 
@@ -379,6 +390,7 @@ class MainApp(QWidget):
                 return
 
         self.hide()
+        from file_receiver import ReceiveApp
         self.receive_window = ReceiveApp()
         self.receive_window.show()
 
@@ -386,6 +398,7 @@ class MainApp(QWidget):
     def preferences_handler(self):
         logger.info("Started Preferences handler menu")
         self.hide()
+        from preferences import PreferencesApp
         self.preferences_app = PreferencesApp()
         self.preferences_app.show()
 
@@ -462,6 +475,7 @@ class MainApp(QWidget):
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     if platform.system() == 'Windows':
+        import ctypes
         try:
             is_admin = ctypes.windll.shell32.IsUserAnAdmin()
         except:
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import socket
+import struct
+import threading
+from constant import logger
+from transfer_io import (
+    RECEIVE_BUFFER_SIZE, allocate_receive_buffer, recv_exact_async, send_file_data_async
+)
+
+# Upper bound for parallel data connections per file, on either side
+MAX_PARALLEL_STREAMS = 8
+# Files smaller than this always go over the single main connection
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+# Sent first on every extra connection: offset and length of its byte range
+_RANGE_HEADER = struct.Struct('<QQ')
+
+
+def negotiate_streams(local_streams, peer_data):
+    """Streams to use with a peer, from our setting and its RECEIVER_JSON handshake data.
+
+    Peers that do not advertise "streams" (older desktop builds, mobile apps)
+    only get the single legacy connection.
+    """
+    peer_streams = (peer_data or {}).get('streams', 1)
+    try:
+        return max(1, min(int(local_streams), int(peer_streams), MAX_PARALLEL_STREAMS))
+    except (TypeError, ValueError):
+        return 1
+
+
+def split_ranges(size, streams):
+    """Split `size` bytes into `streams` contiguous (offset, length) ranges."""
+    base, extra = divmod(size, streams)
+    ranges = []
+    offset = 0
+    for i in range(streams):
+        length = base + (1 if i < extra else 0)
+        ranges.append((offset, length))
+        offset += length
+    return ranges
+
+
+class _ProgressCounter:
+    def __init__(self, callback):
+        self.callback = callback
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, n):
+        with self.lock:
+            self.total += n
+            total = self.total
+        if self.callback:
+            self.callback(total)
+
+
+async def _run_all_async(coroutines):
+    """Await every coroutine concurrently; on the first failure cancel the rest and re-raise it."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def send_file_parallel_async(ip_address, port, file_path, file_size, streams, progress_callback=None,
+                                   hello=b'', throttle=None):
+    """Send `file_path` as `streams` byte ranges, each over its own new connection, on the running event loop.
+
+    The caller has already announced the file and the stream count on the
+    main connection; the receiver accepts exactly that many connections.
+    `hello` opens each of them so the receiver can route it to the session.
+    """
+    loop = asyncio.get_running_loop()
+    progress = _ProgressCounter(progress_callback)
+
+    async def send_range(offset, length):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as skt:
+            skt.setblocking(False)
+            await loop.sock_connect(skt, (ip_address, port))
+            await loop.sock_sendall(skt, hello + _RANGE_HEADER.pack(offset, length))
+            last = 0
+
+            def report(sent):
+                nonlocal last
+                progress.add(sent - last)
+                last = sent
+
+            await send_file_data_async(skt, file_path, progress_callback=report, offset=offset, count=length,
+                                       throttle=throttle)
+
+    await _run_all_async([send_range(o, n) for o, n in split_ranges(file_size, streams)])
+    logger.debug("Sent %s over %d parallel streams", file_path, streams)
+    return progress.total
+
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    # Windows has no pwrite; serialise the seek + write pair instead
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+
+
+async def receive_file_parallel(listener, f, file_size, streams, peer_ip=None,
+                                buffer_size=RECEIVE_BUFFER_SIZE, progress_callback=None):
+    """Accept `streams` range connections from `listener` and write each range at its offset.
+
+    `listener` is the sender's SenderListener. `f` must be opened for binary
+    writing; it is sized up front so ranges can land in any order.
+    Connections from other hosts than `peer_ip` are refused.
+    """
+    if streams < 1 or streams > MAX_PARALLEL_STREAMS:
+        raise ValueError(f"Unsupported stream count: {streams}")
+
+    loop = asyncio.get_running_loop()
+    f.truncate(file_size)
+    f.flush()
+    fd = f.fileno()
+    seek_lock = threading.Lock()
+    progress = _ProgressCounter(progress_callback)
+
+    connections = []
+    try:
+        while len(connections) < streams:
+            conn, address = await listener.accept()
+            if peer_ip and address[0] != peer_ip:
+                logger.warning("Refused range connection from unexpected host %s", address[0])
+                conn.close()
+                continue
+            conn.setblocking(False)
+            connections.append(conn)
+
+        async def receive_range(conn):
+            buffer = allocate_receive_buffer(buffer_size)
+            offset, length = _RANGE_HEADER.unpack(await recv_exact_async(conn, _RANGE_HEADER.size))
+            if offset + length > file_size:
+                raise ValueError(f"Range {offset}+{length} is outside the file")
+            end = offset + length
+            while offset < end:
+                wanted = min(len(buffer), end - offset)
+                filled = 0
+                while filled < wanted:
+                    n = await loop.sock_recv_into(conn, buffer[filled:wanted])
+                    if not n:
+                        raise ConnectionError("Connection lost during file reception.")
+                    filled += n
+                written = 0
+                while written < filled:
+                    written += _pwrite(fd, buffer[written:filled], offset + written, seek_lock)
+                offset += filled
+                progress.add(filled)
+
+        await _run_all_async([receive_range(c) for c in connections])
+    finally:
+        for conn in connections:
+            conn.close()
+
+    f.seek(file_size)
+    return progress.total
@@ -1,14 +1,13 @@
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QCheckBox, QHBoxLayout, QMessageBox, QApplication, QComboBox, QSizePolicy
 )
-from PyQt6.QtGui import QScreen, QFont, QColor, QKeyEvent, QKeySequence, QDesktopServices
-from PyQt6.QtCore import Qt, QUrl
+from PyQt6.QtGui import QScreen, QFont, QColor, QKeyEvent, QKeySequence, QDesktopServices, QDoubleValidator
+from PyQt6.QtCore import Qt, QUrl, QLocale
 import sys
 import platform
 from constant import get_config, write_config, get_default_path, logger
 from PyQt6.QtWidgets import QGraphicsDropShadowEffect
 from credits_dialog import CreditsDialog
-import requests
 import os
 import time
 from PyQt6.QtWidgets import QProgressDialog
@@ -138,6 +137,47 @@ class PreferencesApp(QWidget):
         self.style_checkbox(self.encryption_toggle)
         layout.addWidget(self.encryption_toggle)
 
+        # Sync Folders Toggle
+        self.sync_folders_toggle = QCheckBox('Sync Folders', self)
+        self.sync_folders_toggle.setFont(QFont("Arial", 18))
+        self.style_checkbox(self.sync_folders_toggle)
+        layout.addWidget(self.sync_folders_toggle)
+
+        # Compression Toggle
+        self.compression_toggle = QCheckBox('Compression', self)
+        self.compression_toggle.setFont(QFont("Arial", 18))
+        self.style_checkbox(self.compression_toggle)
+        layout.addWidget(self.compression_toggle)
+
+        # Smallest First Toggle
+        self.smallest_first_toggle = QCheckBox('Send Smallest Files First', self)
+        self.smallest_first_toggle.setFont(QFont("Arial", 18))
+        self.style_checkbox(self.smallest_first_toggle)
+        layout.addWidget(self.smallest_first_toggle)
+
+        # Speed Limit
+        speed_limit_layout = QHBoxLayout()
+        speed_limit_layout.setSpacing(10)
+
+        self.speed_limit_label = QLabel('Speed Limit (Mbit/s, 0 = none):', self)
+        self.speed_limit_label.setFont(QFont("Arial", 18))
+        self.style_label(self.speed_limit_label)
+        speed_limit_layout.addWidget(self.speed_limit_label)
+
+        self.speed_limit_input = QLineEdit(self)
+        self.speed_limit_input.setFont(QFont("Arial", 16))
+        self.speed_limit_input.setFixedHeight(30)
+        self.speed_limit_input.setFixedWidth(100)
+        # cli.py limit takes fractions too; always with a decimal point, whatever the locale
+        speed_limit_validator = QDoubleValidator(0, 100000, 2, self)
+        speed_limit_validator.setNotation(QDoubleValidator.Notation.StandardNotation)
+        speed_limit_validator.setLocale(QLocale.c())
+        self.speed_limit_input.setValidator(speed_limit_validator)
+        self.style_input(self.speed_limit_input)
+        speed_limit_layout.addWidget(self.speed_limit_input)
+
+        layout.addLayout(speed_limit_layout)
+
         # Show Warning Toggle
         self.show_warning_toggle = QCheckBox('Show Warnings', self)
         self.show_warning_toggle.setFont(QFont("Arial", 18))
@@ -418,6 +458,10 @@ class PreferencesApp(QWidget):
         self.save_to_path_input.setText(config["save_to_directory"])
         self.max_filesize = config["max_filesize"]
         self.encryption_toggle.setChecked(config["encryption"])
+        self.sync_folders_toggle.setChecked(config.get("sync_folders", False))
+        self.compression_toggle.setChecked(config.get("compression", True))
+        self.speed_limit_input.setText(f'{float(config.get("speed_limit_mbps") or 0):g}')
+        self.smallest_first_toggle.setChecked(config.get("send_order", "listed") == "smallest")
         self.android_encryption = (config["android_encryption"])
         self.swift_encryption = (config["swift_encryption"])
         self.show_warning_toggle.setChecked(config["show_warning"])  # Load show_warning value
@@ -436,6 +480,10 @@ class PreferencesApp(QWidget):
         device_name = self.device_name_input.text()
         save_to_path = self.save_to_path_input.text()
         encryption = self.encryption_toggle.isChecked()
+        sync_folders = self.sync_folders_toggle.isChecked()
+        compression = self.compression_toggle.isChecked()
+        speed_limit = self.speed_limit_value()
+        send_order = "smallest" if self.smallest_first_toggle.isChecked() else "listed"
         show_warning = self.show_warning_toggle.isChecked()  # Get show_warning toggle state
         check_update = self.show_update_toggle.isChecked()
 
@@ -503,6 +551,18 @@ class PreferencesApp(QWidget):
         
         if encryption != self.original_preferences["encryption"]:
             changed_preferences["encryption"] = encryption
+
+        if sync_folders != self.original_preferences.get("sync_folders", False):
+            changed_preferences["sync_folders"] = sync_folders
+
+        if compression != self.original_preferences.get("compression", True):
+            changed_preferences["compression"] = compression
+
+        if speed_limit != self.original_preferences.get("speed_limit_mbps", 0):
+            changed_preferences["speed_limit_mbps"] = speed_limit
+
+        if send_order != self.original_preferences.get("send_order", "listed"):
+            changed_preferences["send_order"] = send_order
         
         if show_warning != self.original_preferences["show_warning"]:
             changed_preferences["show_warning"] = show_warning
@@ -644,6 +704,13 @@ class PreferencesApp(QWidget):
         y = (screen.height() - window_height) // 2
         self.setGeometry(x, y, window_width, window_height)
 
+    def speed_limit_value(self):
+        try:
+            return float(self.speed_limit_input.text() or 0)
+        except ValueError:
+            # Half typed, e.g. "."
+            return 0.0
+
     def changes_made(self):
         current_preferences = {
             "version": self.version,
@@ -651,17 +718,23 @@ class PreferencesApp(QWidget):
             "save_to_directory": self.save_to_path_input.text(),
             "max_filesize": self.max_filesize,
             "encryption": self.encryption_toggle.isChecked(),
+            "sync_folders": self.sync_folders_toggle.isChecked(),
+            "compression": self.compression_toggle.isChecked(),
+            "speed_limit_mbps": self.speed_limit_value(),
+            "send_order": "smallest" if self.smallest_first_toggle.isChecked() else "listed",
             "android_encryption": self.android_encryption,
             "swift_encryption": self.swift_encryption,
             "show_warning": self.show_warning_toggle.isChecked(),
             "check_update": self.show_update_toggle.isChecked()
         }
         
-        # Create comparison dict without update_channel
-        original_without_channel = self.original_preferences.copy()
-        original_without_channel.pop("update_channel", None)
-        
-        return current_preferences != original_without_channel
+        # Only the settings this dialog edits, the config holds others such as parallel_streams;
+        # missing ones have the defaults the dialog showed for them
+        defaults = {"sync_folders": False, "compression": True, "speed_limit_mbps": 0, "send_order": "listed"}
+        original_preferences = {key: self.original_preferences.get(key, defaults.get(key))
+                                for key in current_preferences}
+
+        return current_preferences != original_preferences
     
     def show_credits(self):
         logger.info("Opened Credits Dialog")
@@ -684,6 +757,14 @@ class PreferencesApp(QWidget):
         <br><br>
         <b>Encryption:</b> Enable or disable AES256 encryption for files being sent.
         <br><br>
+        <b>Sync Folders:</b> Update the receiver's copy of a folder sent before, sending only the changes. Not used with encryption.
+        <br><br>
+        <b>Compression:</b> Compress files that shrink well, such as text and logs, while they are sent. Already compressed files and encrypted transfers are sent as they are.
+        <br><br>
+        <b>Send Smallest Files First:</b> Send the small files of a batch before the large ones instead of in the order they were picked. While sending, any waiting file can still be moved up with Send Next or Send Now.
+        <br><br>
+        <b>Speed Limit:</b> Cap how fast files are sent, in megabits per second, so other traffic on the network is not crowded out. 0 sends at full speed. A new limit applies to transfers already running.
+        <br><br>
         <b>Show Warnings:</b> Enable or disable warning messages before sending or receiving files.
         <br><br>
         <b>Auto-check for updates during app launch:</b> Enable or disable automatic version checks when the application is launched.
@@ -739,6 +820,7 @@ class PreferencesApp(QWidget):
         help_dialog.exec()
 
     def fetch_platform_value(self):
+        import requests
         url = self.get_platform_link()
         logger.info(f"Fetching platform value from: {url}")
         
@@ -980,6 +1062,7 @@ class PreferencesApp(QWidget):
             return None
 
         # Download the file into the download folder
+        import requests
         try:
             response = requests.get(download_link, stream=True)
             response.raise_for_status()
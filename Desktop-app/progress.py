@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+
+# Snapshots are published at most this often (10 Hz)
+PROGRESS_INTERVAL = 0.1
+# Instantaneous throughput is measured over this many seconds
+THROUGHPUT_WINDOW = 2.0
+
+
+class TransferProgress:
+    """Batch progress aggregated on the worker thread and published at a fixed rate.
+
+    Transfer code reports every chunk; `publish` is only called with a
+    snapshot dict when PROGRESS_INTERVAL has passed, so the GUI gets a
+    bounded number of signals no matter how small the chunks are. Safe to
+    call from the range threads of a parallel transfer.
+    """
+
+    def __init__(self, publish, total_bytes=0, total_files=0, interval=PROGRESS_INTERVAL, clock=time.monotonic):
+        self.publish = publish
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.files_done = 0
+        # Bytes accounted for, and the part of them that actually crossed the network
+        self.bytes_done = 0
+        self.transferred = 0
+        self.file_name = ''
+        self.file_size = 0
+        self.file_done = 0
+        self.started = self.clock()
+        self.last_publish = float('-inf')
+        self.samples = deque([(self.started, 0)])
+
+    def set_totals(self, total_bytes, total_files):
+        with self.lock:
+            self.total_bytes = total_bytes
+            self.total_files = total_files
+
+    def begin_file(self, name, size, offset=0):
+        """Start a file; `offset` bytes of it were already delivered earlier."""
+        with self.lock:
+            self.file_name = name
+            self.file_size = size
+            self.file_done = offset
+            self.bytes_done += offset
+        self._maybe_publish()
+
+    def switch_file(self, name, size, done):
+        """Make a file current again after another was sent in between; its `done` bytes are counted."""
+        with self.lock:
+            self.file_name = name
+            self.file_size = size
+            self.file_done = done
+        self._maybe_publish()
+
+    def update_file(self, done):
+        """`done` is the absolute byte count of the current file, as transfer callbacks report it."""
+        with self.lock:
+            delta = done - self.file_done
+            if delta <= 0:
+                return
+            self.file_done = done
+            self.bytes_done += delta
+            self.transferred += delta
+        self._maybe_publish()
+
+    def end_file(self):
+        with self.lock:
+            self.bytes_done += max(0, self.file_size - self.file_done)
+            self.file_done = self.file_size
+            self.files_done += 1
+        self._maybe_publish()
+
+    def add_files(self, count, size, transferred=True):
+        """Account for `count` whole files at once (packed files, or ones skipped on resume)."""
+        with self.lock:
+            self.files_done += count
+            self.bytes_done += size
+            if transferred:
+                self.transferred += size
+        self._maybe_publish()
+
+    def finish(self):
+        with self.lock:
+            self.bytes_done = max(self.bytes_done, self.total_bytes)
+            self.files_done = max(self.files_done, self.total_files)
+        self.publish(self.snapshot())
+
+    def _maybe_publish(self):
+        now = self.clock()
+        with self.lock:
+            if now - self.last_publish < self.interval:
+                return
+            self.last_publish = now
+        self.publish(self.snapshot(now))
+
+    def snapshot(self, now=None):
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.samples.append((now, self.transferred))
+            while len(self.samples) > 2 and now - self.samples[1][0] >= THROUGHPUT_WINDOW:
+                self.samples.popleft()
+            window_start, window_bytes = self.samples[0]
+            elapsed = now - self.started
+            rate = (self.transferred - window_bytes) / (now - window_start) if now > window_start else 0.0
+            average_rate = self.transferred / elapsed if elapsed > 0 else 0.0
+            remaining = max(0, self.total_bytes - self.bytes_done)
+            speed = rate or average_rate
+            return {
+                'percent': min(100, self.bytes_done * 100 // self.total_bytes) if self.total_bytes else 0,
+                'bytes_done': self.bytes_done,
+                'total_bytes': self.total_bytes,
+                'files_done': self.files_done,
+                'total_files': self.total_files,
+                'file_name': self.file_name,
+                'file_percent': min(100, self.file_done * 100 // self.file_size) if self.file_size else 100,
+                'rate': rate,
+                'average_rate': average_rate,
+                'elapsed': elapsed,
+                'eta': remaining / speed if speed else None,
+            }
+
+
+def batch_totals(file_paths, wire_size=None):
+    """(bytes, files) a sender puts on the wire for `file_paths`, walking folders like send_folder does."""
+    total_bytes = total_files = 0
+    for path in file_paths:
+        if os.path.isdir(path):
+            sizes = [os.path.getsize(os.path.join(root, name))
+                     for root, _, names in os.walk(path) for name in names]
+        else:
+            sizes = [os.path.getsize(path)]
+        total_files += len(sizes)
+        total_bytes += sum(wire_size(size) if wire_size else size for size in sizes)
+    return total_bytes, total_files
+
+
+def format_rate(rate):
+    for unit in ('B/s', 'KB/s', 'MB/s'):
+        if rate < 1024:
+            return f"{rate:.1f} {unit}"
+        rate /= 1024
+    return f"{rate:.1f} GB/s"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def format_progress(snapshot):
+    """QProgressBar format string: overall percent, throughput and time left."""
+    return f"%p%  ·  {format_rate(snapshot['rate'])}  ·  {format_eta(snapshot['eta'])} left"
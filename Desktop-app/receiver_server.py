@@ -0,0 +1,264 @@
+import asyncio
+import collections
+import hmac
+import os
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from constant import RECEIVER_DATA, logger
+from framing import FRAME_HELLO, read_frame
+from session import SESSION_HELLO_TIMEOUT
+
+# Senders served at once; handshakes beyond this are turned away
+MAX_CONCURRENT_SENDERS = 8
+# Threads reading FRAME_HELLO from new connections, so a slow client never blocks accept
+ROUTING_WORKERS = 4
+# Pending connections the kernel queues for the whole server
+LISTEN_BACKLOG = 128
+# A worker waits this long for its sender's next connection
+ACCEPT_TIMEOUT = 60
+# A sender may connect before the receiver has finished reading its handshake;
+# its first connection waits this long for the registration
+REGISTER_GRACE = 2.0
+
+
+class SenderListener:
+    """One sender's share of the RECEIVER_DATA port.
+
+    Stands in for a listening socket on the event loop: accept() is awaited
+    and only ever yields connections the server routed to this sender.
+    Waiting ties up no thread, so many senders can sit idle at once.
+    """
+
+    def __init__(self, server, peer_ip, token=None):
+        self.server = server
+        self.peer_ip = peer_ip
+        self.token = token
+        self.timeout = ACCEPT_TIMEOUT
+        self.connections = collections.deque()
+        self.lock = threading.Lock()
+        self.waiter = None
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def put(self, conn, address):
+        """Called from the server's routing threads."""
+        with self.lock:
+            if self.closed:
+                conn.close()
+                return
+            self.connections.append((conn, address))
+            self._wake()
+
+    async def accept(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            with self.lock:
+                if self.closed:
+                    raise OSError("Listener closed")
+                if self.connections:
+                    return self.connections.popleft()
+                ready = loop.create_future()
+                self.waiter = (loop, ready)
+            try:
+                await asyncio.wait_for(ready, max(0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                raise socket.timeout("timed out")
+            finally:
+                with self.lock:
+                    if self.waiter and self.waiter[1] is ready:
+                        self.waiter = None
+
+    def _wake(self):
+        if self.waiter:
+            loop, ready = self.waiter
+            self.waiter = None
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            connections, self.connections = self.connections, collections.deque()
+            self._wake()
+        self.server.unregister(self)
+        for conn, _ in connections:
+            conn.close()
+
+
+class ReceiverServer:
+    """Owns the RECEIVER_DATA port and routes each connection to the sender it belongs to.
+
+    Paired senders open every connection, range connections included,
+    with FRAME_HELLO carrying their session token and are routed by it,
+    so several senders on the same host are told apart. Senders that
+    never paired (mobile apps, older desktop builds) are routed by IP,
+    one per address.
+    """
+
+    def __init__(self, port=RECEIVER_DATA, max_senders=MAX_CONCURRENT_SENDERS, host=''):
+        self.address = (host, port)
+        self.max_senders = max_senders
+        self.lock = threading.Lock()
+        self.registered = threading.Condition(self.lock)
+        self.paired = {}
+        self.unpaired = {}
+        self.sock = None
+        self.thread = None
+        self.pool = None
+        self.stopped = threading.Event()
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def active(self):
+        with self.lock:
+            return len(self.paired) + len(self.unpaired)
+
+    def register(self, peer_ip, token=None):
+        """A listener for the sender at `peer_ip`, or None when the server is full or the address is taken."""
+        with self.lock:
+            if len(self.paired) + len(self.unpaired) >= self.max_senders:
+                logger.warning("Refusing %s: already serving %d senders", peer_ip, self.max_senders)
+                return None
+            if not token and peer_ip in self.unpaired:
+                logger.warning("Refusing %s: a sender without a session is already served from there", peer_ip)
+                return None
+            listener = SenderListener(self, peer_ip, token)
+            if token:
+                self.paired[token] = listener
+            else:
+                self.unpaired[peer_ip] = listener
+            self.registered.notify_all()
+            return listener
+
+    def unregister(self, listener):
+        with self.lock:
+            if listener.token and self.paired.get(listener.token) is listener:
+                del self.paired[listener.token]
+            elif self.unpaired.get(listener.peer_ip) is listener:
+                del self.unpaired[listener.peer_ip]
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.address)
+        self.sock.listen(LISTEN_BACKLOG)
+        self.sock.setblocking(False)
+        self.pool = ThreadPoolExecutor(max_workers=ROUTING_WORKERS, thread_name_prefix='route')
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        logger.debug("Receiver server listening on port %d", self.port)
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
+        if self.thread:
+            self.thread.join()
+        with self.registered:
+            self.registered.notify_all()
+            listeners = list(self.paired.values()) + list(self.unpaired.values())
+        for listener in listeners:
+            listener.close()
+
+    def serve(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ)
+            selector.register(self._wakeup_r, selectors.EVENT_READ)
+            while not self.stopped.is_set():
+                for key, _ in selector.select():
+                    if key.fileobj is not self.sock:
+                        continue
+                    try:
+                        conn, address = self.sock.accept()
+                    except (BlockingIOError, InterruptedError):
+                        continue
+                    except OSError as e:
+                        logger.error("Accept failed: %s", e)
+                        continue
+                    conn.setblocking(True)
+                    self.pool.submit(self.route, conn, address)
+        self.pool.shutdown(wait=False)
+        self.sock.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def route(self, conn, address):
+        peer_ip = address[0]
+        deadline = time.monotonic() + REGISTER_GRACE
+        with self.registered:
+            while True:
+                expects_hello = any(listener.peer_ip == peer_ip for listener in self.paired.values())
+                listener = None if expects_hello else self.unpaired.get(peer_ip)
+                remaining = deadline - time.monotonic()
+                if expects_hello or listener or remaining <= 0 or self.stopped.is_set():
+                    break
+                self.registered.wait(remaining)
+        if expects_hello:
+            listener = self.read_hello(conn, peer_ip)
+        if listener is None:
+            logger.warning("Rejected connection from %s: no transfer expected from it", peer_ip)
+            conn.close()
+            return
+        listener.put(conn, address)
+
+    def read_hello(self, conn, peer_ip):
+        try:
+            conn.settimeout(SESSION_HELLO_TIMEOUT)
+            frame = read_frame(conn)
+            conn.settimeout(None)
+        except (OSError, ValueError) as e:
+            logger.debug("No session hello from %s: %s", peer_ip, e)
+            return None
+        if frame.type != FRAME_HELLO:
+            return None
+        presented = frame.name.encode()
+        with self.lock:
+            for token, listener in self.paired.items():
+                if hmac.compare_digest(token.encode(), presented) and listener.peer_ip == peer_ip:
+                    return listener
+        return None
+
+
+_claims_lock = threading.Lock()
+_claims = {}
+
+
+def _numbered(path, is_folder):
+    yield path
+    base_name, extension = (path, '') if is_folder else os.path.splitext(path)
+    counter = 1
+    while True:
+        yield f"{base_name} ({counter}){extension}"
+        counter += 1
+
+
+def claim_path(owner, path, is_folder=False, taken=os.path.exists):
+    """First free "name (n)" variant of `path`, reserved for `owner` until release_paths().
+
+    Concurrent senders receiving a file or folder of the same name get
+    distinct targets even before either of them has created it on disk.
+    """
+    with _claims_lock:
+        for candidate in _numbered(path, is_folder):
+            if _claims.get(candidate, owner) is owner and not taken(candidate):
+                _claims[candidate] = owner
+                return candidate
+
+
+def release_paths(owner):
+    with _claims_lock:
+        for path in [path for path, claimant in _claims.items() if claimant is owner]:
+            del _claims[path]
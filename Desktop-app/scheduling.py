@@ -0,0 +1,194 @@
+"""The order in which a sender sends the files of a batch.
+
+Files wait in a SendQueue until the sender takes the next one. Urgent
+files go first and may overtake a large file already being sent; pinned
+files follow in the order they were pinned; the rest go in the order of
+the "send_order" setting, as listed or smallest first. Priorities may be
+changed from any thread, e.g. the UI's, while the batch is sent.
+"""
+import fnmatch
+import heapq
+import itertools
+import threading
+
+URGENT = 'urgent'
+PINNED = 'pinned'
+NORMAL = 'normal'
+PRIORITIES = (URGENT, PINNED, NORMAL)
+SEND_ORDERS = ('listed', 'smallest')
+# When priorities can change mid-batch, large files go as FRAME_DATA chunks
+# of this size, so an urgent file can be sent between two of them
+PREEMPT_CHUNK_SIZE = 4 * 1024 * 1024
+# Entries in a snapshot(); the UI shows what is next, not all of a 100k file folder
+QUEUE_VIEW_SIZE = 200
+
+
+class QueuedFile:
+    """One file of a batch. `send` holds whatever the sender needs to send it."""
+
+    def __init__(self, name, size, send, position):
+        self.name = name
+        self.size = size
+        self.send = send
+        self.position = position
+        self.priority = NORMAL
+        self.pinned_at = 0
+        # 'waiting', 'sending', 'interrupted' (overtaken by an urgent file) or 'sent'
+        self.state = 'waiting'
+        # Bumped on every change of priority; older heap entries are skipped
+        self.version = 0
+
+
+class SendQueue:
+    """Files of a batch in the order they are to be sent.
+
+    `urgent` are name patterns (fnmatch, against the wire name or its last
+    component) of files to treat as urgent once queued. With `interactive`
+    False the caller promises not to change priorities after the batch
+    started, so the sender need not keep large files interruptible.
+    `on_change` is called, from whichever thread changed the queue, after
+    every change.
+    """
+
+    def __init__(self, order='listed', urgent=(), interactive=True, on_change=None):
+        self.order = order if order in SEND_ORDERS else 'listed'
+        self.patterns = list(urgent)
+        self.interactive = interactive
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.files = []
+        # Several files of a batch may go by the same name, e.g. from two folders
+        self.names = {}
+        self.heap = []
+        self.counter = itertools.count()
+        self.pins = itertools.count(1)
+        self.urgent_waiting = 0
+        # Priorities given before a reset(), applied again when the files are queued anew
+        self.requested = {}
+
+    def add(self, name, size, send):
+        with self.lock:
+            entry = QueuedFile(name, size, send, len(self.files))
+            self.files.append(entry)
+            self.names.setdefault(name, []).append(entry)
+            priority = self.requested.get(name)
+            if priority is None and any(fnmatch.fnmatch(name, pattern)
+                                        or fnmatch.fnmatch(name.rpartition('/')[2], pattern)
+                                        for pattern in self.patterns):
+                priority = URGENT
+            self._set(entry, priority or NORMAL)
+        self._changed()
+        return entry
+
+    def prioritize(self, name, priority):
+        """Give the waiting files called `name` a priority; False if none is waiting."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}")
+        with self.lock:
+            waiting = [entry for entry in self.names.get(name, ()) if entry.state == 'waiting']
+            for entry in waiting:
+                self._set(entry, priority)
+        if waiting:
+            self._changed()
+        return bool(waiting)
+
+    def next(self):
+        """The file to send now, marked as being sent; None when all are sent."""
+        with self.lock:
+            entry = self._pop()
+        if entry:
+            self._changed()
+        return entry
+
+    def preempting(self, current):
+        """An urgent file to send before going on with `current`, marked as being sent; None mostly.
+
+        Cheap enough to ask between any two chunks.
+        """
+        if not self.urgent_waiting or current.priority == URGENT:
+            return None
+        with self.lock:
+            entry = self._peek()
+            if entry and entry.priority == URGENT:
+                self._pop()
+                current.state = 'interrupted'
+            else:
+                entry = None
+        if entry:
+            self._changed()
+        return entry
+
+    def resume(self, entry):
+        with self.lock:
+            entry.state = 'sending'
+        self._changed()
+
+    def done(self, entry):
+        with self.lock:
+            entry.state = 'sent'
+        self._changed()
+
+    def upcoming(self):
+        """Waiting files in the order they would be sent if nothing changes."""
+        with self.lock:
+            return sorted((entry for entry in self.files if entry.state == 'waiting'), key=self._key)
+
+    def snapshot(self, limit=QUEUE_VIEW_SIZE):
+        """Files not yet sent, as dicts for the UI: the ones being sent first, then the next ones in order."""
+        with self.lock:
+            active = sorted((entry for entry in self.files if entry.state in ('sending', 'interrupted')),
+                            key=lambda entry: entry.state == 'interrupted')
+            waiting = heapq.nsmallest(limit, (entry for entry in self.files if entry.state == 'waiting'),
+                                      key=self._key)
+            return [{'name': entry.name, 'size': entry.size, 'priority': entry.priority, 'state': entry.state}
+                    for entry in (active + waiting)[:limit]]
+
+    def reset(self):
+        """Forget the files, keeping the priorities of those not sent, before they are queued again."""
+        with self.lock:
+            self.requested.update((entry.name, entry.priority) for entry in self.files
+                                  if entry.state != 'sent' and entry.priority != NORMAL)
+            self.files = []
+            self.names = {}
+            self.heap = []
+            self.urgent_waiting = 0
+        self._changed()
+
+    def _key(self, entry):
+        rank = PRIORITIES.index(entry.priority)
+        # Urgent and pinned files go in the order they were marked
+        if entry.priority != NORMAL:
+            return rank, entry.pinned_at, 0
+        return rank, entry.size if self.order == 'smallest' else 0, entry.position
+
+    def _set(self, entry, priority):
+        if entry.priority == URGENT:
+            self.urgent_waiting -= 1
+        entry.priority = priority
+        entry.pinned_at = next(self.pins) if priority != NORMAL else 0
+        entry.version += 1
+        if priority == URGENT:
+            self.urgent_waiting += 1
+        heapq.heappush(self.heap, (self._key(entry), next(self.counter), entry.version, entry))
+
+    def _peek(self):
+        # Entries superseded by a later change of priority are dropped on the way
+        while self.heap:
+            _, _, version, entry = self.heap[0]
+            if entry.state == 'waiting' and version == entry.version:
+                return entry
+            heapq.heappop(self.heap)
+        return None
+
+    def _pop(self):
+        entry = self._peek()
+        if entry:
+            heapq.heappop(self.heap)
+            if entry.priority == URGENT:
+                self.urgent_waiting -= 1
+            entry.state = 'sending'
+        return entry
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
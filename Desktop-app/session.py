@@ -0,0 +1,130 @@
+import asyncio
+import secrets
+import socket
+from constant import RECEIVER_DATA, logger
+from framing import FRAME_HELLO, pack_frame
+
+# A receiver opens RECEIVER_DATA only after the handshake; connects are
+# retried this often until CONNECT_TIMEOUT instead of sleeping up front
+CONNECT_RETRY_INTERVAL = 0.05
+CONNECT_TIMEOUT = 10.0
+# Receivers drop a paired connection that does not say hello within this many seconds
+SESSION_HELLO_TIMEOUT = 10.0
+
+
+def make_session_token():
+    return secrets.token_hex(16)
+
+
+async def connect_with_retry_async(ip_address, port=RECEIVER_DATA, timeout=CONNECT_TIMEOUT):
+    """Connect to `ip_address`, retrying while nothing listens there yet; the socket is left non-blocking."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (ip_address, port)), max(0.1, deadline - loop.time()))
+        except ConnectionRefusedError:
+            sock.close()
+            if loop.time() >= deadline:
+                raise
+            await asyncio.sleep(CONNECT_RETRY_INTERVAL)
+            continue
+        except BaseException:
+            sock.close()
+            raise
+        _tune(sock)
+        return sock
+
+
+def _tune(sock):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Writes are already coalesced; without this a batch's final HALT
+    # waits on a delayed ACK now that the connection stays open
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class DataSession:
+    """The data connection to one paired receiver, kept open across batches.
+
+    The sender puts a fresh token in its RECEIVER_JSON handshake; every data
+    connection of the session opens with a FRAME_HELLO carrying it, so the
+    receiver only serves the device it paired with. Batches end with
+    FRAME_HALT and the next one reuses the same connection, skipping both
+    the handshake and the connect.
+    """
+
+    def __init__(self, ip_address, token=None):
+        self.ip_address = ip_address
+        self.token = token
+        self.sock = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        """The open data socket, connecting (and saying hello) if there is none or the peer closed it."""
+        async with self.lock:
+            if self.sock and not self._alive():
+                logger.debug("Session connection to %s was closed, reconnecting", self.ip_address)
+                self._close()
+            if not self.sock:
+                self.sock = await connect_with_retry_async(self.ip_address)
+                await asyncio.get_running_loop().sock_sendall(self.sock, self.hello())
+                logger.debug("Connected to %s on port %d", self.ip_address, RECEIVER_DATA)
+            return self.sock
+
+    def hello(self):
+        """The FRAME_HELLO every connection of this session opens with; empty for peers that never paired."""
+        return pack_frame(FRAME_HELLO, name=self.token) if self.token else b''
+
+    def reset(self):
+        """Drop the current connection after an error; the next connect() opens a new one."""
+        self._close()
+
+    def close(self):
+        self._close()
+        if _sessions.get(self.ip_address) is self:
+            del _sessions[self.ip_address]
+
+    def _alive(self):
+        # Between batches the receiver never writes, so readable means closed or reset
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) != b''
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+
+_sessions = {}
+
+
+def open_session(ip_address):
+    """Start a new session with `ip_address`, replacing any earlier one; call before the handshake."""
+    previous = _sessions.get(ip_address)
+    if previous:
+        previous.close()
+    session = _sessions[ip_address] = DataSession(ip_address, make_session_token())
+    return session
+
+
+def get_session(ip_address):
+    """The session paired with `ip_address`, or a token-less one for peers that never paired."""
+    session = _sessions.get(ip_address)
+    if session is None:
+        session = _sessions[ip_address] = DataSession(ip_address)
+    return session
+
+
+def close_session(ip_address):
+    session = _sessions.get(ip_address)
+    if session:
+        session.close()
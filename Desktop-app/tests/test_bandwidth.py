@@ -0,0 +1,116 @@
+"""Throttle pacing, measured on the receiving end of a local socket pair."""
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bandwidth
+
+# Achieved rates must be within this share of the limit
+TOLERANCE = 0.05
+# Seconds of each send that are measured, and skipped at the start
+SECONDS = 1.5
+SETTLE = 0.3
+
+
+def paced_send(throttles, seconds=SECONDS, change=None):
+    """Send through each throttle at once for `seconds`; (seconds, bytes so far) as each receiver saw them."""
+    arrivals = [[] for _ in throttles]
+    threads = []
+    start = time.monotonic()
+    for throttle, seen in zip(throttles, arrivals):
+        sender, receiver = socket.socketpair()
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+
+        def send(throttle=throttle, sender=sender):
+            data = bytes(64 * 1024)
+            with sender:
+                while time.monotonic() - start < seconds:
+                    # As senders do: limited() also picks up changes to the settings
+                    if throttle.limited():
+                        throttle.sendall_blocking(sender, data)
+                    else:
+                        sender.sendall(data)
+
+        def receive(seen=seen, receiver=receiver):
+            total = 0
+            with receiver:
+                while True:
+                    data = receiver.recv(1024 * 1024)
+                    if not data:
+                        return
+                    total += len(data)
+                    seen.append((time.monotonic() - start, total))
+
+        threads += [threading.Thread(target=send), threading.Thread(target=receive)]
+    for thread in threads:
+        thread.start()
+    if change:
+        at, action = change
+        time.sleep(at)
+        action()
+    for thread in threads:
+        thread.join()
+    return arrivals
+
+
+def rate(arrivals, start, end):
+    """Mbit/s from `start` to `end`: the least squares slope of bytes received over time."""
+    inside = [(at, total) for at, total in arrivals if start <= at <= end]
+    mean_at = sum(at for at, _ in inside) / len(inside)
+    mean_total = sum(total for _, total in inside) / len(inside)
+    covariance = sum((at - mean_at) * (total - mean_total) for at, total in inside)
+    variance = sum((at - mean_at) ** 2 for at, _ in inside)
+    return covariance / variance * 8 / 1e6
+
+
+class ThrottleTest(unittest.TestCase):
+    def setUp(self):
+        # The process-wide limit comes from these settings instead of the config file
+        self.settings = {'speed_limit_mbps': 0}
+        for name, replacement in (('get_config', lambda: self.settings), ('reload_config', lambda: None)):
+            original = getattr(bandwidth, name)
+            setattr(bandwidth, name, replacement)
+            self.addCleanup(setattr, bandwidth, name, original)
+        self.addCleanup(self.reset_global_limit)
+        self.reset_global_limit()
+
+    def reset_global_limit(self):
+        self.settings['speed_limit_mbps'] = 0
+        bandwidth._global_limit.next_check = 0.0
+        bandwidth._global_limit.apply(self.settings)
+
+    def assertRate(self, measured, limit):
+        self.assertLess(abs(measured - limit) / limit, TOLERANCE, f"{measured:.1f} Mbit/s for a limit of {limit}")
+
+    def test_transfer_limit(self):
+        for limit in (40, 160):
+            with self.subTest(limit=limit):
+                arrivals, = paced_send([bandwidth.Throttle(limit)])
+                self.assertRate(rate(arrivals, SETTLE, arrivals[-1][0]), limit)
+
+    def test_live_change(self):
+        throttle = bandwidth.Throttle(40)
+        arrivals, = paced_send([throttle], seconds=2 * SECONDS, change=(SECONDS, lambda: throttle.set_limit(80)))
+        self.assertRate(rate(arrivals, SETTLE, SECONDS - 0.1), 40)
+        self.assertRate(rate(arrivals, SECONDS + SETTLE, arrivals[-1][0]), 80)
+
+    def test_global_limit_is_shared(self):
+        self.settings['speed_limit_mbps'] = 40
+        bandwidth._global_limit.next_check = 0.0
+        both = paced_send([bandwidth.Throttle(), bandwidth.Throttle()])
+        end = min(arrivals[-1][0] for arrivals in both)
+        self.assertRate(sum(rate(arrivals, SETTLE, end) for arrivals in both), 40)
+
+    def test_no_limit(self):
+        throttle = bandwidth.Throttle()
+        self.assertFalse(throttle.limited())
+        self.assertEqual(throttle.delay(1024 * 1024), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""cli.py send against cli.py receive on this machine, as a user would run them."""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(APP_DIR, 'cli.py')
+
+
+class CliSendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        # Settings, journal and logs go to a home of their own
+        self.env = dict(os.environ, HOME=self.directory.name, DATADASH_PASSWORD='')
+        self.destination = os.path.join(self.directory.name, 'incoming')
+        os.makedirs(self.destination)
+
+    def cli(self, *args, **kwargs):
+        return subprocess.Popen([sys.executable, CLI, *args], cwd=APP_DIR, env=self.env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **kwargs)
+
+    def test_send(self):
+        source = os.path.join(self.directory.name, 'outgoing')
+        os.makedirs(source)
+        contents = {'a.bin': os.urandom(300000), 'b.txt': b'hello', 'empty.txt': b''}
+        for name, data in contents.items():
+            with open(os.path.join(source, name), 'wb') as f:
+                f.write(data)
+
+        receiver = self.cli('receive', '--dest', self.destination)
+        self.addCleanup(receiver.communicate)
+        self.addCleanup(receiver.kill)
+        time.sleep(1.5)
+        sender = self.cli('send', '127.0.0.1', *(os.path.join(source, name) for name in contents))
+        out, err = sender.communicate(timeout=60)
+        self.assertEqual(sender.returncode, 0, err)
+        self.assertNotIn('Traceback', err)
+        self.assertEqual(receiver.wait(timeout=30), 0)
+
+        for name, data in contents.items():
+            with open(os.path.join(self.destination, name), 'rb') as f:
+                self.assertEqual(f.read(), data, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Key reuse when decrypting the files of one transfer."""
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crypt_handler
+from cryptography.exceptions import InvalidTag
+
+
+def sealed(session, data):
+    return b''.join(crypt_handler.encrypt_stream(io.BytesIO(data), session, len(data)))
+
+
+class KeyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.derived = []
+        derive_key = crypt_handler.derive_key
+
+        def counting(key, salt):
+            self.derived.append((salt, key))
+            return derive_key(key, salt)
+
+        crypt_handler.derive_key = counting
+        self.addCleanup(setattr, crypt_handler, 'derive_key', derive_key)
+
+    def decrypt(self, blob, password, keys):
+        out = io.BytesIO()
+        crypt_handler.decrypt_stream(io.BytesIO(blob), out, password, len(blob), keys)
+        return out.getvalue()
+
+    def test_one_derivation_per_transfer(self):
+        session = crypt_handler.EncryptionSession('secret')
+        files = [os.urandom(size) for size in (0, 10, 3 * 1024 * 1024)]
+        blobs = [sealed(session, data) for data in files]
+        self.derived.clear()
+        keys = {}
+        self.assertEqual([self.decrypt(blob, 'secret', keys) for blob in blobs], files)
+        self.assertEqual(self.derived, [(session.salt, 'secret')])
+
+    def test_wrong_password_is_not_reused(self):
+        session = crypt_handler.EncryptionSession('secret')
+        blob = sealed(session, b'data')
+        keys = {}
+        with self.assertRaises(InvalidTag):
+            self.decrypt(blob, 'guess', keys)
+        self.assertEqual(self.decrypt(blob, 'secret', keys), b'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
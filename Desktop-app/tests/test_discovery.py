@@ -0,0 +1,99 @@
+"""Peer expiry and DISCOVER backoff, driven by a clock the test advances."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discovery
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class StubSocket:
+    """Takes DISCOVERs without sending them anywhere."""
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, message, address):
+        self.sent.append((message, address))
+
+
+class PeerTableTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.table = discovery.PeerTable(ttl=15, clock=self.clock)
+
+    def test_update(self):
+        self.assertTrue(self.table.update('10.0.0.2', 'desk', device_type='desktop'))
+        self.assertFalse(self.table.update('10.0.0.2', 'desk', device_type='desktop'))
+        self.assertTrue(self.table.update('10.0.0.2', 'laptop'))
+        # A plain broadcast reply keeps the details of the earlier announcement
+        self.assertEqual(self.table.get('10.0.0.2'), {'ip': '10.0.0.2', 'name': 'laptop', 'device_type': 'desktop'})
+
+    def test_expire(self):
+        self.table.update('10.0.0.2', 'desk')
+        self.clock.now += 10
+        self.table.update('10.0.0.3', 'phone')
+        self.clock.now += 6
+        self.assertEqual([peer['ip'] for peer in self.table.expire()], ['10.0.0.2'])
+        self.assertIsNone(self.table.get('10.0.0.2'))
+        self.assertIsNotNone(self.table.get('10.0.0.3'))
+
+    def test_reply_renews(self):
+        self.table.update('10.0.0.2', 'desk')
+        self.clock.now += 10
+        self.table.update('10.0.0.2', 'desk')
+        self.clock.now += 10
+        self.assertEqual(self.table.expire(), [])
+        self.clock.now += 6
+        self.assertEqual(len(self.table.expire()), 1)
+
+
+class DiscoveryServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.added = []
+        self.removed = []
+        self.service = discovery.DiscoveryService(self.added.append, self.removed.append, ttl=15,
+                                                  multicast=False, clock=self.clock)
+        self.socket = StubSocket()
+
+    def announce_times(self, count):
+        """Announce whenever one is due, `count` times; the clock readings at which they went out."""
+        times = []
+        while len(times) < count:
+            self.clock.now = max(self.clock.now, self.service.next_announce)
+            times.append(self.clock.now)
+            self.service.announce(self.socket)
+        return times
+
+    def test_backoff(self):
+        times = self.announce_times(8)
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        self.assertEqual(gaps, [0.25, 0.5, 1.0, 2.0, 4.0, 5.0, 5.0])
+
+    def test_refresh_restarts_backoff(self):
+        self.announce_times(5)
+        self.service.refresh()
+        self.assertLessEqual(self.service.next_announce, self.clock.now)
+        times = self.announce_times(3)
+        self.assertEqual([later - earlier for earlier, later in zip(times, times[1:])], [0.25, 0.5])
+
+    def test_reply_and_expiry(self):
+        self.service.handle_reply(discovery.RECEIVER_PREFIX.encode() + b'desk', ('10.0.0.2', 12345))
+        self.service.handle_reply(b'something else', ('10.0.0.3', 12345))
+        self.assertEqual(self.added, [{'ip': '10.0.0.2', 'name': 'desk'}])
+        self.clock.now += 16
+        self.assertEqual([peer['ip'] for peer in self.service.table.expire()], ['10.0.0.2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
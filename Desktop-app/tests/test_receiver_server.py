@@ -0,0 +1,56 @@
+"""Routing of data connections to the sender they belong to."""
+import asyncio
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import receiver_server
+import session
+
+
+class RoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = receiver_server.ReceiverServer(port=0, host='127.0.0.1').start()
+        self.addCleanup(self.server.stop)
+
+    def connect(self, data_session, payload):
+        """A connection opened the way `data_session` opens its own, followed by `payload`."""
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        self.addCleanup(sock.close)
+        sock.sendall(data_session.hello() + payload)
+        return sock
+
+    def received(self, listener, timeout=5):
+        async def accept():
+            listener.settimeout(timeout)
+            conn, _ = await listener.accept()
+            with conn:
+                conn.settimeout(5)
+                return conn.recv(1024)
+
+        return asyncio.run(accept())
+
+    def test_two_sessions_from_one_address(self):
+        sessions = [session.DataSession('127.0.0.1', session.make_session_token()) for _ in range(2)]
+        listeners = [self.server.register('127.0.0.1', s.token) for s in sessions]
+        self.assertNotIn(None, listeners)
+        # The second sender connects first: routing goes by token, not by order
+        self.connect(sessions[1], b'second')
+        self.connect(sessions[0], b'first')
+        self.assertEqual(self.received(listeners[0]), b'first')
+        self.assertEqual(self.received(listeners[1]), b'second')
+
+    def test_unknown_token_is_rejected(self):
+        listener = self.server.register('127.0.0.1', session.make_session_token())
+        stranger = self.connect(session.DataSession('127.0.0.1', session.make_session_token()), b'')
+        stranger.settimeout(5)
+        self.assertEqual(stranger.recv(1), b'')
+        with self.assertRaises(socket.timeout):
+            self.received(listener, timeout=0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
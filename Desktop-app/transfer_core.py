@@ -0,0 +1,1342 @@
+"""The desktop transfer protocol on asyncio, independent of Qt.
+
+Sender and Receiver run one transfer each as a coroutine and report what
+happens through a TransferEvents object. Any number of them can run as
+tasks on one event loop: the PyQt6 windows submit theirs to the shared
+transfer loop below, a headless process may just use asyncio.run().
+"""
+import asyncio
+import io
+import json
+import os
+import platform
+import shutil
+import struct
+import tempfile
+import threading
+from pathlib import Path
+from bandwidth import Throttle
+from compression import (
+    BlockCompressor, is_compressed_format, negotiate_compression, receive_compressed_async, worth_compressing
+)
+from constant import RECEIVER_JSON, get_config, logger
+from crypt_handler import EncryptionSession, encrypt_stream, encrypted_size
+from discovery import device_data
+from framing import (
+    FLAG_COMPRESSED, FLAG_DIGEST, FLAG_ENCRYPTED, FLAG_INLINE, FLAG_LAST, FLAG_PARALLEL, FLAG_REPAIR, FRAME_DATA, FRAME_DIGEST,
+    FRAME_FILE, FRAME_HALT, FRAME_PACK, FRAME_RESUME, FRAME_SYNC, FRAME_VERIFY, LEGACY_PROTOCOL, PACK_FILE_SIZE, PACK_MAX_FILES, PACK_SIZE, FrameWriter, ProtocolError,
+    is_frame, negotiate_protocol, pack_files, pack_frame, pack_legacy_header, read_frame_async,
+    read_legacy_header_async, read_pack_async
+)
+from integrity import (
+    INTEGRITY_ALGORITHM, INTEGRITY_BLOCK_SIZE, SYNC_BLOCK_SIZE, BlockHasher, IntegrityError, Manifest,
+    damaged_ranges, file_digest, hash_file
+)
+from parallel_transfer import PARALLEL_THRESHOLD, negotiate_streams, receive_file_parallel, send_file_parallel_async
+from progress import TransferProgress, batch_totals
+from receiver_server import ACCEPT_TIMEOUT, ReceiverServer, claim_path, release_paths
+from scheduling import PREEMPT_CHUNK_SIZE, SendQueue
+from session import CONNECT_TIMEOUT, DataSession, get_session, open_session
+from transfer_io import (
+    HAS_SENDFILE, RECEIVE_BUFFER_SIZE, ReadAhead, WriteBehind, allocate_receive_buffer, preallocate_file,
+    receive_file_data_async, recv_exact_async, send_chunks_async, send_file_data_async
+)
+from transfer_journal import TransferJournal, make_transfer_id
+
+# Reconnects after a dropped connection before the transfer is given up
+RESUME_ATTEMPTS = 3
+RESUME_RETRY_DELAY = 2
+# Handshakes on RECEIVER_JSON served at once, and how long each may take
+MAX_HANDSHAKES = 16
+HANDSHAKE_TIMEOUT = 10
+# Rounds of resending damaged files before a batch is reported as failed
+RETRANSMIT_ATTEMPTS = 3
+# Changes to a sender's queue are reported at most this often
+QUEUE_REPORT_INTERVAL = 0.25
+
+
+class TransferEvents:
+    """What a transfer reports. Every method is optional and runs on the event loop's thread."""
+
+    def on_started(self):
+        """A receiver got the first frame of a batch."""
+
+    def on_progress(self, snapshot):
+        """A TransferProgress snapshot, at most every PROGRESS_INTERVAL."""
+
+    def on_finished(self, encrypted_files):
+        """A batch completed; `encrypted_files` still need the user's password."""
+
+    def on_error(self, title, message, details=''):
+        """The transfer could not start or continue."""
+
+    def on_queue(self, files):
+        """An interactive sender's SendQueue.snapshot() after it changed, at most every QUEUE_REPORT_INTERVAL."""
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def transfer_loop():
+    """The event loop shared by every transfer of this process, started on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='transfers', daemon=True).start()
+        return _loop
+
+
+def submit(coroutine):
+    """Run `coroutine` on the transfer loop from any thread; cancelling the returned future cancels it."""
+    return asyncio.run_coroutine_threadsafe(coroutine, transfer_loop())
+
+
+def _hashed(chunks, update):
+    for chunk in chunks:
+        update(chunk)
+        yield chunk
+
+
+async def _send_json(writer, data):
+    payload = json.dumps(data).encode()
+    writer.write(struct.pack('<Q', len(payload)) + payload)
+    await writer.drain()
+
+
+async def _read_json(reader):
+    size = struct.unpack('<Q', await reader.readexactly(8))[0]
+    return json.loads((await reader.readexactly(size)).decode())
+
+
+async def _drain_and_close(reader, writer):
+    # Read until the peer closes so closing our end does not reset the connection
+    try:
+        await asyncio.wait_for(reader.read(), HANDSHAKE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        pass
+    writer.close()
+
+
+async def pair(ip_address, announcement=None):
+    """Handshake with the receiver at `ip_address` and return its device data.
+
+    A fresh session token goes along, pairing this device with the receiver
+    for the whole send session. When a multicast `announcement` from a
+    desktop receiver already told us what its reply would say, it is used
+    instead of waiting for the reply.
+    """
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, RECEIVER_JSON), CONNECT_TIMEOUT)
+    try:
+        session = open_session(ip_address)
+        await _send_json(writer, dict(device_data(), session_token=session.token))
+        if announcement and announcement.get('device_type') == 'python':
+            asyncio.ensure_future(_drain_and_close(reader, writer))
+            writer = None
+            return {k: v for k, v in announcement.items() if k not in ('ip', 'name')}
+        return await asyncio.wait_for(_read_json(reader), HANDSHAKE_TIMEOUT)
+    finally:
+        if writer:
+            writer.close()
+
+
+class HandshakeServer:
+    """Answers RECEIVER_JSON handshakes and registers each sender with `data_server`.
+
+    `on_paired(device_info, listener)` is called for every sender that gets
+    a slot; senders are turned away while the data server is full.
+    """
+
+    def __init__(self, data_server, on_paired, port=RECEIVER_JSON, host='0.0.0.0'):
+        self.data_server = data_server
+        self.on_paired = on_paired
+        self.address = (host, port)
+        self.slots = asyncio.Semaphore(MAX_HANDSHAKES)
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, *self.address, reuse_address=True)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        client_ip = writer.get_extra_info('peername')[0]
+        logger.debug(f"Client IP address stored: {client_ip}")
+        try:
+            async with self.slots:
+                await _send_json(writer, device_data())
+                device_info = await asyncio.wait_for(_read_json(reader), HANDSHAKE_TIMEOUT)
+        except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            logger.error("Handshake failed: %s", e)
+            return
+        finally:
+            writer.close()
+
+        # Registered now, before the transfer starts, so an early data connection already has a home
+        listener = self.data_server.register(client_ip, device_info.get("session_token"))
+        if listener is None:
+            logger.warning("Busy, not receiving from %s", client_ip)
+            return
+        if device_info.get("device_type") not in ("python", "java", "swift"):
+            logger.debug("Unknown device type received.")
+            listener.close()
+            return
+        logger.debug("Connected to a %s device.", device_info["device_type"])
+        self.on_paired(device_info, listener)
+
+
+class Sender:
+    """Sends `file_paths` to the desktop receiver at `ip_address` in one batch.
+
+    `encryption`, `sync` and `compress` override the "encryption",
+    "sync_folders" and "compression" config settings. In sync mode a
+    folder is updated in place on the receiver, sending only the blocks
+    that changed since the last time. `speed_limit` caps this transfer in
+    Mbit/s, on top of the speed limit settings; see set_speed_limit().
+    Files go in the order of `queue`, a scheduling.SendQueue; without one,
+    in the order of the "send_order" setting. See prioritize().
+    """
+
+    def __init__(self, ip_address, file_paths, password=None, receiver_data=None, events=None, encryption=None,
+                 sync=None, compress=None, speed_limit=None, queue=None):
+        self.ip_address = ip_address
+        self.file_paths = file_paths
+        self.password = password
+        self.encryption = encryption
+        self.sync = sync
+        self.compress = compress
+        self.throttle = Throttle(speed_limit)
+        self.queue = queue
+        self.receiver_data = receiver_data
+        self.events = events or TransferEvents()
+        self.sock = None
+        self.loop = None
+        self.queue_report_due = False
+
+    def set_speed_limit(self, mbps):
+        """Change this transfer's limit while it runs, from any thread; 0 lifts it."""
+        self.throttle.set_limit(mbps)
+
+    def prioritize(self, name, priority):
+        """Move the waiting file `name` (as sent, e.g. "photos/a.jpg") up or down, from any thread.
+
+        An urgent file of a framed transfer is sent between two chunks of
+        the large file being sent, if the queue is interactive.
+        """
+        return self.queue.prioritize(name, priority)
+
+    def queue_changed(self):
+        # Any thread; reports are coalesced so a folder of small files does not flood the UI
+        if self.queue_report_due or self.loop is None or not self.queue.interactive:
+            return
+        self.queue_report_due = True
+        try:
+            self.loop.call_soon_threadsafe(self.loop.call_later, QUEUE_REPORT_INTERVAL, self.report_queue)
+        except RuntimeError:
+            # The transfer is over and its loop closed
+            pass
+
+    def report_queue(self):
+        self.queue_report_due = False
+        # Only worth showing to someone who can reorder it
+        if self.queue.interactive:
+            self.events.on_queue(self.queue.snapshot())
+
+    async def connect(self):
+        try:
+            self.sock = await self.session.connect()
+        except OSError as e:
+            error_message = f"Failed to connect to {self.ip_address}: {str(e)}"
+            logger.error(error_message)
+            self.events.on_error("Connection Error", error_message, "")
+            return False
+        return True
+
+    async def run(self):
+        # A receiver that pairs sessions keeps the data connection open
+        # between batches, so "Send More Files" skips handshake and connect
+        if (self.receiver_data or {}).get("sessions"):
+            self.session = get_session(self.ip_address)
+        else:
+            self.session = DataSession(self.ip_address)
+        if not await self.connect():
+            return False
+
+        self.loop = asyncio.get_running_loop()
+        if self.queue is None:
+            # Nobody to change the order while the batch is sent
+            self.queue = SendQueue(get_config().get("send_order", "listed"), interactive=False)
+        self.queue.on_change = self.queue_changed
+        self.encryption_flag = get_config()["encryption"] if self.encryption is None else self.encryption
+        # One PBKDF2 derivation for the whole batch, per-file subkeys after that
+        self.encryption_session = (await asyncio.to_thread(EncryptionSession, self.password)
+                                   if self.encryption_flag else None)
+        # Large files may be split over several connections if the receiver supports it
+        self.parallel_streams = negotiate_streams(get_config().get("parallel_streams", 1), self.receiver_data)
+        self.protocol = negotiate_protocol(self.receiver_data)
+        logger.debug("Using protocol version %d", self.protocol)
+        # Receivers that verify content get block digests of every file and a manifest of the batch
+        self.integrity = (self.protocol != LEGACY_PROTOCOL
+                          and (self.receiver_data or {}).get("integrity") == INTEGRITY_ALGORITHM)
+        self.manifest = Manifest()
+        self.sent_files = {}
+        # Sync builds on the digests; an encrypted copy never matches the last one, so it always goes whole
+        sync = get_config().get("sync_folders", False) if self.sync is None else self.sync
+        self.sync_folders = (sync and self.integrity and not self.encryption_flag
+                             and (self.receiver_data or {}).get("sync", False))
+        self.signatures = {}
+        # Files are compressed when the receiver can decompress them; the codec is ours to pick
+        compress = get_config().get("compression", True) if self.compress is None else self.compress
+        self.compression = (negotiate_compression(self.receiver_data)
+                            if compress and self.protocol != LEGACY_PROTOCOL else None)
+        # Receivers with a transfer journal let us reconnect and skip what already arrived
+        self.resume_offsets = {}
+        transfer_id = None
+        if (self.receiver_data or {}).get("resume"):
+            transfer_id = make_transfer_id(self.ip_address, self.file_paths)
+
+        wire_size = encrypted_size if self.encryption_flag else None
+        total_bytes, total_files = batch_totals(self.file_paths, wire_size)
+        # Memory the reader thread may fill ahead of the socket
+        read_ahead_limit = get_config().get("read_ahead_mb", 16) * 1024 * 1024
+
+        attempt = 0
+        while True:
+            try:
+                self.progress = TransferProgress(self.events.on_progress, total_bytes, total_files)
+                self.writer = FrameWriter(self.sock, throttle=self.throttle)
+                self.next_file_id = 1
+                self.pack_entries = []
+                self.pack_size = 0
+                self.pack_counted = 0
+                self.read_ahead = ReadAhead(read_ahead_limit)
+                self.queue.reset()
+                if transfer_id:
+                    await self.request_resume(transfer_id)
+                await self.send_batch()
+                break
+            except asyncio.CancelledError:
+                # A half-sent batch leaves the connection unusable for the next one
+                self.session.reset()
+                raise
+            except IntegrityError as e:
+                logger.error("Transfer failed verification: %s", e)
+                if not self.session.token:
+                    self.session.close()
+                self.events.on_error("Integrity Error", "Some files did not arrive intact.", str(e))
+                return False
+            except OSError as e:
+                attempt += 1
+                if not transfer_id or attempt > RESUME_ATTEMPTS:
+                    logger.error("Transfer failed: %s", e)
+                    self.session.reset()
+                    self.events.on_error("Connection Error", f"The connection to {self.ip_address} was lost.", str(e))
+                    return False
+                logger.warning("Connection lost (%s), reconnecting, attempt %d of %d", e, attempt, RESUME_ATTEMPTS)
+                self.session.reset()
+                await asyncio.sleep(RESUME_RETRY_DELAY * attempt)
+                if not await self.connect():
+                    return False
+            finally:
+                self.read_ahead.close()
+
+        if not self.session.token:
+            self.session.close()
+        self.progress.finish()
+        self.events.on_finished([])
+        return True
+
+    async def request_resume(self, transfer_id):
+        request = json.dumps({"transfer_id": transfer_id}).encode()
+        if self.protocol == LEGACY_PROTOCOL:
+            await self.writer.write('encyp: r'.encode(), struct.pack('<Q', len(request)), request)
+            await self.writer.flush()
+            reply_size = struct.unpack('<Q', await recv_exact_async(self.sock, 8))[0]
+        else:
+            await self.writer.write(pack_frame(FRAME_RESUME, length=len(request)), request)
+            await self.writer.flush()
+            reply_size = (await read_frame_async(self.sock)).length
+        self.resume_offsets = json.loads((await recv_exact_async(self.sock, reply_size)).decode()).get("files", {})
+        if self.resume_offsets:
+            logger.info("Receiver already has %d files of transfer %s", len(self.resume_offsets), transfer_id)
+
+    async def send_batch(self):
+        metadata_file_path = None
+        self.metadata_created = False
+        for file_path in self.file_paths:
+            if os.path.isdir(file_path):
+                await self.send_folder(file_path)
+            else:
+                if not self.metadata_created:
+                    metadata_file_path = self.create_metadata(file_paths=self.file_paths)
+                    await self.send_file(metadata_file_path, counted=False)
+                relative_file_path = os.path.basename(file_path) + ('.crypt' if self.encryption_flag else '')
+                self.queue.add(relative_file_path, os.path.getsize(file_path), (file_path, relative_file_path))
+        await self.send_queued()
+
+        if self.metadata_created and metadata_file_path:
+            shutil.rmtree(os.path.dirname(metadata_file_path), ignore_errors=True)
+
+        await self.flush_pack()
+        unrepaired = await self.verify_batch() if self.integrity else []
+        logger.debug("Sent halt signal")
+        if self.protocol == LEGACY_PROTOCOL:
+            await self.writer.write('encyp: h'.encode())
+        else:
+            await self.writer.write(pack_frame(FRAME_HALT))
+        await self.writer.flush()
+        if unrepaired:
+            # The receiver finishes the batch and reports the same files
+            raise IntegrityError(f"{len(unrepaired)} files still differ after {RETRANSMIT_ATTEMPTS} retransmits: "
+                                 + ", ".join(sorted(unrepaired)[:10]))
+
+    def get_temp_dir(self):
+        system = platform.system()
+        if system == "Windows":
+            temp_dir = Path(os.getenv('LOCALAPPDATA')) / 'Temp' / 'DataDash'
+        elif system == "Darwin":  # macOS
+            temp_dir = Path.home() / 'Library' / 'Caches' / 'DataDash'
+        elif system == "Linux":  # Linux and others
+            temp_dir = Path.home() / '.cache' / 'DataDash'
+        else:
+            logger.error(f"Unsupported platform: {system}")
+
+        try:
+            os.makedirs(str(temp_dir), exist_ok=True)
+            logger.debug(f"Created/verified temp directory: {temp_dir}")
+        except Exception as e:
+            logger.error(f"Failed to create temp directory: {e}")
+            # Fallback to system temp directory
+            temp_dir = Path(tempfile.gettempdir()) / 'DataDash'
+            os.makedirs(str(temp_dir), exist_ok=True)
+            logger.debug(f"Using fallback temp directory: {temp_dir}")
+
+        return temp_dir
+
+    def create_metadata(self, folder_path=None, file_paths=None, signatures=False):
+        temp_dir = self.get_temp_dir()
+        if folder_path:
+            metadata = []
+            for root, dirs, files in os.walk(folder_path):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    relative_path = os.path.relpath(file_path, folder_path).replace('\\', '/')
+                    file_size = os.path.getsize(file_path)
+                    metadata.append({
+                        'path': relative_path,
+                        'size': file_size
+                    })
+                    if signatures:
+                        self.signatures[relative_path] = hash_file(file_path, block_size=SYNC_BLOCK_SIZE).digests()
+                        metadata[-1]['digest'] = file_digest(self.signatures[relative_path]).hex()
+                for dir in dirs:
+                    dir_path = os.path.join(root, dir)
+                    relative_path = os.path.relpath(dir_path, folder_path).replace('\\', '/')
+                    metadata.append({
+                        'path': relative_path + '/',
+                        'size': 0
+                    })
+            metadata.append({'base_folder_name': os.path.basename(folder_path), 'path': '.delete', 'size': 0})
+            if signatures:
+                metadata[-1]['sync'] = True
+        elif file_paths:
+            metadata = []
+            for file_path in file_paths:
+                file_size = os.path.getsize(file_path)
+                metadata.append({
+                    'path': os.path.basename(file_path),
+                    'size': file_size
+                })
+        else:
+            return None
+        # Own directory per transfer: several senders may run at once
+        metadata_file_path = os.path.join(tempfile.mkdtemp(dir=temp_dir), 'metadata.json')
+        with open(metadata_file_path, 'w') as f:
+            f.write(json.dumps(metadata))
+        self.metadata_created = True
+        return metadata_file_path
+
+    async def send_folder(self, folder_path):
+        logger.debug("Sending folder %s", folder_path)
+
+        state = {}
+        if not self.metadata_created:
+            # Signatures mean reading the whole folder, so they are taken off the event loop
+            metadata_file_path = await asyncio.to_thread(self.create_metadata, folder_path=folder_path,
+                                                         signatures=self.sync_folders)
+            metadata = json.loads(open(metadata_file_path).read())
+            await self.send_file(metadata_file_path, counted=False)
+            if self.sync_folders:
+                state = await self.request_sync()
+        unchanged = set(state.get("same", []))
+        older = state.get("blocks", {})
+        for file_info in metadata:
+            relative_file_path = file_info['path']
+            file_path = os.path.join(folder_path, relative_file_path)
+            if not relative_file_path.endswith('.delete'):
+                if relative_file_path in unchanged:
+                    self.progress.add_files(1, file_info['size'], transferred=False)
+                elif relative_file_path in older:
+                    await self.send_delta(file_path, relative_file_path, file_info['size'],
+                                          bytes.fromhex(older[relative_file_path]))
+                elif not relative_file_path.endswith('/'):
+                    # Entries ending in / are folders; empty files are sent like any other
+                    if self.encryption_flag:
+                        relative_file_path += ".crypt"
+                    self.queue.add(relative_file_path, file_info['size'], (file_path, relative_file_path))
+
+        shutil.rmtree(os.path.dirname(metadata_file_path), ignore_errors=True)
+
+    async def send_queued(self):
+        # Read ahead in the order the queue has now; files moved later are read when their turn comes
+        for entry in self.queue.upcoming():
+            self.plan_read(entry.send[0], entry.size, self.encryption_flag)
+        for entry in iter(self.queue.next, None):
+            await self.send_file(*entry.send, encrypted_transfer=self.encryption_flag, entry=entry)
+            self.queue.done(entry)
+        self.report_queue()
+
+    def plan_read(self, file_path, plain_size, encrypted_transfer):
+        """Let the reader thread open or read `file_path` while the files before it are sent."""
+        if self.protocol != LEGACY_PROTOCOL and plain_size <= PACK_FILE_SIZE:
+            self.read_ahead.want(file_path, whole=True)
+        elif not encrypted_transfer and not (self.parallel_streams > 1 and plain_size >= PARALLEL_THRESHOLD):
+            if self.interruptible(plain_size, encrypted_transfer, False) and not self.may_compress(file_path):
+                # Sent a chunk at a time, each read from the path
+                return
+            # sendfile and the compressor need only the open file; a plain copy reads the data too
+            self.read_ahead.want(file_path, whole=not HAS_SENDFILE and not self.may_compress(file_path))
+
+    def may_compress(self, file_path):
+        return bool(self.compression) and not is_compressed_format(file_path)
+
+    def interruptible(self, file_size, encrypted_transfer, parallel):
+        """Whether a file goes as FRAME_DATA chunks, so that urgent files can be sent between them."""
+        return (self.queue.interactive and self.protocol != LEGACY_PROTOCOL and not encrypted_transfer
+                and not parallel and file_size >= 2 * PREEMPT_CHUNK_SIZE)
+
+    async def send_file(self, file_path, relative_file_path=None, encrypted_transfer=False, counted=True, entry=None):
+        logger.debug("Sending file: %s", file_path)
+
+        plain_size = os.path.getsize(file_path)
+        file_size = encrypted_size(plain_size) if encrypted_transfer else plain_size
+        if relative_file_path is None:
+            relative_file_path = os.path.basename(file_path)
+            if encrypted_transfer:
+                relative_file_path += '.crypt'
+        logger.debug("Sending %s, %s", relative_file_path, file_size)
+
+        received, journaled_size = self.resume_offsets.get(relative_file_path, (0, None))
+        if journaled_size != file_size:
+            received = 0
+        if file_size and received >= file_size:
+            logger.debug("Receiver already has %s, skipping", relative_file_path)
+            self.progress.add_files(1, file_size, transferred=False)
+            return True
+        # A partial encrypted file cannot be continued: the new session uses new keys
+        resume_offset = received if not encrypted_transfer else 0
+
+        if self.protocol != LEGACY_PROTOCOL and not resume_offset and file_size <= PACK_FILE_SIZE:
+            await self.queue_packed_file(file_path, relative_file_path, encrypted_transfer, plain_size, file_size,
+                                         counted)
+            return True
+        await self.flush_pack()
+
+        # The metadata file is consumed by the receiver, not written, so only payload files are verified
+        verified = self.integrity and counted
+        parallel = (not encrypted_transfer and not resume_offset
+                    and self.parallel_streams > 1 and file_size >= PARALLEL_THRESHOLD)
+        # Encrypted data does not shrink, and range connections carry raw bytes
+        compressed = (not encrypted_transfer and not parallel and self.may_compress(file_path)
+                      and await asyncio.to_thread(worth_compressing, file_path, resume_offset))
+        chunked = entry is not None and not compressed and self.interruptible(file_size, encrypted_transfer, parallel)
+        if resume_offset:
+            logger.debug("Resuming %s at byte %d", relative_file_path, resume_offset)
+
+        if self.protocol == LEGACY_PROTOCOL:
+            if resume_offset:
+                header = pack_legacy_header('encyp: o', relative_file_path, file_size, resume_offset)
+            elif parallel:
+                header = pack_legacy_header('encyp: p', relative_file_path, file_size, self.parallel_streams)
+            else:
+                encryption_flag = 'encyp: t' if encrypted_transfer else 'encyp: f'
+                header = pack_legacy_header(encryption_flag, relative_file_path, file_size)
+        else:
+            flags = FLAG_PARALLEL if parallel else 0 if chunked else FLAG_INLINE
+            if encrypted_transfer:
+                flags |= FLAG_ENCRYPTED
+            if verified:
+                flags |= FLAG_DIGEST
+            if compressed:
+                flags |= FLAG_COMPRESSED
+            file_id = self.next_file_id
+            header = pack_frame(FRAME_FILE, file_id=self.next_file_id, offset=resume_offset, length=file_size,
+                                flags=flags, streams=self.parallel_streams if parallel else 0,
+                                name=relative_file_path)
+            self.next_file_id += 1
+
+        if counted:
+            self.progress.begin_file(relative_file_path, file_size, resume_offset)
+
+        def report_progress(sent_size):
+            if counted:
+                self.progress.update_file(resume_offset + sent_size)
+
+        await self.writer.write(header)
+        await self.writer.flush()
+
+        hasher = BlockHasher() if verified else None
+        if encrypted_transfer:
+            with open(file_path, 'rb') as f:
+                chunks = encrypt_stream(f, self.encryption_session, plain_size)
+                if hasher:
+                    chunks = _hashed(chunks, hasher.update)
+                await send_chunks_async(self.sock, chunks, progress_callback=report_progress, throttle=self.throttle)
+        else:
+            # Hashed on a worker thread while the kernel sends the same pages, whole file even when resuming
+            hashing = asyncio.ensure_future(asyncio.to_thread(hash_file, file_path, file_size)) if verified else None
+            try:
+                if parallel:
+                    port = self.sock.getpeername()[1]
+                    await send_file_parallel_async(self.ip_address, port, file_path, file_size,
+                                                   self.parallel_streams, progress_callback=report_progress,
+                                                   hello=self.session.hello(), throttle=self.throttle)
+                elif chunked:
+                    await self.send_interruptible(entry, file_path, file_id, resume_offset, file_size,
+                                                  report_progress)
+                elif compressed:
+                    compressor = BlockCompressor(self.compression)
+                    with await self.read_ahead.open(file_path) as f:
+                        blocks = compressor.blocks(f, resume_offset, file_size - resume_offset)
+                        await send_chunks_async(self.sock, blocks,
+                                                progress_callback=lambda _: report_progress(compressor.consumed),
+                                                throttle=self.throttle)
+                    logger.debug("Compressed %s to %d of %d bytes", relative_file_path, compressor.stored,
+                                 compressor.consumed)
+                else:
+                    await send_file_data_async(self.sock, file_path, offset=resume_offset,
+                                               count=file_size - resume_offset, progress_callback=report_progress,
+                                               read_ahead=self.read_ahead, throttle=self.throttle)
+            except BaseException:
+                if hashing:
+                    hashing.cancel()
+                raise
+            if hashing:
+                hasher = await hashing
+        if verified:
+            await self.send_digest(file_id, relative_file_path, hasher.digests(),
+                                   (file_path, encrypted_transfer, plain_size, file_size))
+
+        if counted:
+            self.progress.end_file()
+        return True
+
+    async def send_interruptible(self, entry, file_path, file_id, offset, file_size, report_progress):
+        """Send the rest of a file from `offset` as FRAME_DATA chunks, sending urgent files between them."""
+        start = offset
+        while offset < file_size:
+            length = min(PREEMPT_CHUNK_SIZE, file_size - offset)
+            await self.writer.write(pack_frame(FRAME_DATA, file_id=file_id, offset=offset, length=length,
+                                               flags=FLAG_LAST if offset + length == file_size else 0))
+            await self.writer.flush()
+            await send_file_data_async(self.sock, file_path, offset=offset, count=length, throttle=self.throttle,
+                                       progress_callback=lambda sent, done=offset - start: report_progress(done + sent))
+            offset += length
+            urgent = self.queue.preempting(entry) if offset < file_size else None
+            if not urgent:
+                continue
+            while urgent:
+                logger.info("Sending %s ahead of %s", urgent.name, entry.name)
+                await self.send_file(*urgent.send, encrypted_transfer=self.encryption_flag, entry=urgent)
+                self.queue.done(urgent)
+                urgent = self.queue.preempting(entry)
+            # The receiver has the urgent files complete before this one goes on
+            await self.flush_pack()
+            self.queue.resume(entry)
+            self.progress.switch_file(entry.name, file_size, offset)
+
+    async def queue_packed_file(self, file_path, relative_file_path, encrypted_transfer, plain_size, file_size,
+                                counted):
+        # Small files are read into a pack and go out many at a time, one header per pack
+        body = await self.read_ahead.read(file_path)
+        if encrypted_transfer:
+            body = b''.join(encrypt_stream(io.BytesIO(body), self.encryption_session, plain_size))
+        if len(body) != file_size:
+            raise ConnectionError("File ended before all data was sent.")
+        digest = None
+        if self.integrity and counted:
+            hasher = BlockHasher()
+            hasher.update(body)
+            digest = file_digest(hasher.digests())
+            self.manifest.add(relative_file_path, digest)
+            self.sent_files[relative_file_path] = (file_path, encrypted_transfer, plain_size, file_size)
+            digest = digest.hex()
+        self.pack_entries.append((relative_file_path, FLAG_ENCRYPTED if encrypted_transfer else 0, body, digest))
+        self.pack_size += len(body)
+        if counted:
+            self.pack_counted += 1
+        if self.pack_size >= PACK_SIZE or len(self.pack_entries) >= PACK_MAX_FILES:
+            await self.flush_pack()
+
+    async def flush_pack(self):
+        if not self.pack_entries:
+            return
+        await self.writer.write(*pack_files(self.pack_entries))
+        await self.writer.flush()
+        logger.debug("Sent pack of %d files, %d bytes", len(self.pack_entries), self.pack_size)
+        self.progress.add_files(self.pack_counted, self.pack_size)
+        self.pack_entries = []
+        self.pack_size = 0
+        self.pack_counted = 0
+
+    async def request_sync(self):
+        """Which files of the folder the receiver already has: {"same": [names], "blocks": {name: hex digests}}."""
+        await self.flush_pack()
+        await self.writer.write(pack_frame(FRAME_SYNC))
+        await self.writer.flush()
+        reply = await read_frame_async(self.sock)
+        if reply.type != FRAME_SYNC:
+            raise ProtocolError(f"Expected the sync state, got frame type {reply.type}")
+        state = json.loads((await recv_exact_async(self.sock, reply.length)).decode())
+        logger.info("Receiver has %d files unchanged and %d older", len(state.get("same", [])),
+                    len(state.get("blocks", {})))
+        return state
+
+    async def send_delta(self, file_path, relative_file_path, file_size, their_digests):
+        # The receiver's older copy is patched in place with the blocks that differ
+        ranges = damaged_ranges(self.signatures[relative_file_path], their_digests, file_size, SYNC_BLOCK_SIZE)
+        changed = sum(length for _, length in ranges)
+        logger.debug("Sending %d of %d bytes of %s", changed, file_size, relative_file_path)
+        self.sent_files[relative_file_path] = (file_path, False, file_size, file_size)
+        await self.repair_file(relative_file_path, ranges)
+        self.progress.add_files(1, file_size - changed, transferred=False)
+        self.progress.add_files(0, changed)
+
+    async def send_digest(self, file_id, name, digests, source):
+        await self.writer.write(pack_frame(FRAME_DIGEST, file_id=file_id, offset=INTEGRITY_BLOCK_SIZE,
+                                           length=len(digests)), digests)
+        self.manifest.add(name, file_digest(digests))
+        self.sent_files[name] = source
+
+    async def verify_batch(self):
+        """Has the receiver check the batch against our manifest and resends what it reports damaged.
+
+        Returns the names that were still damaged after RETRANSMIT_ATTEMPTS rounds.
+        """
+        for attempt in range(RETRANSMIT_ATTEMPTS + 1):
+            nodes = self.manifest.nodes()
+            request = json.dumps({"root": nodes[''], "nodes": nodes}).encode()
+            await self.writer.write(pack_frame(FRAME_VERIFY, length=len(request)), request)
+            await self.writer.flush()
+            reply = await read_frame_async(self.sock)
+            if reply.type != FRAME_VERIFY:
+                raise ProtocolError(f"Expected a verdict, got frame type {reply.type}")
+            verdict = json.loads((await recv_exact_async(self.sock, reply.length)).decode())
+
+            repairs = {name: ranges for name, ranges in verdict.get("retransmit", {}).items()
+                       if name in self.sent_files}
+            # Files the receiver lacks or holds with other content, found by descending the differing nodes
+            have = verdict.get("have", {})
+            for name, digest in self.manifest.in_directories(verdict.get("directories", [])).items():
+                if name not in repairs and have.get(name) != digest:
+                    repairs[name] = None
+            if not repairs:
+                logger.debug("Receiver verified %d files", len(self.manifest.files))
+                return []
+            if attempt == RETRANSMIT_ATTEMPTS:
+                return list(repairs)
+            logger.warning("Receiver reports %d damaged files, sending them again", len(repairs))
+            for name, ranges in repairs.items():
+                await self.repair_file(name, ranges)
+
+    async def repair_file(self, name, ranges):
+        file_path, encrypted_transfer, plain_size, file_size = self.sent_files[name]
+        # Encryption uses a fresh nonce each time, so an encrypted file is only ever replaced whole
+        if encrypted_transfer or ranges is None:
+            ranges = [(0, file_size)]
+        elif not ranges:
+            # Nothing changed but the length: an empty last chunk completes the file
+            ranges = [(file_size, 0)]
+        flags = FLAG_REPAIR | FLAG_DIGEST | (FLAG_ENCRYPTED if encrypted_transfer else 0)
+        file_id = self.next_file_id
+        self.next_file_id += 1
+        logger.debug("Sending %d ranges of %s in place", len(ranges), name)
+        await self.writer.write(pack_frame(FRAME_FILE, file_id=file_id, length=file_size, flags=flags, name=name))
+
+        if encrypted_transfer:
+            hasher = BlockHasher()
+            await self.writer.write(pack_frame(FRAME_DATA, file_id=file_id, length=file_size, flags=FLAG_LAST))
+            await self.writer.flush()
+            with open(file_path, 'rb') as f:
+                await send_chunks_async(self.sock, _hashed(encrypt_stream(f, self.encryption_session, plain_size),
+                                                           hasher.update), throttle=self.throttle)
+            digests = hasher.digests()
+        else:
+            for index, (offset, length) in enumerate(ranges):
+                await self.writer.write(pack_frame(FRAME_DATA, file_id=file_id, offset=offset, length=length,
+                                                   flags=FLAG_LAST if index == len(ranges) - 1 else 0))
+                await self.writer.flush()
+                await send_file_data_async(self.sock, file_path, offset=offset, count=length, throttle=self.throttle)
+            digests = (await asyncio.to_thread(hash_file, file_path, file_size)).digests()
+        await self.send_digest(file_id, name, digests, self.sent_files[name])
+
+
+class Receiver:
+    """Receives batches from the sender at `peer_ip` until it disconnects.
+
+    `listener` is the sender's slot on a shared ReceiverServer; without one
+    the receiver serves RECEIVER_DATA itself for just this sender.
+    `save_to_directory` overrides the config setting of that name.
+    """
+    # Kernel socket -> file copy on Linux; off by default as it bypasses the buffer
+    use_splice = False
+    # Files a framed sender may have open at once with interleaved FRAME_DATA chunks
+    max_open_files = 64
+
+    def __init__(self, peer_ip, listener=None, session_token=None, events=None, buffer_size=RECEIVE_BUFFER_SIZE,
+                 save_to_directory=None):
+        self.peer_ip = peer_ip
+        self.save_to_directory = save_to_directory
+        self.listener = listener
+        self.own_server = None
+        # Set when the sender paired in the handshake: its connection stays open across batches
+        self.session_token = listener.token if listener else session_token
+        self.events = events or TransferEvents()
+        self.sock = None
+        self.client_address = None
+        self.encrypted_files = []
+        self.metadata = None
+        self.is_folder_transfer = False
+        self.destination_folder = None
+        self.base_folder_name = ''
+        self.journal = None
+        self.progress = None
+        self.open_files = {}
+        # Integrity checks of the current batch: what arrived, what the sender says it sent, and what differs
+        self.manifest = Manifest()
+        self.expected = Manifest()
+        self.received_files = {}
+        self.damaged = {}
+        self.verifying = {}
+        self.repairing = set()
+        # Sync mode: older copies of this batch's files, patched in place
+        self.sync_targets = {}
+        self.buffer_size = buffer_size
+        self.receive_buffer = allocate_receive_buffer(buffer_size)
+        self.write_behind = None
+
+    async def run(self):
+        write_behind_limit = get_config().get("write_behind_mb", 16) * 1024 * 1024
+        if write_behind_limit:
+            # Disk writes on a helper thread, so a slow destination does not hold up the socket
+            self.write_behind = WriteBehind(write_behind_limit, self.buffer_size)
+        if self.listener is None:
+            # Standalone receiver (benchmarks, scripts): serve RECEIVER_DATA for this one sender
+            self.own_server = ReceiverServer(max_senders=1).start()
+            self.listener = self.own_server.register(self.peer_ip, self.session_token)
+        self.listener.settimeout(ACCEPT_TIMEOUT)
+        try:
+            if not await self.accept():
+                logger.error("Failed to establish a connection.")
+                return
+            while True:
+                if await self.receive_batch():
+                    # A paired sender keeps the connection open for its next batch
+                    if self.session_token:
+                        continue
+                    break
+                # A sender that supports resuming reconnects after a dropped
+                # connection; keep serving it until the batch completes.
+                if not (self.journal and await self.wait_for_reconnect()):
+                    break
+                logger.info("Sender reconnected, resuming transfer %s", self.journal.transfer_id)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.write_behind:
+            self.write_behind.close()
+        for f, *_ in self.open_files.values():
+            f.close()
+        self.open_files = {}
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        self.listener.close()
+        if self.own_server:
+            self.own_server.stop()
+        release_paths(self)
+
+    async def accept(self):
+        try:
+            self.sock, self.client_address = await self.listener.accept()
+        except OSError as e:
+            error_message = f"Failed to accept connection: {str(e)}"
+            logger.error(error_message)
+            self.events.on_error("Connection Error", error_message, "")
+            return False
+        self.sock.setblocking(False)
+        logger.debug("Connected to %s", self.client_address)
+        return True
+
+    async def wait_for_reconnect(self):
+        self.sock.close()
+        self.sock = None
+        try:
+            self.sock, self.client_address = await self.listener.accept()
+        except OSError as e:
+            logger.error("Sender did not reconnect: %s", e)
+            return False
+        self.sock.setblocking(False)
+        return True
+
+    async def handle_resume_request(self, frame):
+        request = json.loads((await recv_exact_async(self.sock, frame.length)).decode())
+        self.journal = TransferJournal(request['transfer_id'])
+        reply = json.dumps({'files': self.journal.offsets()}).encode()
+        if frame.version == LEGACY_PROTOCOL:
+            header = struct.pack('<Q', len(reply))
+        else:
+            header = pack_frame(FRAME_RESUME, length=len(reply))
+        await asyncio.get_running_loop().sock_sendall(self.sock, header + reply)
+        logger.debug("Resume state sent for transfer %s", self.journal.transfer_id)
+
+    def finish_batch(self):
+        if self.journal:
+            for path in self.journal.encrypted_paths():
+                if path not in self.encrypted_files and os.path.exists(path):
+                    self.encrypted_files.append(path)
+            self.journal.discard()
+            self.journal = None
+        encrypted_files, self.encrypted_files = self.encrypted_files, []
+        if self.damaged:
+            names = sorted(self.damaged)
+            logger.error("%d files failed verification: %s", len(names), ", ".join(names[:10]))
+            self.events.on_error("Integrity Error", f"{len(names)} files did not arrive intact.", "\n".join(names))
+        self.manifest = Manifest()
+        self.expected = Manifest()
+        self.received_files = {}
+        self.damaged = {}
+        self.sync_targets = {}
+        self.progress.finish()
+        release_paths(self)
+        # The next batch of a session starts from scratch
+        self.progress = None
+        self.metadata = None
+        self.destination_folder = None
+        self.is_folder_transfer = False
+        logger.debug("Received halt signal. Stopping file reception.")
+        self.events.on_finished(encrypted_files)
+
+    async def receive_batch(self):
+        """Receive one connection's worth of files. Returns True once the sender's halt signal arrived."""
+        logger.debug("File reception started.")
+        finished = False
+
+        while True:
+            try:
+                # Framed and legacy senders are told apart by the first bytes of each header
+                first_bytes = await recv_exact_async(self.sock, 8, allow_eof=True)
+                if not first_bytes:
+                    logger.debug("Sender closed the connection.")
+                    break
+                if is_frame(first_bytes):
+                    frame = await read_frame_async(self.sock, first_bytes)
+                else:
+                    frame = await read_legacy_header_async(self.sock, first_bytes.decode())
+                logger.debug("Received frame: %s", frame)
+                if self.progress is None:
+                    # First frame of a batch
+                    self.progress = TransferProgress(self.events.on_progress)
+                    self.events.on_started()
+
+                if frame is None:
+                    logger.debug("End of transfer signal received.")
+                    break
+                if frame.type == FRAME_HALT:
+                    self.finish_batch()
+                    finished = True
+                    break
+                if frame.type == FRAME_RESUME:
+                    await self.handle_resume_request(frame)
+                    continue
+                if frame.type == FRAME_DATA:
+                    await self.receive_chunk(frame)
+                    continue
+                if frame.type == FRAME_PACK:
+                    await self.receive_pack(frame)
+                    continue
+                if frame.type == FRAME_DIGEST:
+                    await self.receive_digest(frame)
+                    continue
+                if frame.type == FRAME_VERIFY:
+                    await self.send_verdict(frame)
+                    continue
+                if frame.type == FRAME_SYNC:
+                    await self.send_sync_state(frame)
+                    continue
+                if frame.type != FRAME_FILE:
+                    raise ProtocolError(f"Unknown frame type {frame.type}")
+
+                file_name = frame.name.replace('\\', '/')
+                try:
+                    if file_name == 'metadata.json':
+                        logger.debug("Receiving metadata file.")
+                        self.apply_metadata(await self.receive_metadata(frame.length))
+                        continue
+
+                    await self.receive_file(frame, file_name)
+
+                except Exception as e:
+                    # Part of the body may still be unread and would be taken for the next header;
+                    # drop the connection instead, a sender that can resume starts this file over
+                    logger.error(f"Error saving file {file_name}: {str(e)}")
+                    break
+
+            except Exception as e:
+                logger.error("Error during file reception: %s", str(e))
+                break
+
+        if self.write_behind:
+            await self.write_behind.drain()
+        for f, *_ in self.open_files.values():
+            f.close()
+        self.open_files = {}
+        # File ids start over on the next connection
+        self.verifying = {}
+        self.repairing = set()
+        if self.journal and not finished:
+            # Keep what arrived so a reconnecting sender can skip it
+            self.journal.save()
+        logger.debug("File reception completed.")
+        return finished
+
+    def apply_metadata(self, metadata):
+        self.metadata = metadata
+        self.is_folder_transfer = any(file_info.get('path', '').endswith('/') for file_info in metadata)
+        files = [file_info for file_info in metadata
+                 if not file_info.get('path', '').endswith(('/', '.delete'))]
+        self.progress.set_totals(sum(file_info.get('size', 0) for file_info in files), len(files))
+        if self.is_folder_transfer and self.journal and self.journal.existing_destination():
+            # Resumed batch: keep filling the folder the first attempt created
+            self.destination_folder = self.journal.existing_destination()
+        elif self.is_folder_transfer:
+            # In sync mode the folder of the last transfer is updated rather than copied again
+            sync = any(file_info.get('sync') for file_info in metadata)
+            self.destination_folder = self.create_folder_structure(self.metadata, reuse=sync)
+        else:
+            self.destination_folder = self.save_to_directory or get_config()["save_to_directory"]
+        if self.journal:
+            self.journal.set_destination(self.destination_folder)
+
+    def target_path(self, file_name):
+        if self.is_folder_transfer:
+            relative_file_path = file_name
+            if self.base_folder_name and relative_file_path.startswith(self.base_folder_name + '/'):
+                relative_file_path = relative_file_path[len(self.base_folder_name) + 1:]
+            return os.path.join(self.destination_folder, relative_file_path)
+        return os.path.join(self.destination_folder, os.path.basename(file_name))
+
+    def resolve_file_path(self, file_name, file_size):
+        full_file_path = self.target_path(file_name)
+        os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+        journaled_path = self.journal.path_for(file_name, file_size) if self.journal else None
+        if journaled_path:
+            # Same file as in an earlier attempt: overwrite or continue it in place
+            return journaled_path
+        # Claimed rather than just checked, so a concurrent sender never gets the same name
+        return claim_path(self, full_file_path)
+
+    async def receive_file(self, frame, file_name):
+        file_size = frame.length
+        resume_offset = frame.offset
+        encrypted_transfer = bool(frame.flags & FLAG_ENCRYPTED)
+        parallel_transfer = bool(frame.flags & FLAG_PARALLEL)
+        verified = bool(frame.flags & FLAG_DIGEST)
+        compressed = bool(frame.flags & FLAG_COMPRESSED)
+        if frame.flags & FLAG_REPAIR:
+            self.open_repair(frame, file_name, encrypted_transfer)
+            return
+
+        full_file_path = self.resolve_file_path(file_name, file_size)
+        logger.debug(f"Saving file to: {full_file_path}")
+        if self.journal:
+            self.journal.start_file(file_name, full_file_path, file_size, resume_offset, encrypted_transfer)
+
+        if not frame.flags & (FLAG_INLINE | FLAG_PARALLEL):
+            # Body follows as FRAME_DATA chunks, possibly interleaved with other files
+            if len(self.open_files) >= self.max_open_files:
+                raise ProtocolError("Too many files open at once")
+            f = open(full_file_path, "r+b" if resume_offset else "wb")
+            if not resume_offset:
+                preallocate_file(f, file_size)
+            self.open_files[frame.file_id] = (f, file_name, full_file_path, file_size, encrypted_transfer)
+            if verified:
+                self.verifying[frame.file_id] = (file_name, full_file_path, file_size, None)
+            if resume_offset >= file_size:
+                self.close_open_file(frame.file_id)
+            return
+
+        self.progress.begin_file(file_name, file_size, resume_offset)
+
+        def report_progress(received_size):
+            self.progress.update_file(resume_offset + received_size)
+            if self.journal and not parallel_transfer:
+                self.journal.update(file_name, resume_offset + received_size)
+
+        # Hashed as the data passes through the receive buffer; parallel streams are read back afterwards
+        hasher = None
+        if verified and resume_offset:
+            hasher = await asyncio.to_thread(hash_file, full_file_path, resume_offset)
+        elif verified and not parallel_transfer:
+            hasher = BlockHasher()
+        data_callback = hasher.update if hasher else None
+
+        if resume_offset:
+            logger.debug("Resuming %s at byte %d", file_name, resume_offset)
+            with open(full_file_path, "r+b") as f:
+                f.seek(resume_offset)
+                await self.receive_body(f, file_size - resume_offset, compressed, report_progress, data_callback)
+        else:
+            with open(full_file_path, "wb") as f:
+                preallocate_file(f, file_size)
+                if parallel_transfer:
+                    logger.debug("Receiving %s over %d parallel streams", file_name, frame.streams)
+                    await receive_file_parallel(
+                        self.listener, f, file_size, frame.streams,
+                        peer_ip=self.client_address[0], buffer_size=self.buffer_size,
+                        progress_callback=report_progress
+                    )
+                else:
+                    await self.receive_body(f, file_size, compressed, report_progress, data_callback)
+        if verified:
+            self.verifying[frame.file_id] = (file_name, full_file_path, file_size, hasher)
+
+        self.complete_file(file_name, full_file_path, encrypted_transfer)
+        self.progress.end_file()
+
+    async def receive_body(self, f, size, compressed, progress_callback, data_callback):
+        if compressed:
+            # Written as the blocks are decompressed; splice and write-behind need the raw stream
+            await receive_compressed_async(self.sock, f, size, progress_callback, data_callback)
+            return
+        await receive_file_data_async(
+            self.sock, f, size, self.receive_buffer,
+            progress_callback=progress_callback, use_splice=self.use_splice, data_callback=data_callback,
+            write_behind=self.write_behind
+        )
+        await self.flush(f)
+
+    async def receive_chunk(self, frame):
+        if frame.file_id not in self.open_files:
+            raise ProtocolError(f"Data for unknown file {frame.file_id}")
+        f, file_name, full_file_path, file_size, encrypted_transfer = self.open_files[frame.file_id]
+        if frame.offset + frame.length > file_size:
+            raise ProtocolError(f"Chunk {frame.offset}+{frame.length} is outside {file_name}")
+        report_progress = None
+        if self.journal and frame.file_id not in self.repairing:
+            # A sender's own chunks of a file come in order, so what is written is all there is; repairs go anywhere
+            report_progress = lambda received_size: self.journal.update(file_name, frame.offset + received_size)
+        f.seek(frame.offset)
+        await receive_file_data_async(self.sock, f, frame.length, self.receive_buffer, progress_callback=report_progress,
+                                      use_splice=self.use_splice, write_behind=self.write_behind)
+        if frame.file_id not in self.repairing:
+            self.progress.add_files(0, frame.length)
+        if frame.flags & FLAG_LAST:
+            # Complete only once everything of it is on disk
+            await self.flush(f)
+            self.close_open_file(frame.file_id)
+
+    async def flush(self, f):
+        if self.write_behind:
+            await self.write_behind.flush(f)
+
+    async def receive_pack(self, frame):
+        entries = await read_pack_async(self.sock, frame)
+        files = []
+        for name, flags, body, digest in entries:
+            name = name.replace('\\', '/')
+            if name == 'metadata.json':
+                self.apply_metadata(json.loads(bytes(body).decode('utf-8')))
+            else:
+                files.append((name, flags, body, digest, self.target_path(name)))
+
+        # Directories are created and listed once per pack instead of once per file
+        listings = {}
+        for directory in sorted({os.path.dirname(path) for *_, path in files}):
+            os.makedirs(directory, exist_ok=True)
+            listings[directory] = set(os.listdir(directory))
+
+        for name, flags, body, digest, path in files:
+            try:
+                full_file_path = self.journal.path_for(name, len(body)) if self.journal else None
+                if not full_file_path:
+                    full_file_path = self._unique_in_listing(path, listings[os.path.dirname(path)])
+                encrypted_transfer = bool(flags & FLAG_ENCRYPTED)
+                if self.journal:
+                    self.journal.start_file(name, full_file_path, len(body), 0, encrypted_transfer)
+                with open(full_file_path, "wb") as f:
+                    f.write(body)
+                self.complete_file(name, full_file_path, encrypted_transfer)
+                if digest:
+                    hasher = BlockHasher()
+                    hasher.update(body)
+                    expected, actual = bytes.fromhex(digest), file_digest(hasher.digests())
+                    self.check_file(name, full_file_path, expected, actual,
+                                    [(0, len(body))] if expected != actual else [])
+            except Exception as e:
+                logger.error(f"Error saving file {name}: {str(e)}")
+        logger.debug("Unpacked %d files", len(files))
+        self.progress.add_files(len(files), sum(len(body) for _, _, body, *_ in files))
+
+    def _unique_in_listing(self, file_path, listing):
+        # Same naming as resolve_file_path, checked against a directory listing taken up front
+        candidate = claim_path(self, file_path, taken=lambda path: os.path.basename(path) in listing)
+        listing.add(os.path.basename(candidate))
+        return candidate
+
+    def close_open_file(self, file_id):
+        f, file_name, full_file_path, file_size, encrypted_transfer = self.open_files.pop(file_id)
+        f.close()
+        if file_id in self.repairing:
+            self.repairing.discard(file_id)
+        else:
+            self.progress.add_files(1, 0)
+        self.complete_file(file_name, full_file_path, encrypted_transfer)
+
+    def open_repair(self, frame, file_name, encrypted_transfer):
+        # Ranges of a file that arrived damaged earlier in the batch, or of an older copy in sync mode
+        synced = self.sync_targets.pop(file_name, None)
+        full_file_path = synced or self.received_files.get(file_name)
+        if synced:
+            # Unchanged blocks stay as they are; the file counts as done once its changes are in
+            self.progress.add_files(1, frame.length, transferred=False)
+            if self.journal:
+                self.journal.start_file(file_name, synced, frame.length, 0, encrypted_transfer)
+        if not full_file_path or not os.path.exists(full_file_path):
+            full_file_path = self.resolve_file_path(file_name, frame.length)
+            open(full_file_path, "wb").close()
+        if len(self.open_files) >= self.max_open_files:
+            raise ProtocolError("Too many files open at once")
+        f = open(full_file_path, "r+b")
+        f.truncate(frame.length)
+        self.open_files[frame.file_id] = (f, file_name, full_file_path, frame.length, encrypted_transfer)
+        self.repairing.add(frame.file_id)
+        self.verifying[frame.file_id] = (file_name, full_file_path, frame.length, None)
+
+    async def receive_digest(self, frame):
+        expected = await recv_exact_async(self.sock, frame.length)
+        if frame.file_id not in self.verifying:
+            # The file could not be saved; it is missing from the manifest and gets sent again whole
+            logger.debug("Digest for unsaved file %d", frame.file_id)
+            return
+        file_name, full_file_path, file_size, hasher = self.verifying.pop(frame.file_id)
+        block_size = frame.offset
+        if block_size <= 0:
+            raise ProtocolError(f"Invalid digest block size {block_size}")
+        if hasher is None or hasher.block_size != block_size:
+            hasher = await asyncio.to_thread(hash_file, full_file_path, file_size, block_size)
+        actual = hasher.digests()
+        self.check_file(file_name, full_file_path, file_digest(expected), file_digest(actual),
+                        damaged_ranges(expected, actual, file_size, block_size))
+
+    def check_file(self, file_name, full_file_path, expected, actual, ranges):
+        self.received_files[file_name] = full_file_path
+        self.manifest.add(file_name, actual)
+        self.expected.add(file_name, expected)
+        if ranges:
+            logger.warning("%s arrived damaged in %d ranges", file_name, len(ranges))
+            self.damaged[file_name] = ranges
+        else:
+            self.damaged.pop(file_name, None)
+
+    async def send_sync_state(self, frame):
+        await recv_exact_async(self.sock, frame.length)
+        same, blocks = await asyncio.to_thread(self.compare_folder) if self.is_folder_transfer else ([], {})
+        unchanged = {file_info['path']: file_info['size'] for file_info in self.metadata or []
+                     if file_info['path'] in same}
+        self.progress.add_files(len(unchanged), sum(unchanged.values()), transferred=False)
+        reply = json.dumps({"same": same, "blocks": blocks}).encode()
+        await asyncio.get_running_loop().sock_sendall(self.sock, pack_frame(FRAME_SYNC, length=len(reply)) + reply)
+        logger.debug("Sync: %d files unchanged, %d to patch", len(same), len(blocks))
+
+    def compare_folder(self):
+        """Files of the metadata already in the destination folder, and the block digests of older copies."""
+        same, blocks = [], {}
+        for file_info in self.metadata:
+            if 'digest' not in file_info:
+                continue
+            full_file_path = self.target_path(file_info['path'])
+            if not os.path.isfile(full_file_path):
+                continue
+            digests = hash_file(full_file_path, block_size=SYNC_BLOCK_SIZE).digests()
+            if (os.path.getsize(full_file_path) == file_info['size']
+                    and file_digest(digests).hex() == file_info['digest']):
+                same.append(file_info['path'])
+            else:
+                blocks[file_info['path']] = digests.hex()
+                self.sync_targets[file_info['path']] = full_file_path
+        return same, blocks
+
+    async def send_verdict(self, frame):
+        request = json.loads((await recv_exact_async(self.sock, frame.length)).decode())
+        verdict = {"root": self.manifest.root(), "retransmit": self.damaged}
+        # Damaged files explain part of the difference; any other means files are missing or extra here
+        directories = Manifest.differing(self.expected.nodes(), request.get("nodes", {}))
+        if directories:
+            verdict["directories"] = directories
+            verdict["have"] = self.manifest.in_directories(directories)
+        reply = json.dumps(verdict).encode()
+        await asyncio.get_running_loop().sock_sendall(self.sock, pack_frame(FRAME_VERIFY, length=len(reply)) + reply)
+        logger.debug("Verified batch: %d damaged files, %d directories differ", len(self.damaged), len(directories))
+
+    def complete_file(self, file_name, full_file_path, encrypted_transfer):
+        if self.journal:
+            self.journal.complete_file(file_name)
+        if encrypted_transfer and full_file_path not in self.encrypted_files:
+            self.encrypted_files.append(full_file_path)
+
+    async def receive_metadata(self, file_size):
+        received_data = await recv_exact_async(self.sock, file_size)
+        try:
+            metadata_json = received_data.decode('utf-8')
+            return json.loads(metadata_json)
+        except UnicodeDecodeError as e:
+            logger.error("Unicode decode error: %s", e)
+            raise
+        except json.JSONDecodeError as e:
+            logger.error("JSON decode error: %s", e)
+            raise
+
+    def create_folder_structure(self, metadata, reuse=False):
+        default_dir = self.save_to_directory or get_config()["save_to_directory"]
+
+        if not default_dir:
+            raise ValueError("No save_to_directory configured")
+
+        base_folder_name = None
+        for file_info in metadata:
+            path = file_info.get('path', '')
+            if path.endswith('/'):
+                base_folder_name = path.rstrip('/').split('/')[0]
+                logger.debug("Found base folder name: %s", base_folder_name)
+                break
+
+        if not base_folder_name:
+            base_folder_name = metadata[-1].get('base_folder_name', '')
+            logger.debug("Base folder name from last metadata entry: %s", base_folder_name)
+
+        if not base_folder_name:
+            raise ValueError("Base folder name not found in metadata")
+
+        destination_folder = claim_path(self, os.path.join(default_dir, base_folder_name), is_folder=True,
+                                        taken=(lambda path: False) if reuse else os.path.exists)
+        logger.debug("Destination folder: %s", destination_folder)
+
+        if not os.path.exists(destination_folder):
+            os.makedirs(destination_folder)
+            logger.debug("Created root folder: %s", destination_folder)
+
+        self.base_folder_name = base_folder_name
+
+        return destination_folder
@@ -0,0 +1,699 @@
+import asyncio
+import collections
+import os
+import queue
+import threading
+from constant import logger
+
+# Bytes handed to the kernel per sendfile() call. Large enough that the
+# interpreter is out of the data path, small enough to keep progress moving.
+SENDFILE_CHUNK_SIZE = 8 * 1024 * 1024
+# Buffer used when zero-copy is not available (Windows, non-regular files)
+FALLBACK_CHUNK_SIZE = 1024 * 1024
+
+HAS_SENDFILE = hasattr(os, 'sendfile')
+HAS_FADVISE = hasattr(os, 'posix_fadvise')
+_WILLNEED = getattr(os, 'POSIX_FADV_WILLNEED', 0)
+_SEQUENTIAL = getattr(os, 'POSIX_FADV_SEQUENTIAL', 0)
+
+
+def _read_file(file_path, offset, count, chunk_size=FALLBACK_CHUNK_SIZE):
+    with open(file_path, 'rb') as f:
+        yield from _read_chunks(f, offset, count, chunk_size)
+
+
+def _read_chunks(f, offset, count, chunk_size=FALLBACK_CHUNK_SIZE):
+    f.seek(offset)
+    remaining = count
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            raise ConnectionError("File ended before all data was sent.")
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _advise(f, offset, length, advice):
+    # Only a hint: the kernel starts reading in the background and returns at once
+    if HAS_FADVISE and length >= 0:
+        try:
+            os.posix_fadvise(f.fileno(), offset, length, advice)
+        except OSError:
+            pass
+
+
+
+async def send_file_data_async(sock, file_path, progress_callback=None, offset=0, count=None, read_ahead=None,
+                               throttle=None):
+    """Stream `count` bytes of `file_path` starting at `offset` to the non-blocking `sock`.
+
+    `progress_callback` is called with the bytes sent so far after every
+    chunk and `throttle` is a bandwidth.Throttle pacing them. With sendfile
+    the kernel is asked to read the next chunk while the current one is
+    sent. Without it the file is read on a helper thread, ahead of the
+    socket. `read_ahead` is the sender's ReadAhead, which may have opened
+    or read the file already.
+    """
+    loop = asyncio.get_running_loop()
+    if count is None:
+        count = os.path.getsize(file_path) - offset
+    if not HAS_SENDFILE:
+        if read_ahead:
+            return await read_ahead.send(sock, file_path, offset, count, progress_callback, throttle)
+        return await send_chunks_async(sock, _read_file(file_path, offset, count), progress_callback, throttle)
+    sent = 0
+    f = await read_ahead.open(file_path) if read_ahead else open(file_path, 'rb')
+    with f:
+        while sent < count:
+            chunk = min(SENDFILE_CHUNK_SIZE, count - sent)
+            if throttle and throttle.limited():
+                chunk = throttle.chunk_size(chunk)
+                await throttle.wait(chunk)
+            following = min(SENDFILE_CHUNK_SIZE, count - sent - chunk)
+            if following:
+                _advise(f, offset + sent + chunk, following, _WILLNEED)
+            n = await loop.sock_sendfile(sock, f, offset + sent, chunk)
+            if n == 0:
+                raise ConnectionError("File ended before all data was sent.")
+            sent += n
+            if progress_callback:
+                progress_callback(sent)
+    return sent
+
+
+# Bytes a ReadAhead holds in memory at most, the size of each read, and the
+# threads opening files at once (opens on a network share are latency bound)
+READ_AHEAD_LIMIT = 16 * 1024 * 1024
+READ_AHEAD_CHUNK_SIZE = 1024 * 1024
+READ_AHEAD_WORKERS = 4
+_DONE = object()
+
+
+class ReadAhead:
+    """Opens and reads files on helper threads ahead of the sender.
+
+    The sender announces upcoming files with want(), in the order it will
+    send them. While it sends one, the threads already open the next ones.
+    Files wanted whole are read into memory, the rest are opened with a
+    kernel read-ahead hint and handed over for sendfile. Past their first
+    chunk, files are read one at a time, so a spinning disk is not made to
+    seek between them. At most `limit` bytes are held, plus one chunk of
+    the file being sent; a limit of 0 turns reading ahead off. Files the
+    sender passes over, e.g. when skipped on resume, are dropped.
+    """
+
+    def __init__(self, limit=READ_AHEAD_LIMIT, chunk_size=READ_AHEAD_CHUNK_SIZE, workers=READ_AHEAD_WORKERS):
+        self.loop = asyncio.get_running_loop()
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.threads = []
+        self.planned = collections.deque()
+        self.planned_keys = collections.Counter()
+        self.plan = queue.SimpleQueue()
+        self.queues = {}
+        self.budget = threading.Condition()
+        self.held = collections.Counter()
+        self.dropped = -1
+        self.closed = False
+        self.wanted = 0
+        self.reading = set()
+
+    def want(self, file_path, whole=True):
+        """Queue `file_path` to be read into memory, or with `whole` False only opened."""
+        if not self.limit:
+            return
+        if not self.threads:
+            self.threads = [threading.Thread(target=self._run, name='read-ahead', daemon=True)
+                            for _ in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+        self.planned.append((self.wanted, file_path, whole))
+        self.planned_keys[file_path, whole] += 1
+        self.plan.put((self.wanted, file_path, whole))
+        self.wanted += 1
+
+    async def open(self, file_path):
+        """The file object for `file_path`, opened ahead of time if it was wanted."""
+        index = self._find(file_path, whole=False)
+        if index is None:
+            return open(file_path, 'rb')
+        f = await self._next(index)
+        self.release(index, self._charge(f))
+        self.queues.pop(index, None)
+        return f
+
+    async def read(self, file_path):
+        """The whole content of `file_path`, read ahead of time if it was wanted."""
+        index = self._find(file_path, whole=True)
+        if index is None:
+            with open(file_path, 'rb') as f:
+                return await asyncio.to_thread(f.read)
+        chunks = []
+        async for chunk in self._chunks(index):
+            chunks.append(chunk)
+            self.release(index, len(chunk))
+        return b''.join(chunks)
+
+    async def send(self, sock, file_path, offset, count, progress_callback=None, throttle=None):
+        index = None
+        if not offset and count == os.path.getsize(file_path):
+            index = self._find(file_path, whole=True)
+        if index is None:
+            # Not planned, or only part of it is wanted: read it alone
+            return await send_chunks_async(sock, _read_file(file_path, offset, count), progress_callback, throttle)
+        sent = 0
+        async for chunk in self._chunks(index):
+            try:
+                if throttle and throttle.limited():
+                    await throttle.sendall(sock, chunk)
+                else:
+                    await self.loop.sock_sendall(sock, chunk)
+            finally:
+                self.release(index, len(chunk))
+            sent += len(chunk)
+            if progress_callback:
+                progress_callback(sent)
+        if sent != count:
+            raise ConnectionError("File ended before all data was sent.")
+        return sent
+
+    def release(self, index, size):
+        with self.budget:
+            self.held[index] -= size
+            if self.held[index] <= 0:
+                del self.held[index]
+            self.budget.notify_all()
+
+    def close(self):
+        with self.budget:
+            self.closed = True
+            self.budget.notify_all()
+        for _ in self.threads:
+            self.plan.put(None)
+        # Anything read or opened ahead that nobody will send
+        for index, items in list(self.queues.items()):
+            while not items.empty():
+                self._discard(index, items.get_nowait())
+        self.queues = {}
+
+    async def _chunks(self, index):
+        try:
+            while True:
+                item = await self._next(index)
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            self.queues.pop(index, None)
+
+    def _find(self, file_path, whole):
+        if not self.planned_keys[file_path, whole]:
+            return None
+        # Files planned before this one were passed over by the sender
+        while True:
+            index, path, planned_whole = self.planned.popleft()
+            self.planned_keys[path, planned_whole] -= 1
+            if path == file_path and planned_whole == whole:
+                self._drop_below(index)
+                return index
+
+    def _drop_below(self, index):
+        with self.budget:
+            self.dropped = index - 1
+            self.budget.notify_all()
+        for stale in [stale for stale in self.queues if stale < index]:
+            items = self.queues.pop(stale)
+            while not items.empty():
+                self._discard(stale, items.get_nowait())
+
+    def _queue(self, index):
+        if index not in self.queues:
+            self.queues[index] = asyncio.Queue()
+        return self.queues[index]
+
+    async def _next(self, index):
+        item = await self._queue(index).get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def _deliver(self, index, item):
+        # On the event loop: items of dropped files are let go at once
+        if self.closed or index <= self.dropped:
+            self._discard(index, item)
+        else:
+            self._queue(index).put_nowait(item)
+
+    def _discard(self, index, item):
+        if isinstance(item, (bytes, bytearray)):
+            self.release(index, len(item))
+        elif hasattr(item, 'close'):
+            self.release(index, self._charge(item))
+            item.close()
+
+    def _charge(self, f):
+        # An open file counts as its read-ahead window, and at least 1/64 of
+        # the budget so that no more than 64 are held open
+        return max(min(os.fstat(f.fileno()).st_size, SENDFILE_CHUNK_SIZE), self.limit // 64)
+
+    def _post(self, index, item):
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, index, item)
+        except RuntimeError:
+            # The sender's loop is gone
+            if hasattr(item, 'close'):
+                item.close()
+
+    def _reserve(self, index, size, first=True):
+        """Wait for room in the budget; False once the file is no longer wanted."""
+        with self.budget:
+            while not self.closed and index > self.dropped:
+                current = index == self.dropped + 1
+                # Past its first chunk a file waits for the ones before it to be read
+                in_order = first or current or min(self.reading) == index
+                # The file being sent may always have one chunk in flight, so it never waits on later ones
+                if in_order and (sum(self.held.values()) + size <= self.limit or current and not self.held[index]):
+                    self.held[index] += size
+                    return True
+                self.budget.wait()
+            return False
+
+    def _run(self):
+        while True:
+            entry = self.plan.get()
+            if entry is None or self.closed:
+                return
+            index, file_path, whole = entry
+            with self.budget:
+                self.reading.add(index)
+            try:
+                if index > self.dropped:
+                    self._prepare(index, file_path, whole)
+            finally:
+                with self.budget:
+                    self.reading.discard(index)
+                    self.budget.notify_all()
+
+    def _prepare(self, index, file_path, whole):
+        try:
+            f = open(file_path, 'rb')
+            size = os.fstat(f.fileno()).st_size
+        except OSError as e:
+            self._post(index, e)
+            return
+        if not whole:
+            if not self._reserve(index, self._charge(f)):
+                f.close()
+                return
+            _advise(f, 0, 0, _SEQUENTIAL)
+            _advise(f, 0, min(size, SENDFILE_CHUNK_SIZE), _WILLNEED)
+            self._post(index, f)
+            return
+        with f:
+            self._read_into_queue(index, f, size)
+
+    def _read_into_queue(self, index, f, size):
+        remaining = size
+        try:
+            while remaining > 0:
+                wanted = min(self.chunk_size, remaining)
+                if not self._reserve(index, wanted, first=remaining == size):
+                    return
+                chunk = f.read(wanted)
+                if len(chunk) < wanted:
+                    self.release(index, wanted - len(chunk))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self._post(index, chunk)
+        except OSError as e:
+            self._post(index, e)
+            return
+        self._post(index, _DONE)
+
+
+_END_OF_STREAM = object()
+
+
+async def send_chunks_async(sock, chunks, progress_callback=None, throttle=None):
+    """Send every bytes-like object yielded by the `chunks` iterable.
+
+    The next chunk is produced (read, encrypted) on an executor thread
+    while the current one is being sent. Returns the bytes sent.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(chunks)
+    pending = loop.run_in_executor(None, next, iterator, _END_OF_STREAM)
+    sent = 0
+    try:
+        while True:
+            chunk = await pending
+            if chunk is _END_OF_STREAM:
+                break
+            pending = loop.run_in_executor(None, next, iterator, _END_OF_STREAM)
+            if throttle and throttle.limited():
+                await throttle.sendall(sock, chunk)
+            else:
+                await loop.sock_sendall(sock, chunk)
+            sent += len(chunk)
+            if progress_callback:
+                progress_callback(sent)
+    finally:
+        # Never leave the generator running on its thread behind us
+        if not pending.done():
+            await asyncio.wait([pending])
+    return sent
+
+
+
+# Receive side: one reusable buffer per worker instead of a bytes object per recv()
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+MIN_RECEIVE_BUFFER_SIZE = 64 * 1024
+MAX_RECEIVE_BUFFER_SIZE = 64 * 1024 * 1024
+# Bytes moved per splice() call, and the pipe size we ask the kernel for
+SPLICE_CHUNK_SIZE = 1024 * 1024
+
+HAS_FALLOCATE = hasattr(os, 'posix_fallocate')
+HAS_SPLICE = hasattr(os, 'splice')
+HAS_PWRITE = hasattr(os, 'pwrite')
+
+
+def recv_exact(sock, size, allow_eof=False):
+    """Read exactly `size` bytes from `sock`.
+
+    Short reads are retried until the full amount arrived. With `allow_eof`
+    an orderly close before the first byte returns b'' instead of raising.
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            if allow_eof and received == 0:
+                return b''
+            raise ConnectionError("Connection closed before data was completely received.")
+        received += n
+    return bytes(data)
+
+
+def allocate_receive_buffer(size=RECEIVE_BUFFER_SIZE):
+    size = max(MIN_RECEIVE_BUFFER_SIZE, min(int(size), MAX_RECEIVE_BUFFER_SIZE))
+    return memoryview(bytearray(size))
+
+
+def preallocate_file(f, size):
+    """Reserve `size` bytes for `f` up front so the filesystem can lay it out contiguously."""
+    if not HAS_FALLOCATE or size <= 0:
+        return False
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+        return True
+    except OSError as e:
+        # Filesystems such as some network mounts do not support it
+        logger.debug("posix_fallocate not supported here: %s", e)
+        return False
+
+
+async def recv_exact_async(sock, size, allow_eof=False):
+    """recv_exact() for a non-blocking socket on the running event loop."""
+    loop = asyncio.get_running_loop()
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = await loop.sock_recv_into(sock, view[received:])
+        if not n:
+            if allow_eof and received == 0:
+                return b''
+            raise ConnectionError("Connection closed before data was completely received.")
+        received += n
+    return bytes(data)
+
+
+async def receive_file_data_async(sock, f, size, buffer, progress_callback=None, use_splice=False,
+                                  data_callback=None, write_behind=None):
+    """Receive `size` bytes from the non-blocking `sock` into the open binary file `f`.
+
+    `buffer` is a memoryview from allocate_receive_buffer() and is reused for
+    every file. Data is gathered with recv_into() until the buffer is full
+    and then written with a single write() call. When `use_splice` is set and
+    the platform supports it, data is moved socket -> pipe -> file inside the
+    kernel instead. With a `write_behind` the writes happen on its thread
+    and may still be pending on return; see WriteBehind.flush().
+    `progress_callback` gets the bytes received so far, or written so far
+    with a `write_behind`; `data_callback` gets every block before it is
+    written and rules out splice.
+    """
+    received = 0
+    try:
+        if use_splice and HAS_SPLICE and not data_callback:
+            received = await _receive_with_splice(sock, f, size, progress_callback)
+        elif write_behind:
+            received = await write_behind.receive(sock, f, size, progress_callback, data_callback)
+        else:
+            received = await _receive_buffered(sock, f, size, buffer, progress_callback, data_callback)
+    finally:
+        if received < size:
+            # Do not leave a preallocated tail of zeroes behind a failed transfer
+            f.flush()
+            f.truncate(f.tell())
+    return received
+
+
+async def _receive_buffered(sock, f, size, buffer, progress_callback, data_callback=None):
+    loop = asyncio.get_running_loop()
+    received = 0
+    capacity = len(buffer)
+    while received < size:
+        filled = 0
+        wanted = min(capacity, size - received)
+        try:
+            while filled < wanted:
+                n = await loop.sock_recv_into(sock, buffer[filled:wanted])
+                if not n:
+                    raise ConnectionError("Connection lost during file reception.")
+                filled += n
+        finally:
+            if filled:
+                if data_callback:
+                    data_callback(buffer[:filled])
+                f.write(buffer[:filled])
+                received += filled
+        if progress_callback:
+            progress_callback(received)
+    return received
+
+
+# Bytes of received data a WriteBehind holds while they wait for the disk
+WRITE_BEHIND_LIMIT = 16 * 1024 * 1024
+
+
+def _write_at(f, offset, data):
+    if HAS_PWRITE:
+        fd = f.fileno()
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+
+
+class WriteBehind:
+    """Writes received data to disk on a helper thread while the socket keeps being read.
+
+    Data is received into one of a pool of reusable buffers, which goes to
+    the writer thread and comes back to the pool once written. Receiving
+    only waits when every buffer is still queued for the disk, so a slow
+    destination (a USB stick, a network share) no longer stalls the socket
+    on each write. Writes go to absolute offsets and may still be pending
+    when receive() returns; flush() waits for those of one file and raises
+    the first write that failed. Where os.pwrite() is missing, receive()
+    flushes before returning since the writer moves the file position.
+    """
+
+    def __init__(self, limit=WRITE_BEHIND_LIMIT, buffer_size=RECEIVE_BUFFER_SIZE):
+        self.buffer_size = max(MIN_RECEIVE_BUFFER_SIZE, min(int(buffer_size), MAX_RECEIVE_BUFFER_SIZE))
+        self.count = max(2, limit // self.buffer_size)
+        self.allocated = 0
+        self.free = []
+        self.loop = None
+        self.thread = None
+        self.jobs = queue.SimpleQueue()
+        self.released = None
+        self.pending = collections.Counter()
+        self.errors = {}
+        self.waiters = {}
+
+    async def receive(self, sock, f, size, progress_callback=None, data_callback=None):
+        self._start()
+        # The writer works on the descriptor; nothing may wait in the file object's own buffer
+        f.flush()
+        offset = f.tell()
+        received = written = 0
+
+        def on_written(n):
+            nonlocal written
+            written += n
+            if progress_callback:
+                progress_callback(written)
+
+        try:
+            while received < size:
+                buffer = await self._acquire()
+                filled = 0
+                wanted = min(len(buffer), size - received)
+                try:
+                    while filled < wanted:
+                        n = await self.loop.sock_recv_into(sock, buffer[filled:wanted])
+                        if not n:
+                            raise ConnectionError("Connection lost during file reception.")
+                        filled += n
+                finally:
+                    self._submit(f, offset + received, buffer, filled, data_callback, on_written)
+                    received += filled
+            if not HAS_PWRITE:
+                await self.flush(f)
+        except BaseException:
+            # What did reach the disk stays; the caller truncates behind it
+            try:
+                await self.flush(f)
+            except Exception:
+                pass
+            f.seek(offset + written)
+            raise
+        return received
+
+    async def flush(self, f):
+        """Wait until every write to `f` is done; raises the first that failed."""
+        while self.pending[f]:
+            waiter = self.loop.create_future()
+            self.waiters.setdefault(f, []).append(waiter)
+            await waiter
+        error = self.errors.pop(f, None)
+        if error:
+            raise error
+
+    async def drain(self):
+        """Wait for the writes to every file, dropping their errors."""
+        for f in list(self.pending):
+            try:
+                await self.flush(f)
+            except Exception as e:
+                logger.debug("Write behind failed: %s", e)
+        self.errors = {}
+
+    def close(self):
+        if self.thread:
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def _start(self):
+        if self.thread is None:
+            self.loop = asyncio.get_running_loop()
+            self.released = asyncio.Event()
+            self.thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self.thread.start()
+
+    async def _acquire(self):
+        while not self.free:
+            if self.allocated < self.count:
+                self.allocated += 1
+                return allocate_receive_buffer(self.buffer_size)
+            # Every buffer waits for the disk: this is where a slow destination pushes back
+            self.released.clear()
+            await self.released.wait()
+        return self.free.pop()
+
+    def _submit(self, f, offset, buffer, length, data_callback, written_callback):
+        if not length:
+            self._release(buffer)
+            return
+        self.pending[f] += 1
+        self.jobs.put((f, offset, buffer, length, data_callback, written_callback))
+
+    def _release(self, buffer):
+        self.free.append(buffer)
+        self.released.set()
+
+    def _done(self, f, buffer, length, error, written_callback):
+        self._release(buffer)
+        if error:
+            self.errors.setdefault(f, error)
+        else:
+            written_callback(length)
+        self.pending[f] -= 1
+        if not self.pending[f]:
+            del self.pending[f]
+            for waiter in self.waiters.pop(f, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            f, offset, buffer, length, data_callback, written_callback = job
+            error = None
+            try:
+                if data_callback:
+                    data_callback(buffer[:length])
+                _write_at(f, offset, buffer[:length])
+            except (OSError, ValueError) as e:
+                error = e
+            try:
+                self.loop.call_soon_threadsafe(self._done, f, buffer, length, error, written_callback)
+            except RuntimeError:
+                # The receiver's loop is gone
+                pass
+
+
+async def _wait_readable(sock):
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    loop.add_reader(sock.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+async def _receive_with_splice(sock, f, size, progress_callback):
+    f.flush()
+    file_fd = f.fileno()
+    offset = f.tell()
+    read_fd, write_fd = os.pipe()
+    try:
+        try:
+            import fcntl
+            fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, SPLICE_CHUNK_SIZE)
+        except (ImportError, AttributeError, OSError):
+            pass
+        received = 0
+        while received < size:
+            try:
+                n = os.splice(sock.fileno(), write_fd, min(SPLICE_CHUNK_SIZE, size - received))
+            except BlockingIOError:
+                await _wait_readable(sock)
+                continue
+            if not n:
+                raise ConnectionError("Connection lost during file reception.")
+            pending = n
+            while pending:
+                written = os.splice(read_fd, file_fd, pending, offset_dst=offset)
+                offset += written
+                pending -= written
+            received += n
+            if progress_callback:
+                progress_callback(received)
+        return received
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+        f.seek(offset)
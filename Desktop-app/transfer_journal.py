@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import time
+from constant import log_dir, logger
+
+# Journals live next to the log file, one JSON file per transfer ID
+JOURNAL_DIR = os.path.join(log_dir, 'journal')
+# Minimum seconds between journal writes while a file is streaming in
+JOURNAL_FLUSH_INTERVAL = 1.0
+# Journals of transfers that were never resumed are dropped after this long
+JOURNAL_MAX_AGE = 7 * 24 * 3600
+
+
+def make_transfer_id(peer, file_paths):
+    """Stable ID for a batch: the same selection sent again maps to the same journal."""
+    entries = []
+    for path in file_paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    stat = os.stat(file_path)
+                    entries.append([os.path.relpath(file_path, path), stat.st_size, int(stat.st_mtime)])
+            entries.append([path, 'dir'])
+        else:
+            stat = os.stat(path)
+            entries.append([path, stat.st_size, int(stat.st_mtime)])
+    digest = hashlib.sha256(json.dumps([peer, entries]).encode()).hexdigest()
+    return digest[:32]
+
+
+class TransferJournal:
+    """Per-transfer record of which files reached the receiver and how far.
+
+    Layout on disk:
+        {"destination_folder": str | null,
+         "files": {wire name: {"path": str, "size": int, "received": int, "encrypted": bool}}}
+    """
+
+    def __init__(self, transfer_id, directory=JOURNAL_DIR):
+        if not transfer_id or not all(c in '0123456789abcdef' for c in transfer_id):
+            raise ValueError(f"Invalid transfer id: {transfer_id!r}")
+        self.transfer_id = transfer_id
+        self.path = os.path.join(directory, transfer_id + '.json')
+        self.destination_folder = None
+        self.files = {}
+        self._last_flush = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self._drop_stale(directory)
+        self._load()
+
+    def _drop_stale(self, directory):
+        cutoff = time.time() - JOURNAL_MAX_AGE
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.destination_folder = data.get('destination_folder')
+            self.files = data.get('files', {})
+            logger.info("Loaded journal for transfer %s with %d files", self.transfer_id, len(self.files))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable journal %s: %s", self.path, e)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'destination_folder': self.destination_folder, 'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+        self._last_flush = time.monotonic()
+
+    def _maybe_save(self):
+        if time.monotonic() - self._last_flush >= JOURNAL_FLUSH_INTERVAL:
+            self.save()
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def set_destination(self, folder):
+        self.destination_folder = folder
+        self.save()
+
+    def existing_destination(self):
+        if self.destination_folder and os.path.isdir(self.destination_folder):
+            return self.destination_folder
+        return None
+
+    def path_for(self, name, size):
+        """Where an earlier attempt stored `name`, if it was the same size."""
+        entry = self.files.get(name)
+        if entry and entry['size'] == size:
+            return entry['path']
+        return None
+
+    def offsets(self):
+        """[bytes already on disk, expected size] for every journaled file, checked against the file itself."""
+        result = {}
+        for name, entry in self.files.items():
+            try:
+                on_disk = os.path.getsize(entry['path'])
+            except OSError:
+                continue
+            result[name] = [min(entry['received'], on_disk, entry['size']), entry['size']]
+        return result
+
+    def start_file(self, name, path, size, received=0, encrypted=False):
+        self.files[name] = {'path': path, 'size': size, 'received': received, 'encrypted': encrypted}
+        self._maybe_save()
+
+    def encrypted_paths(self):
+        return [entry['path'] for entry in self.files.values() if entry.get('encrypted')]
+
+    def update(self, name, received):
+        self.files[name]['received'] = received
+        self._maybe_save()
+
+    def complete_file(self, name):
+        entry = self.files[name]
+        entry['received'] = entry['size']
+        self._maybe_save()